@@ -16,10 +16,10 @@ import ipdb
 import time
 from bs4 import BeautifulSoup
 
-from dbmanager.dbManager.base_dm_sql import BaseDMsql
+from dbmanager.bulk_dm_sql import BulkDMsql
 
 
-class FISmanager(BaseDMsql):
+class FISmanager(BulkDMsql):
 
     def createDBschema(self):
         """
@@ -0,0 +1,200 @@
+"""
+Compact index from Semantic Scholar paper identifiers to paperIDs
+
+Semantic Scholar identifies papers with 40 character hexadecimal strings
+(SHA1 digests). The index keeps the 20-byte binary digests in a sorted
+array, next to a parallel array with the paperID of each paper in table
+S2papers. Both arrays are saved as .npy files that are memory-mapped
+when the index is opened, so that the pages are shared by all processes
+using the index (e.g., the workers of a multiprocessing Pool created
+after the index has been opened) and only loaded in memory when needed.
+
+Lookups are vectorized: a list of S2paperIDs is converted into an array
+of digests, and located in the sorted array with a binary search.
+
+"""
+
+import os
+import glob
+import numpy as np
+
+
+def to_digests(S2paperIDs):
+    """Converts a list of S2paperIDs into an array of 20-byte digests
+    :param S2paperIDs: List of strings
+
+    Returns:
+    A tuple with the array of digests, and a boolean array indicating which
+    identifiers are valid 40 character hexadecimal strings (the digest of
+    invalid identifiers is meaningless)
+    """
+    if all(len(el) == 40 for el in S2paperIDs):
+        try:
+            digests = np.frombuffer(bytes.fromhex(''.join(S2paperIDs)), dtype='S20')
+            return digests, np.ones(len(S2paperIDs), dtype=bool)
+        except ValueError:
+            pass
+
+    digests = np.zeros(len(S2paperIDs), dtype='S20')
+    valid = np.zeros(len(S2paperIDs), dtype=bool)
+    for idx, el in enumerate(S2paperIDs):
+        if len(el) == 40:
+            try:
+                digests[idx] = bytes.fromhex(el)
+                valid[idx] = True
+            except ValueError:
+                pass
+
+    return digests, valid
+
+
+class S2index(object):
+
+    """Memory-mapped index from S2paperID to paperID
+    ====================================================
+    Public methods:
+    - build: Creates the index files from (S2paperID, paperID) pairs
+    - add_part, merge_parts: Create the index files from parts that are
+                             saved as the (S2paperID, paperID) pairs
+                             become available
+    - exists: Checks if the index files are available
+    - remove: Deletes the index files
+    - lookup: Returns the paperIDs corresponding to a list of S2paperIDs
+    - lookup_digests: Same as lookup, for S2paperIDs converted with to_digests
+    =====================================================
+    """
+
+    def __init__(self, index_file):
+        """
+        Opens an existing index
+        :param index_file: Path of the index. The index is stored in files
+                           index_file.keys.npy and index_file.ids.npy
+        """
+        self._keys = np.load(index_file + '.keys.npy', mmap_mode='r')
+        self._ids = np.load(index_file + '.ids.npy', mmap_mode='r')
+
+    def __len__(self):
+        return len(self._keys)
+
+    @staticmethod
+    def exists(index_file):
+        """Returns True if the files of the index are available"""
+        return (os.path.isfile(index_file + '.keys.npy') and
+                os.path.isfile(index_file + '.ids.npy'))
+
+    @staticmethod
+    def remove(index_file):
+        """Deletes the files of the index, and any parts saved with
+        add_part, if they exist"""
+        for fname in ([index_file + '.keys.npy', index_file + '.ids.npy'] +
+                      glob.glob(index_file + '.part*.npy')):
+            if os.path.isfile(fname):
+                os.remove(fname)
+
+    @staticmethod
+    def build(index_file, chunks):
+        """Creates the index files
+        :param index_file: Path of the index
+        :param chunks: Iterable over pairs of lists (S2paperIDs, paperIDs)
+
+        Returns:
+        The number of papers in the index
+        """
+        def digest_chunks():
+            for S2paperIDs, paperIDs in chunks:
+                digests, valid = to_digests(S2paperIDs)
+                yield digests[valid], np.asarray(paperIDs, dtype=np.uint32)[valid]
+
+        return S2index._save(index_file, digest_chunks())
+
+    @staticmethod
+    def add_part(index_file, part, S2paperIDs, paperIDs):
+        """Saves part of the (S2paperID, paperID) pairs of an index that
+        is being generated (e.g., the papers in one data file). Once all
+        parts have been saved, the index is created with merge_parts
+        :param index_file: Path of the index
+        :param part: Integer identifying the part
+        :param S2paperIDs: List of S2paperIDs
+        :param paperIDs: List with the corresponding paperIDs
+        """
+        digests, valid = to_digests(S2paperIDs)
+        np.save(index_file + '.part%05d.keys.npy' % part, digests[valid])
+        np.save(index_file + '.part%05d.ids.npy' % part,
+                np.asarray(paperIDs, dtype=np.uint32)[valid])
+
+    @staticmethod
+    def merge_parts(index_file):
+        """Creates the index files from all parts saved with add_part,
+        and removes the parts
+
+        Returns:
+        The number of papers in the index
+        """
+        parts = sorted(glob.glob(index_file + '.part*.keys.npy'))
+
+        def digest_chunks():
+            for fname in parts:
+                yield np.load(fname), np.load(fname.replace('.keys.npy', '.ids.npy'))
+
+        npapers = S2index._save(index_file, digest_chunks())
+        for fname in parts:
+            os.remove(fname)
+            os.remove(fname.replace('.keys.npy', '.ids.npy'))
+
+        return npapers
+
+    @staticmethod
+    def _save(index_file, chunks):
+        """Sorts and saves the index
+        :param chunks: Iterable over pairs of arrays (digests, paperIDs)
+        """
+        all_keys = []
+        all_ids = []
+        for digests, paperIDs in chunks:
+            all_keys.append(digests)
+            all_ids.append(paperIDs)
+
+        if len(all_keys):
+            keys = np.concatenate(all_keys)
+            ids = np.concatenate(all_ids)
+        else:
+            keys = np.zeros(0, dtype='S20')
+            ids = np.zeros(0, dtype=np.uint32)
+        del all_keys, all_ids
+
+        order = np.argsort(keys, kind='stable')
+        np.save(index_file + '.keys.npy', keys[order])
+        np.save(index_file + '.ids.npy', ids[order])
+
+        return len(keys)
+
+    def lookup(self, S2paperIDs):
+        """Returns the paperIDs corresponding to a list of S2paperIDs
+        :param S2paperIDs: List of strings
+
+        Returns:
+        A numpy array of paperIDs (uint32). Papers that are not in the
+        index get paperID 0
+        """
+        return self.lookup_digests(*to_digests(S2paperIDs))
+
+    def lookup_digests(self, digests, valid=None):
+        """Returns the paperIDs corresponding to an array of digests
+        :param digests: Array of 20-byte digests (see to_digests)
+        :param valid: Boolean array indicating the valid digests. If None,
+                      all digests are considered valid
+
+        Returns:
+        A numpy array of paperIDs (uint32). Papers that are not in the
+        index get paperID 0
+        """
+        if not len(digests) or not len(self._keys):
+            return np.zeros(len(digests), dtype=np.uint32)
+
+        pos = np.searchsorted(self._keys, digests)
+        pos = np.minimum(pos, len(self._keys) - 1)
+        found = self._keys[pos] == digests
+        if valid is not None:
+            found &= valid
+
+        return np.where(found, self._ids[pos], 0).astype(np.uint32)
@@ -0,0 +1,110 @@
+"""
+Interning of dimension values (venues, journals, fields of study and
+entities) found in the Semantic Scholar corpus
+
+Each value receives a stable integer ID the first time it is found, so
+that the rows relating papers with venues, journals, fields and entities
+can be generated while the papers are being read, without waiting until
+all data files have been processed.
+
+When the corpus is processed by a multiprocessing Pool, a single
+Interner lives in a manager process and is shared by all workers through
+a proxy. Each worker wraps the proxy in a CachedInterner, so that only
+values not seen before by the worker need to be sent to the manager.
+
+"""
+
+import threading
+from multiprocessing.managers import BaseManager
+
+
+class Interner(object):
+
+    """Assigns consecutive integer IDs, starting at 1, to the values of
+    each dimension, in the order in which they are found
+    ====================================================
+    Public methods:
+    - intern: Returns the IDs of a list of values, assigning new IDs
+              to values that had not been found before
+    - items: Returns all (value, ID) pairs of a dimension
+    - load: Adds (value, ID) pairs assigned in a previous execution
+    =====================================================
+    """
+
+    def __init__(self):
+        self._values = {}
+        #Calls from different workers are served by different threads
+        #of the manager process
+        self._lock = threading.Lock()
+
+    def intern(self, dimension, values):
+        """Returns the IDs of a list of values
+        :param dimension: Name of the dimension (e.g., 'S2venues')
+        :param values: List of values
+        """
+        with self._lock:
+            table = self._values.setdefault(dimension, {})
+            ids = []
+            for el in values:
+                if el not in table:
+                    table[el] = len(table) + 1
+                ids.append(table[el])
+
+        return ids
+
+    def items(self, dimension, since=0):
+        """Returns a list with the (value, ID) pairs of a dimension,
+        sorted by ID
+        :param dimension: Name of the dimension
+        :param since: Only pairs with ID larger than since are returned
+        """
+        with self._lock:
+            return sorted([el for el in self._values.get(dimension, {}).items() if el[1] > since],
+                          key=lambda el: el[1])
+
+    def load(self, dimension, items):
+        """Adds (value, ID) pairs to a dimension. New values will receive
+        IDs larger than all loaded IDs
+        :param dimension: Name of the dimension
+        :param items: List of (value, ID) pairs
+        """
+        with self._lock:
+            table = self._values.setdefault(dimension, {})
+            table.update(items)
+            #Keep len(table) + 1 as the next free ID
+            if len(table) and max(table.values()) != len(table):
+                raise ValueError('IDs of dimension ' + dimension + ' are not consecutive')
+
+
+class InternManager(BaseManager):
+    """Manager for sharing an Interner among processes"""
+    pass
+
+InternManager.register('Interner', Interner)
+
+
+class CachedInterner(object):
+
+    """Wrapper for a (shared) Interner that keeps a local copy of the
+    IDs that have already been obtained
+    """
+
+    def __init__(self, interner):
+        """
+        :param interner: Interner or proxy to a shared Interner
+        """
+        self._interner = interner
+        self._cache = {}
+
+    def intern(self, dimension, values):
+        """Returns the IDs of a list of values (see Interner.intern)"""
+        cache = self._cache.setdefault(dimension, {})
+        missing = list(set([el for el in values if el not in cache]))
+        if len(missing):
+            cache.update(zip(missing, self._interner.intern(dimension, missing)))
+
+        return [cache[el] for el in values]
+
+    def items(self, dimension, since=0):
+        """Returns (value, ID) pairs of a dimension (see Interner.items)"""
+        return self._interner.items(dimension, since)
@@ -9,19 +9,29 @@ Created on Jul 7 2019
 """
 
 import os
+import glob
+import json
+import hashlib
 import pandas as pd
 import numpy as np
 from tqdm import *
-import gzip
-import json
 import ipdb
 import time
 import langid
+import queue
+import threading
 #from utils import get_size
-from collections import Counter
-from multiprocessing import Pool
-
-from dbmanager.dbManager.base_dm_sql import BaseDMsql
+from collections import Counter, deque
+from multiprocessing import Pool, Queue
+
+from dbmanager.bulk_dm_sql import BulkDMsql, sql_tablename
+from dbmanager.S2reader import list_S2files, read_S2batches, read_S2blocks, file_checksum, \
+                               decode_S2lines
+from dbmanager.S2index import S2index, to_digests
+from dbmanager.S2interner import Interner, InternManager, CachedInterner
+from dbmanager.column_batch import ColumnBatch, SharedBatch
+from dbmanager.S2parquet import ParquetSink, pq
+from dbmanager.S2sort import RunSpool
 
 import re
 
@@ -32,6 +42,50 @@ except re.error:
     # UCS-2
     regex = re.compile('[\uD800-\uDBFF][\uDC00-\uDFFF]')
 
+#Columns of table S2papers filled in by process_papers, in the same order
+papers_columns = ['S2paperID', 'title', 'lowertitle', 'paperAbstract', 'entities',
+                  'fieldsOfStudy', 's2PdfUrl', 'pdfUrls', 'year', 'journalVolume',
+                  'journalPages', 'isDBLP', 'isMedline', 'doi', 'doiUrl', 'pmid',
+                  'contentHash']
+
+#Year of the papers without year in the batches built by process_papers. It
+#is replaced by 0 if S2papers is partitioned by year (see S2manager._fillYears)
+missing_year = 9999
+
+#Types of the numeric columns of table S2papers in the batches built by
+#process_papers. All other columns are strings
+papers_dtypes = {'paperID': np.int64, 'year': np.int32, 'isDBLP': np.int8,
+                 'isMedline': np.int8}
+
+#Fields of the paper records included in the content hash (see content_hash).
+#Fields that are not imported, such as inCitations, are excluded, since they
+#change in every release
+hash_fields = ['title', 'paperAbstract', 'entities', 'fieldsOfStudy', 's2PdfUrl',
+               'pdfUrls', 'year', 'journalVolume', 'journalPages', 'sources', 'doi',
+               'doiUrl', 'pmid', 'venue', 'journalName', 'outCitations', 'authors']
+
+#Tables relating papers with other elements. For each of them we indicate the
+#column that stores the related element and, if the element is referenced by
+#name in the data files, the dimension table and the column with the name
+link_tables = {
+    'citations': ['paperID2', None, None],
+    'paperAuthor': ['authorID', None, None],
+    'paperField': ['fieldID', 'S2fields', 'fieldName'],
+    'paperVenue': ['venueID', 'S2venues', 'venueName'],
+    'paperJournal': ['journalID', 'S2journals', 'journalName'],
+    'paperEntity': ['entityID', 'S2entities', 'entityName']
+    }
+
+#Tables relating each paper with a single element. In the lean schema profile
+#(see S2manager.schema_profile) they are not created, and the element is stored
+#in a column of table S2papers with the name of the column of the table
+folded_tables = ['paperVenue', 'paperJournal']
+
+#When paperIDs are assigned during the import (assignIDs option), the
+#papers in the n-th data file (in alphabetical order) get consecutive
+#paperIDs starting at n * ids_per_file + 1
+ids_per_file = 2**21
+
 """Some functions need to be defined outside the class for allowing 
    parallel processing of the Semantic Scholar files. It is necessary
    to do so to make pickle serialization work"""
@@ -41,318 +95,2156 @@ def ElementInList(source_list, search_string):
     else:
         return 0
 
+def content_hash(paperEntry):
+    """Returns the MD5 digest (hexadecimal string) of the fields of a paper
+    that are imported in the database (see hash_fields)
+    """
+    content = json.dumps([paperEntry.get(el) for el in hash_fields], sort_keys=True)
+    return hashlib.md5(content.encode('utf8')).hexdigest()
+
+def process_papers(papers, firstID=None):
+    """Takes a list of dictionaries with paper information as input, and
+    returns a ColumnBatch with the rows to insert in S2papers (columns
+    papers_columns). The values of each column are extracted at once, so
+    no list is built for each paper
+    :param firstID: If not None, paperIDs are assigned to the papers in the
+                    list, starting at firstID, in column paperID (the first
+                    column of the batch)
+    """
+    batch = ColumnBatch.from_lists(papers_columns, [
+                [el['id'] for el in papers],
+                [regex.sub(' ', el['title']) for el in papers],
+                [regex.sub(' ', el['title'].lower()) for el in papers],
+                [regex.sub(' ', el['paperAbstract']) for el in papers],
+                ['\t'.join(el['entities']) for el in papers],
+                ['\t'.join(el['fieldsOfStudy']) for el in papers],
+                [el['s2PdfUrl'] for el in papers],
+                ['\t'.join(el['pdfUrls']) for el in papers],
+                [el['year'] if 'year' in el else missing_year for el in papers],
+                [el['journalVolume'].strip() for el in papers],
+                [el['journalPages'].strip() for el in papers],
+                [ElementInList(el['sources'], 'DBLP') for el in papers],
+                [ElementInList(el['sources'], 'Medline') for el in papers],
+                [el['doi'] for el in papers],
+                [el['doiUrl'] for el in papers],
+                [el['pmid'] for el in papers],
+                [content_hash(el) for el in papers]
+                ], papers_dtypes)
+    if firstID is not None:
+        batch = batch.with_column('paperID', np.arange(firstID, firstID + len(papers)),
+                                  papers_dtypes['paperID'])
+
+    return batch
+
 def process_paper(paperEntry):
     """This function takes a dictionary with paper information as input
-    and returns a list to insert in S2papers
-    """
-    if 'year' in paperEntry.keys():
-        paper_list = [paperEntry['id'],
-                          regex.sub(' ', paperEntry['title']),
-                          regex.sub(' ', paperEntry['title'].lower()),
-                          regex.sub(' ', paperEntry['paperAbstract']),
-                          '\t'.join(paperEntry['entities']),
-                          '\t'.join(paperEntry['fieldsOfStudy']),
-                          paperEntry['s2PdfUrl'],
-                          '\t'.join(paperEntry['pdfUrls']),
-                          paperEntry['year'],
-                          paperEntry['journalVolume'].strip(),
-                          paperEntry['journalPages'].strip(),
-                          ElementInList(paperEntry['sources'], 'DBLP'),
-                          ElementInList(paperEntry['sources'], 'Medline'),
-                          paperEntry['doi'],
-                          paperEntry['doiUrl'],
-                          paperEntry['pmid']
-                          ]
-    else:
-        paper_list = [paperEntry['id'],
-                          regex.sub(' ', paperEntry['title']),
-                          regex.sub(' ', paperEntry['title'].lower()),
-                          regex.sub(' ', paperEntry['paperAbstract']),
-                          '\t'.join(paperEntry['entities']),
-                          '\t'.join(paperEntry['fieldsOfStudy']),
-                          paperEntry['s2PdfUrl'],
-                          '\t'.join(paperEntry['pdfUrls']),
-                          9999,
-                          paperEntry['journalVolume'].strip(),
-                          paperEntry['journalPages'].strip(),
-                          ElementInList(paperEntry['sources'], 'DBLP'),
-                          ElementInList(paperEntry['sources'], 'Medline'),
-                          paperEntry['doi'],
-                          paperEntry['doiUrl'],
-                          paperEntry['pmid']
-                          ]
-
-    return paper_list
-
-def process_paperFile(gzfile):
-    """Process Semantic Scholar gzip file, and extract a list of
-    journals, a list of venues, a list of fields of study, and a
-    list wih paper information to save in the S2papers table
+    and returns a list to insert in S2papers (see process_papers)
+    """
+    return list(process_papers([paperEntry]).rows()[0])
+
+def share_rows(rows):
+    """Copies the ColumnBatch values of a dictionary of rows (e.g., the
+    result of process_paperFile) to shared memory (see ColumnBatch.share)
+    """
+    if isinstance(rows, dict):
+        return {key: el.share() if isinstance(el, ColumnBatch) else el
+                for key, el in rows.items()}
+    return rows
+
+def attach_rows(rows):
+    """Retrieves the batches copied to shared memory with share_rows"""
+    if isinstance(rows, dict):
+        return {key: el.attach() if isinstance(el, SharedBatch) else el
+                for key, el in rows.items()}
+    return rows
+
+def first_paperID(fileno):
+    """Returns the paperID of the first paper of the fileno-th data file,
+    when paperIDs are assigned during the import
+    """
+    return fileno * ids_per_file + 1
+
+def check_firstID(firstID, offset, npapers):
+    """Returns the paperID of the first paper of a batch, given the paperID
+    of the first paper of the file and the position of the batch in it.
+    Raises an error if the paperIDs would overlap those of the next file
+    """
+    if (firstID - 1) % ids_per_file + offset + npapers > ids_per_file:
+        raise ValueError('Too many papers in data file for assigning paperIDs. ' +
+                         'Increase ids_per_file in S2manager.py')
+    return firstID + offset
+
+def id_ranges(paperIDs):
+    """Returns the list of (first, last) ranges of consecutive values in
+    an array of paperIDs. Zeros (papers not found) are ignored
+    """
+    paperIDs = np.unique(paperIDs[paperIDs > 0]).astype(np.int64)
+    if not len(paperIDs):
+        return []
+    breaks = np.nonzero(np.diff(paperIDs) > 1)[0]
+    firsts = np.concatenate((paperIDs[:1], paperIDs[breaks + 1]))
+    lasts = np.concatenate((paperIDs[breaks], paperIDs[-1:]))
+
+    return list(zip(firsts.tolist(), lasts.tolist()))
+
+def run_task(task):
+    """Runs a task in a worker of a multiprocessing Pool. If
+    _lookup['shared_memory'] is set, the batches of rows in the result
+    are sent to the parent process through shared memory (see share_rows)
+    Args:
+    :param task: Tuple with a function defined in this module, followed
+                 by the arguments of the function
+    """
+    if _lookup.get('shared_memory'):
+        return share_rows(task[0](*task[1:]))
+    return task[0](*task[1:])
+
+def bounded_imap(pool, tasks, maxpending):
+    """Same as pool.imap(run_task, tasks), but at most maxpending tasks
+    are submitted to the pool before their results are consumed. This
+    limits the memory used by results that are waiting to be written
+    Args:
+    :param pool: multiprocessing Pool
+    :param tasks: Iterable over tasks (see run_task)
+    :param maxpending: Maximum number of submitted tasks whose results
+                       have not been consumed yet
+    """
+    pending = deque()
+    for task in tasks:
+        if len(pending) >= maxpending:
+            yield attach_rows(pending.popleft().get())
+        pending.append(pool.apply_async(run_task, (task,)))
+    while len(pending):
+        yield attach_rows(pending.popleft().get())
+
+def stream_task(task, slot):
+    """Runs in a worker of a multiprocessing Pool a task that yields the
+    rows of a data file in batches (e.g., process_paperFile), putting each
+    batch in a queue as soon as it is extracted, and None once the task
+    has finished. Batches are sent through shared memory if
+    _lookup['shared_memory'] is set (see share_rows)
+    Args:
+    :param task: Tuple with a generator function defined in this module,
+                 followed by the arguments of the function
+    :param slot: Position of the queue for the batches of rows in
+                 _lookup['queues'] (see stream_queues)
+    """
+    batches = _lookup['queues'][slot]
+    try:
+        for rows in task[0](*task[1:]):
+            batches.put(share_rows(rows) if _lookup.get('shared_memory') else rows)
+    finally:
+        batches.put(None)
+
+def stream_batches(batches, slot, result, free):
+    """Yields the batches of rows put in a queue by stream_task, and
+    raises the error of the task, if any, once all of them have been read
+    :param free: Queue with the slots of the queues that are not in use
+                 (see stream_imap). The slot is returned at the end
+    """
+    for rows in iter(batches.get, None):
+        yield attach_rows(rows)
+    free.put(slot)
+    result.get()
+
+def drain_batches(batches):
+    """Reads and discards the remaining batches of an iterator returned by
+    stream_imap. A writer that fails must drain the batches of its file,
+    since otherwise the worker of the task waits forever for the batches
+    to be consumed, and the tasks of the files of the other writers may
+    never start
+    """
+    try:
+        for rows in batches:
+            pass
+    except Exception:
+        #Errors of the task are irrelevant once the writer has failed
+        pass
+
+def stream_queues(maxpending, nwriters, queuesize=2):
+    """Returns the queues for the batches of the tasks of stream_imap.
+    They must be created before the pool, and stored in the _lookup of
+    the workers (see init_worker), so that each batch is only pickled
+    once, when the worker puts it in the queue
+    Args:
+    :param maxpending: See stream_imap
+    :param nwriters: Number of writer threads that consume the iterators
+                     returned by stream_imap (see writeConcurrently)
+    :param queuesize: Maximum number of batches of a task waiting in its
+                      queue. Workers wait while the queue is full, so
+                      neither the workers nor the parent process keep all
+                      the rows of a file
+    """
+    #One queue for each task submitted ahead, and for the tasks waiting in
+    #the queue of writeConcurrently, taken by the writers or about to be
+    #put in the queue
+    return [Queue(queuesize) for el in range(maxpending + 2 * nwriters + 2)]
+
+def stream_imap(pool, queues, tasks, maxpending):
+    """Same as bounded_imap, for tasks that yield the rows of a data file
+    in batches (see stream_task). Instead of the results of each task,
+    an iterator over its batches is returned, so that the batches can be
+    written while the following ones are extracted
+    Args:
+    :param pool: multiprocessing Pool, whose workers have the queues in
+                 _lookup['queues']
+    :param queues: List of queues returned by stream_queues. Each task
+                   uses a queue until all its batches have been read
+    :param tasks: Iterable over tasks (see stream_task)
+    :param maxpending: Number of tasks submitted to the pool ahead of the
+                       task whose batches are being consumed
+    """
+    pending = deque()
+    tasks = iter(tasks)
+    free = queue.Queue()
+    for slot in range(len(queues)):
+        free.put(slot)
+
+    def submit():
+        task = next(tasks, None)
+        if task is not None:
+            slot = free.get()
+            pending.append((slot, pool.apply_async(stream_task, (task, slot))))
+
+    for el in range(maxpending):
+        submit()
+    while len(pending):
+        slot, result = pending.popleft()
+        submit()
+        yield stream_batches(queues[slot], slot, result, free)
+
+def merge_counts(counts, batch_counts):
+    """Adds the number of rows for each table in batch_counts to those in
+    counts (for the summaries returned by workers that write their own
+    rows, see imap_blocks)
+    """
+    if counts is None:
+        return dict(batch_counts)
+    for tablename in batch_counts:
+        counts[tablename] = counts.get(tablename, 0) + batch_counts[tablename]
+
+    return counts
+
+def imap_blocks(pool, blocks, maxpending, merge):
+    """Runs the tasks for the blocks of several files in a multiprocessing
+    Pool (see bounded_imap), and merges the results of the blocks of each
+    file, so that they can be recorded as if the file had been processed
+    by a single task
+    Args:
+    :param pool: multiprocessing Pool
+    :param blocks: Iterable over pairs (key, task). The pairs for the blocks
+                   of a file must be consecutive, and have the same key
+    :param maxpending: Maximum number of submitted tasks whose results
+                       have not been consumed yet
+    :param merge: Function that merges the results of two blocks (e.g.,
+                  merge_counts)
+
+    Yields:
+    Pairs (key, merged results), in the same order as the files
+    """
+    keys = deque()
+
+    def tasks():
+        for key, task in blocks:
+            keys.append(key)
+            yield task
+
+    current = None
+    results = None
+    for block_results in bounded_imap(pool, tasks(), maxpending):
+        key = keys.popleft()
+        if results is not None and key != current:
+            yield current, results
+            results = None
+        current = key
+        results = merge(results, block_results)
+    if results is not None:
+        yield current, results
+
+def queued_blocks(results):
+    """Yields the results put in a queue by stream_blocks, until None is
+    found, and raises the errors put in the queue
+    """
+    for block_results in iter(results.get, None):
+        if isinstance(block_results, Exception):
+            raise block_results
+        yield block_results
+
+def stream_blocks(pool, blocks, maxpending, queuesize=2):
+    """Same as imap_blocks, but instead of merging the results of the blocks
+    of each file, an iterator over them is returned for each file (as in
+    stream_imap), so that the rows of each block are written as soon as
+    they arrive. The results are put in a queue of the file as the
+    iteration goes on, so the iterators must be consumed concurrently
+    (e.g., by the writers of writeConcurrently), and those that are not
+    written must be drained (see drain_batches)
+    Args:
+    :param pool: multiprocessing Pool
+    :param blocks: Iterable over pairs (key, task). The pairs for the blocks
+                   of a file must be consecutive, and have the same key
+    :param maxpending: Maximum number of submitted tasks whose results
+                       have not been consumed yet
+    :param queuesize: Maximum number of results waiting in the queue of
+                      a file
+
+    Yields:
+    Pairs (key, iterator over the results of the blocks), in the same order
+    as the files
+    """
+    keys = deque()
+
+    def tasks():
+        for key, task in blocks:
+            keys.append(key)
+            yield task
+
+    current = None
+    results = None
+    try:
+        for block_results in bounded_imap(pool, tasks(), maxpending):
+            key = keys.popleft()
+            if results is None or key != current:
+                if results is not None:
+                    results.put(None)
+                current = key
+                results = queue.Queue(queuesize)
+                yield key, queued_blocks(results)
+            results.put(block_results)
+    except Exception as e:
+        #The iterator of the file raises the error too, so that the file is
+        #not recorded as if all its blocks had been written
+        if results is not None:
+            results.put(e)
+        raise
+    if results is not None:
+        results.put(None)
+
+def intern_lists(dimension, lists):
+    """Returns the IDs of the values in a list of lists, keeping the
+    structure of the input, using the interner in _lookup
+    """
+    ids = _lookup['interner'].intern(dimension, [el for sublist in lists for el in sublist])
+    result = []
+    pos = 0
+    for sublist in lists:
+        result.append(ids[pos:pos+len(sublist)])
+        pos += len(sublist)
+
+    return result
+
+def range_partitions(lows):
+    """Returns the definitions of consecutive RANGE partitions, one for the
+    values from each lower bound up to the next one, named after its lower
+    bound (e.g., p1990). The last partition holds all larger values
+    :param lows: Sorted list with the lower bounds of the partitions
+    """
+    highs = ['(%d)' % el for el in lows[1:]] + ['MAXVALUE']
+    return ', '.join(['PARTITION p%d VALUES LESS THAN %s' % (low, high)
+                      for low, high in zip(lows, highs)])
+
+def unique_rows(rows):
+    """Returns a list with the rows (as tuples) of a list of rows without
+    duplicates, keeping the first occurrence of each row
+    """
+    return list(dict.fromkeys(map(tuple, rows)))
+
+def process_paperBatch(papers, firstID=None, links=False):
+    """Process a list of Semantic Scholar paper dictionaries, and extract
+    a list of rows to save in the S2papers table. Venues, journals, fields
+    of study and entities of the papers are interned (see S2interner), so
+    that they get their IDs as soon as they are found
+    Args:
+    :param papers: List of dictionaries with paper information
+    :param firstID: If not None, paperIDs are assigned to the papers in
+                    the list, starting at firstID, and included at the
+                    beginning of each row
+    :param links: If True, rows for tables paperField, paperVenue,
+                  paperJournal and paperEntity are also extracted. Papers
+                  are identified by their paperID if firstID is not None,
+                  and by their S2paperID otherwise
+
+    Returns:
+    A dictionary with the list of rows for each table (a ColumnBatch for
+    table S2papers)
+    """
+    # We extract venues, journals, fields and entities IDs. Fields and entities
+    # are lists, since each paper may have several of them
+    venues = _lookup['interner'].intern('S2venues', [el['venue'] for el in papers])
+    journals = _lookup['interner'].intern('S2journals', [el['journalName'] for el in papers])
+    fields = intern_lists('S2fields', [el['fieldsOfStudy'] for el in papers])
+    entities = intern_lists('S2entities', [list(set(el['entities'])) for el in papers])
+
+    # We extract fields for the S2papers table
+    rows = {'S2papers': process_papers(papers, firstID)}
+
+    if links:
+        if firstID is not None:
+            paperIDs = list(range(firstID, firstID + len(papers)))
+        else:
+            paperIDs = [el['id'] for el in papers]
+        rows['paperVenue'] = [[paperID, el] for paperID, el in zip(paperIDs, venues)]
+        rows['paperJournal'] = [[paperID, el] for paperID, el in zip(paperIDs, journals)]
+        rows['paperField'] = [[paperID, el] for paperID, paper_fields in zip(paperIDs, fields)
+                                for el in paper_fields]
+        rows['paperEntity'] = [[paperID, el] for paperID, paper_entities in zip(paperIDs, entities)
+                                for el in paper_entities]
+
+    return rows
+
+def process_paperFile(gzfile, firstID=None, chunksize=10000):
+    """Process Semantic Scholar gzip file, and extract a list wih paper
+    information to save in the S2papers table (see process_paperBatch)
+    The file is read in batches of chunksize papers, and the rows of
+    each batch are returned before the next one is read
     Args:
     :param gzfil: String containing the name of the file to process
+    :param firstID: If not None, paperIDs are assigned to the papers
+                    in the file starting at firstID, and the rows for
+                    tables paperField, paperVenue, paperJournal and
+                    paperEntity are also extracted
+    :param chunksize: Number of papers of each batch
+
+    Yields:
+    A dictionary with the list of rows for each table, for each batch
+    """
+    npapers = 0
+    for papers in read_S2batches(gzfile, chunksize):
+        if firstID is not None:
+            yield process_paperBatch(papers, check_firstID(firstID, npapers, len(papers)),
+                                     links=True)
+        else:
+            yield process_paperBatch(papers)
+        npapers += len(papers)
+
+def process_paperLines(lines, firstID=None):
+    """Same as process_paperBatch with links=True if firstID is not None,
+    for a block of lines of a Semantic Scholar gzip file (see read_S2blocks)
+    that are decoded by the worker. If the papers are filtered (see
+    S2reader.set_filter), the paperIDs reserved for the block are not
+    all used
+    """
+    return process_paperBatch(list(decode_S2lines(lines)), firstID,
+                              links=firstID is not None)
+
+def process_allBatch(papers, firstID=None):
+    """Process a list of Semantic Scholar paper dictionaries, and extract
+    in a single pass the rows for table S2papers and for all tables that
+    relate papers with other elements (see link_tables)
+    Args:
+    :param papers: List of dictionaries with paper information
+    :param firstID: If None, papers are identified by their S2paperID in
+                    the rows of all tables relating papers with other
+                    elements. Otherwise, paperIDs are assigned to the papers
+                    starting at firstID, and used in the rows of all these
+                    tables, except for the cited paper in citations
 
     Returns:
-    A list containing 3 lists: papers in file, unique journals in file,
-    unique venues in file, unique fields in file
-    """
-    with gzip.open(gzfile, 'rt', encoding='utf8') as f:
-        papers_infile = f.read().replace('}\n{','},{')
-    
-    papers_infile = json.loads('['+papers_infile+']')
-
-    # We extract venues and journals, getting rid of repetitions
-    thisfile_venues = [el['venue'] for el in papers_infile]
-    thisfile_venues = list(set(thisfile_venues))
-    thisfile_journals = [el['journalName'] for el in papers_infile]
-    thisfile_journals = list(set(thisfile_journals))
-    # We extract all fields, and flatten before getting rid of repetitions
-    # Flatenning is necessary because each paper has a list of fields
-    thisfile_fields = [el['fieldsOfStudy'] for el in papers_infile]
-    thisfile_fields = [item for sublist in thisfile_fields for item in sublist]
-    thisfile_fields = list(set(thisfile_fields))
-    """
-    Entities are not included in current Semantic Scholar versions
-    # We extract all entities, and flatten before getting rid of repetitions
-    # Flatenning is necessary because each paper has a list of entities
-    thisfile_entities = [el['entities'] for el in papers_infile]
-    thisfile_entities = [item for sublist in thisfile_entities for item in sublist]
-    thisfile_entities = list(set(thisfile_entities))"""    # We extract fields for the S2papers table
-    lista_papers = [process_paper(el) for el in papers_infile]
-
-    return [lista_papers, thisfile_venues, thisfile_journals, thisfile_fields]
-
-
-class S2manager(BaseDMsql):
+    A dictionary with the list of rows for each table
+    """
+    rows = process_paperBatch(papers, firstID, links=True)
+    rows['citations'] = []
+    rows['paperAuthor'] = []
 
-    def createDBschema(self):
+    for idx, paperEntry in enumerate(papers):
+        if firstID is None:
+            paperID = paperEntry['id']
+        else:
+            paperID = firstID + idx
+        rows['citations'] += [[paperID, el] for el in paperEntry['outCitations']]
+        rows['paperAuthor'] += [[paperID, el['ids'][0]] for el in paperEntry['authors']
+                                    if len(el['ids'])]
+
+    return rows
+
+def process_allFile(gzfile, firstID=None, chunksize=10000):
+    """Process Semantic Scholar gzip file, extracting the rows for all
+    tables of the database (see process_allBatch)
+    Args:
+    :param gzfile: String containing the name of the file to process
+    :param firstID: If not None, paperIDs are assigned to the papers
+                    in the file starting at firstID
+    :param chunksize: Number of papers of each batch
+
+    Yields:
+    A dictionary with the list of rows for each table, for each batch
+    of chunksize papers
+    """
+    npapers = 0
+    for papers in read_S2batches(gzfile, chunksize):
+        if firstID is not None:
+            yield process_allBatch(papers, check_firstID(firstID, npapers, len(papers)))
+        else:
+            yield process_allBatch(papers)
+        npapers += len(papers)
+
+def save_paperRows(DB, rows, npart, assignIDs, chunksize, source=None):
+    """Inserts the rows extracted by process_paperBatch, filling in the
+    tables concurrently. If paperIDs are assigned by the importer, the
+    (S2paperID, paperID) pairs are saved as part npart of the S2index
+    Args:
+    :param DB: S2manager used for the insertion
+    :param source: Name of the data file of the rows (see S2manager.saveRows)
+    """
+    columns = ['paperID'] + papers_columns if assignIDs else papers_columns
+    DB.saveRows({tablename: (columns if tablename == 'S2papers'
+                             else link_columns(tablename), rows[tablename])
+                 for tablename in rows}, source, chunksize)
+    if assignIDs:
+        S2index.add_part(DB.index_file, npart, rows['S2papers'].column('S2paperID'),
+                         rows['S2papers'].column('paperID'))
+
+def save_allRows(DB, rows, npart, assignIDs, chunksize, source=None):
+    """Inserts the rows extracted by process_allBatch, filling in the tables
+    concurrently. If paperIDs are assigned by the importer, the (S2paperID,
+    paperID) pairs are saved as part npart of the S2index, and citations
+    are kept in spool files until the index is available. Otherwise, the
+    rows relating papers with other elements are inserted in the staging
+    tables
+    Args:
+    :param DB: S2manager used for the insertion
+    :param source: Name of the data file of the rows (see S2manager.saveRows)
+    """
+    if assignIDs:
+        table_rows = {'S2papers': (['paperID'] + papers_columns, rows['S2papers'])}
+        S2index.add_part(DB.index_file, npart, rows['S2papers'].column('S2paperID'),
+                         rows['S2papers'].column('paperID'))
+    else:
+        table_rows = {'S2papers': (papers_columns, rows['S2papers'])}
+    for tablename in link_tables:
+        if not assignIDs:
+            table_rows['tmp_' + tablename] = (['S2paperID', link_tables[tablename][0]],
+                                              rows[tablename])
+        elif tablename == 'citations':
+            digests, valid = to_digests([el[1] for el in rows[tablename]])
+            citing = np.array([el[0] for el in rows[tablename]], dtype=np.uint32)
+            np.save(DB.index_file + '.cites%05d.citing.npy' % npart, citing[valid])
+            np.save(DB.index_file + '.cites%05d.cited.npy' % npart, digests[valid])
+        else:
+            table_rows[tablename] = (link_columns(tablename), rows[tablename])
+    DB.saveRows(table_rows, source, chunksize)
+
+def save_linkRows(DB, rows, chunksize, source=None):
+    """Inserts the rows extracted by process_Citations, process_Fields,
+    process_Authorship or process_Entities, filling in the tables
+    concurrently (e.g., paperField, paperVenue and paperJournal)
+    Args:
+    :param DB: S2manager used for the insertion
+    :param source: Name of the data file of the rows (see S2manager.saveRows)
+
+    Returns:
+    The number of rows inserted
+    """
+    DB.saveRows({tablename: (link_columns(tablename), rows[tablename])
+                 for tablename in rows}, source, chunksize)
+    return sum([len(el) for el in rows.values()])
+
+"""The following functions are alternatives to process_paperFile,
+   process_allFile and process_linkFile for workers that write their rows
+   in the database (worker_writes option of S2manager). Each worker uses
+   its own manager, stored in _lookup['DB'] by init_worker, and returns
+   only the number of rows written. Files are read and written in batches
+   of chunksize papers"""
+def write_paperFile(gzfile, firstID, chunksize):
+    """Imports the papers of a Semantic Scholar gzip file, assigning
+    paperIDs starting at firstID (see process_paperFile)
+
+    Returns:
+    A dictionary with the number of papers written, under key 'S2papers'
+    """
+    source = os.path.basename(gzfile)
+    npapers = 0
+    for papers in read_S2batches(gzfile, chunksize):
+        batchID = check_firstID(firstID, npapers, len(papers))
+        #The first paperID of each batch identifies its part of the S2index
+        save_paperRows(_lookup['DB'], process_paperBatch(papers, batchID, links=True),
+                       batchID, True, chunksize, source)
+        npapers += len(papers)
+    _lookup['DB'].closeRows(source)
+
+    return {'S2papers': npapers}
+
+def write_paperLines(lines, firstID, chunksize, source):
+    """Imports the papers in a block of lines of a Semantic Scholar gzip
+    file (see process_paperLines), assigning paperIDs starting at firstID
+    :param source: Name of the data file. Parquet files of the block are
+                   written as a part of the data file (source.firstID)
+
+    Returns:
+    A dictionary with the number of papers written, under key 'S2papers'
+    """
+    #The first paperID of the block identifies its part of the S2index
+    rows = process_paperLines(lines, firstID)
+    save_paperRows(_lookup['DB'], rows, firstID, True, chunksize, '%s.%d' % (source, firstID))
+    _lookup['DB'].closeRows('%s.%d' % (source, firstID))
+
+    return {'S2papers': len(rows['S2papers'])}
+
+def write_allFile(gzfile, firstID, chunksize):
+    """Imports all data of a Semantic Scholar gzip file (see
+    process_allFile). If firstID is None, paperIDs are assigned by
+    the database
+
+    Returns:
+    A dictionary with the number of papers written, under key 'S2papers'
+    """
+    source = os.path.basename(gzfile)
+    npapers = 0
+    for papers in read_S2batches(gzfile, chunksize):
+        if firstID is not None:
+            batchID = check_firstID(firstID, npapers, len(papers))
+            save_allRows(_lookup['DB'], process_allBatch(papers, batchID), batchID,
+                         True, chunksize, source)
+        else:
+            save_allRows(_lookup['DB'], process_allBatch(papers), None, False, chunksize,
+                         source)
+        npapers += len(papers)
+    _lookup['DB'].closeRows(source)
+
+    return {'S2papers': npapers}
+
+def write_linkFile(process_batch, gzfile, chunksize):
+    """Imports the rows extracted by process_batch from a Semantic Scholar
+    gzip file (see process_linkFile)
+
+    Returns:
+    The number of rows written
+    """
+    source = os.path.basename(gzfile)
+    nrows = 0
+    for papers in read_S2batches(gzfile, chunksize):
+        nrows += save_linkRows(_lookup['DB'], process_batch(papers), chunksize, source)
+    _lookup['DB'].closeRows(source)
+
+    return nrows
+
+def init_worker(lookup):
+    """Initialization of the workers of a multiprocessing Pool
+    Args:
+    :param lookup: Dictionary with the objects to store in _lookup. If it
+                   contains a proxy to a shared Interner, the worker uses
+                   it through a CachedInterner. If it contains a manager
+                   (key 'DB'), the worker uses a clone of the manager with
+                   its own connections. The queues for the batches of rows
+                   of stream_imap are stored under key 'queues'
+    """
+    _lookup.update(lookup)
+    if 'interner' in _lookup:
+        _lookup['interner'] = CachedInterner(_lookup['interner'])
+    if 'DB' in _lookup:
+        _lookup['DB'] = _lookup['DB'].clone(shared_pool=False)
+
+"""Lookup objects for the workers of importCitations, importFields,
+   importAuthors and importEntities (the S2index and dictionaries for
+   venues, journals, fields and entities). They are filled in by the parent
+   process before the pool of workers is created, so that the workers
+   inherit them through fork, and use them without modifications. Since the
+   S2index is memory-mapped, its pages are not copied to the workers"""
+_lookup = {}
+
+def link_columns(tablename):
+    """Returns the columns to insert in a table that relates papers
+    with other elements (see link_tables)
+    """
+    if tablename == 'citations':
+        return ['paperID1', 'paperID2']
+    else:
+        return ['paperID', link_tables[tablename][0]]
+
+def paper_IDs(papers):
+    """Returns a list with the paperIDs of a list of dictionaries with
+    paper information, using the S2index shared by the parent process.
+    Papers that are not in table S2papers get paperID 0
+    """
+    return _lookup['S2index'].lookup([el['id'] for el in papers]).tolist()
+
+def process_Citations(papers):
+    """This function takes a list of dictionaries with paper information
+    as input and returns the rows to insert in citations table
+    """
+    # Citing and cited papers are looked up for the whole batch at once
+    ncites = [len(el['outCitations']) for el in papers]
+    citing = np.repeat(np.array(paper_IDs(papers), dtype=np.uint32), ncites)
+    cited = _lookup['S2index'].lookup([el for paperEntry in papers
+                                          for el in paperEntry['outCitations']])
+    valid = (citing > 0) & (cited > 0)
+    cite_list = np.column_stack((citing[valid], cited[valid])).tolist()
+
+    return {'citations': cite_list}
+
+def process_Fields(papers):
+    """This function takes a list of dictionaries with paper information
+    as input and returns the rows to insert in tables paperField,
+    paperVenue and paperJournal
+    """
+    lista_fields = []
+    lista_journals = []
+    lista_venues = []
+    for paperID, paperEntry in zip(paper_IDs(papers), papers):
+        if not paperID:
+            continue
+        try:
+            fields_list = [[paperID, _lookup['fields'][el]] 
+                            for el in paperEntry['fieldsOfStudy']]
+            journal_list = [[paperID, _lookup['journals'][paperEntry['journalName']]]]
+            venues_list = [[paperID, _lookup['venues'][paperEntry['venue']]]]
+        except KeyError:
+            continue
+        lista_fields += fields_list
+        lista_journals += journal_list
+        lista_venues += venues_list
+
+    return {'paperField': lista_fields, 'paperVenue': lista_venues,
+            'paperJournal': lista_journals}
+
+def process_Authorship(papers):
+    """This function takes a list of dictionaries with paper information
+    as input and returns the rows to insert in paperAuthor
+    """
+    author_list = []
+    for paperID, paperEntry in zip(paper_IDs(papers), papers):
+        if paperID:
+            author_list += [[paperID, el['ids'][0]] 
+                            for el in paperEntry['authors'] if len(el['ids'])]
+
+    return {'paperAuthor': author_list}
+
+def process_Entities(papers):
+    """This function takes a list of dictionaries with paper information
+    as input and returns the rows to insert in paperEntity
+    """
+    entities_list = []
+    for paperID, paperEntry in zip(paper_IDs(papers), papers):
+        if paperID:
+            entities_list += [[paperID, _lookup['entities'][el]] 
+                            for el in set(paperEntry['entities']) if el in _lookup['entities']]
+
+    return {'paperEntity': entities_list}
+
+def process_deltaBatch(papers):
+    """Process a list of Semantic Scholar paper dictionaries from a new
+    corpus release, comparing them with the papers in the database (the
+    arrays in _lookup['state'], see S2manager.importDelta). Rows are only
+    extracted for new papers, and for papers whose content hash has changed.
+    Citations of unchanged papers are only extracted if the cited paper is
+    not in the database, since it may be a new paper of this release
+    Args:
+    :param papers: List of dictionaries with paper information
+
+    Returns:
+    A dictionary with the rows for the staging tables (tmp_S2papers, where
+    new papers get paperID 0, and tmp_<table> for the tables that relate
+    papers with other elements), and, under key 'seen', the positions in
+    the state arrays of the papers found in the database
+    """
+    keys, ids, hashes = _lookup['state']
+    digests, valid = to_digests([el['id'] for el in papers])
+    if len(keys):
+        pos = np.minimum(np.searchsorted(keys, digests), len(keys) - 1)
+        found = valid & (keys[pos] == digests)
+    else:
+        pos = np.zeros(len(papers), dtype=np.int64)
+        found = np.zeros(len(papers), dtype=bool)
+    new_hashes = np.array([bytes.fromhex(content_hash(el)) for el in papers], dtype='S16')
+    modified = ~found | (hashes[pos] != new_hashes) if len(keys) else ~found
+
+    rows = {'tmp_S2papers': process_papers([], 0), 'tmp_delta': [], 'seen': pos[found].tolist()}
+    for tablename in link_tables:
+        rows['tmp_' + tablename] = []
+
+    #Citations of unchanged papers to papers not in the database. Those
+    #whose cited paper is not inserted either are discarded by the join
+    #with S2papers (see S2manager._fillFromStaging)
+    cites = [[paperEntry['id'], el] for paperEntry, flag in zip(papers, found & ~modified)
+             if flag for el in paperEntry['outCitations']]
+    if len(cites):
+        cited, new_cited = to_digests([el[1] for el in cites])
+        cited_pos = np.minimum(np.searchsorted(keys, cited), len(keys) - 1)
+        new_cited &= keys[cited_pos] != cited
+        rows['tmp_citations'] = [el for el, flag in zip(cites, new_cited) if flag]
+    if not modified.any():
+        return rows
+
+    if len(keys):
+        paperIDs = np.where(found, ids[pos], 0)[modified].tolist()
+    else:
+        paperIDs = np.zeros(int(modified.sum()), dtype=ids.dtype).tolist()
+    batch_rows = process_allBatch([el for el, flag in zip(papers, modified) if flag])
+    rows['tmp_S2papers'] = batch_rows['S2papers'].with_column('paperID', paperIDs,
+                                                              papers_dtypes['paperID'])
+    rows['tmp_delta'] = [[el, 0] for el in paperIDs if el]
+    for tablename in link_tables:
+        rows['tmp_' + tablename] = rows['tmp_' + tablename] + batch_rows[tablename]
+
+    return rows
+
+def process_deltaFile(gzfile, chunksize=10000):
+    """Process Semantic Scholar gzip file from a new corpus release (see
+    process_deltaBatch)
+    Args:
+    :param gzfile: String containing the name of the file to process
+    :param chunksize: Number of papers of each batch
+
+    Yields:
+    A dictionary with the list of rows for each staging table, for each
+    batch of chunksize papers
+    """
+    for papers in read_S2batches(gzfile, chunksize):
+        yield process_deltaBatch(papers)
+
+def delta_columns(tablename):
+    """Returns the columns to insert in a staging table of importDelta"""
+    if tablename == 'tmp_S2papers':
+        return ['paperID'] + papers_columns
+    elif tablename == 'tmp_delta':
+        return ['paperID', 'deleted']
+    else:
+        return ['S2paperID', link_tables[tablename[4:]][0]]
+
+def process_linkFile(process_batch, gzfile, chunksize=10000):
+    """Process Semantic Scholar gzip file with one of the functions
+    process_Citations, process_Fields, process_Authorship or process_Entities
+    Args:
+    :param process_batch: Function used to process the papers
+    :param gzfile: String containing the name of the file to process
+    :param chunksize: Number of papers of each batch
+
+    Yields:
+    A dictionary with the list of rows for each table, for each batch
+    of chunksize papers
+    """
+    for papers in read_S2batches(gzfile, chunksize):
+        yield process_batch(papers)
+
+class S2manager(BulkDMsql):
+
+    def __init__(self, *args, index_file='S2index', worker_writes=False, block_size=0,
+                 parquet_dir=None, parquet_only=False, shared_memory=False, sort_dir=None,
+                 sort_run_rows=1<<22, schema_profile='default', partition_years=None,
+                 partition_ids=0, **kwargs):
         """
-        Create DB table structure
+        Initialization of the manager. Apart from the arguments of BulkDMsql,
+        :param index_file: Path of the S2paperID to paperID index files
+        :param worker_writes: If True, the workers of the pool used when ncpu
+                              is set write their rows in the database over
+                              their own connections, instead of sending them
+                              to the parent process. For importPapers, this
+                              is only possible if paperIDs are assigned by
+                              the importer (assignIDs option)
+        :param block_size: If larger than 0, importPapers splits the data
+                           files into blocks of block_size papers that are
+                           processed by different workers, instead of
+                           processing each file in a single worker
+        :param parquet_dir: If not None, the rows extracted from each data
+                            file are also written as Parquet files in this
+                            directory (see S2parquet)
+        :param parquet_only: If True, rows are only written as Parquet
+                             files, and not inserted in the database. The
+                             import manifest and the dimension tables are
+                             still kept in the database
+        :param shared_memory: If True, the rows of table S2papers extracted by
+                              the workers of the pool used when ncpu is set are
+                              sent to the parent process through shared memory
+                              (see ColumnBatch.share)
+        :param sort_dir: If not None, the rows of the tables that relate
+                         papers with other elements are spilled to sorted
+                         runs in this directory (see S2sort), and inserted
+                         at the end of each import stage in primary key
+                         order and without duplicates
+        :param sort_run_rows: Maximum number of rows of each run
+        :param schema_profile: 'default' for the tables in schema, or 'lean'
+                               for the tables in lean_schema, where tables
+                               relating papers with other elements use the
+                               related pair as primary key, and venues and
+                               journals are stored in table S2papers (see
+                               migrateSchema)
+        :param partition_years: If not None, table S2papers is created
+                                partitioned by year, with a partition for
+                                the papers from each of the years in the
+                                list, and one for older papers and papers
+                                without year (stored with year 0). Years
+                                must be positive, and are sorted and
+                                deduplicated
+        :param partition_ids: If larger than 0, table citations is created
+                              partitioned by ranges of partition_ids paperIDs
+                              of the citing paper. Rows spilled to sorted
+                              runs are loaded concurrently for different
+                              partitions (see _loadRuns)
         """
-        for sql_cmd in schema:
+        if schema_profile not in schema_profiles:
+            raise ValueError('Unknown schema profile ' + schema_profile + '. ' +
+                             'Available profiles: ' + ', '.join(schema_profiles))
+        #Partitions are defined in increasing order of year, after the one
+        #for year 0
+        partition_years = sorted(set(partition_years or []))
+        if len(partition_years) and partition_years[0] <= 0:
+            raise ValueError('Years of partition_years must be positive, got ' +
+                             str(partition_years[0]))
+        if partition_ids < 0:
+            raise ValueError('partition_ids must not be negative, got ' + str(partition_ids))
+        super().__init__(*args, **kwargs)
+        self.index_file = index_file
+        self.worker_writes = worker_writes
+        self.block_size = block_size
+        self.parquet = ParquetSink(parquet_dir) if parquet_dir else None
+        self.parquet_only = parquet_only and self.parquet is not None
+        self.shared_memory = shared_memory
+        self.runs = RunSpool(sort_dir, sort_run_rows) if sort_dir else None
+        self.schema_profile = schema_profile
+        #Tables whose rows are stored as columns of table S2papers
+        self.folded = folded_tables if schema_profile == 'lean' else []
+        self.partition_years = partition_years
+        self.partition_ids = partition_ids
+        #Partitioned tables
+        self.partitioned = (['S2papers'] if len(self.partition_years) else []) + \
+                           (['citations'] if partition_ids else [])
+
+    def clone(self, shared_pool=True):
+        """Returns a copy of the manager with a new connection (see
+        BulkDMsql.clone). Clones for other processes also get their own
+        Parquet writers and sorted runs
+        """
+        DB = super().clone(shared_pool)
+        if not shared_pool and self.parquet is not None:
+            DB.parquet = ParquetSink(self.parquet.parquet_dir)
+        if not shared_pool and self.runs is not None:
+            DB.runs = RunSpool(self.runs.sort_dir, self.runs.run_rows)
+
+        return DB
+
+    def saveRows(self, table_rows, source=None, chunksize=None):
+        """Saves the rows extracted from a data file, filling in several
+        tables concurrently (see insertConcurrently). If parquet_dir is set,
+        the rows are also written in the Parquet files of the data file,
+        which must be completed with closeRows once all its rows are saved.
+        If sort_dir is set, rows of the tables that relate papers with
+        other elements are spilled to sorted runs instead of being inserted
+        (see _loadRuns). In the lean schema profile, rows of tables
+        paperVenue and paperJournal are stored in table S2papers (see
+        _foldRows), and duplicated rows are removed from the other tables
+        :param table_rows: Dictionary with a pair (columns, rows) for each
+                           table
+        :param source: Name of the data file. If None, rows are not written
+                       as Parquet files, and are always inserted
+        :param chunksize: See insertInTable
+        """
+        if self.parquet is not None and source is not None:
+            self.parquet.write(source, table_rows)
+        if self.parquet_only:
+            return
+        if len(self.folded):
+            table_rows = self._foldRows(table_rows, chunksize)
+        table_rows = self._fillYears(table_rows)
+        if self.runs is not None and source is not None:
+            self.runs.write(source, {tablename: el for tablename, el in table_rows.items()
+                                     if tablename in link_tables})
+            table_rows = {tablename: el for tablename, el in table_rows.items()
+                          if tablename not in link_tables}
+        if self.schema_profile == 'lean':
+            #Rows are the primary key of the tables. All rows of a paper are
+            #extracted together, so duplicates are always in the same call
+            table_rows = {tablename: (el[0], unique_rows(el[1])) if tablename in link_tables
+                          else el for tablename, el in table_rows.items()}
+        self.insertConcurrently(table_rows, chunksize=chunksize)
+
+    def _foldRows(self, table_rows, chunksize=None):
+        """Stores the rows of tables paperVenue and paperJournal in the
+        columns venueID and journalID of table S2papers (lean schema
+        profile). If the rows of the papers are also in table_rows, with
+        their paperIDs, the columns are added to them. Otherwise, the papers
+        must already be in table S2papers, and they are updated
+        :param table_rows: Dictionary with a pair (columns, rows) for each
+                           table (see saveRows)
+        :param chunksize: Number of papers updated at once
+
+        Returns:
+        The dictionary without the rows of tables paperVenue and paperJournal
+        """
+        folded = {tablename: table_rows[tablename][1] for tablename in self.folded
+                  if tablename in table_rows}
+        if not len(folded):
+            return table_rows
+        table_rows = {tablename: el for tablename, el in table_rows.items()
+                      if tablename not in folded}
+        columns, papers = table_rows.get('S2papers', ([], None))
+        if isinstance(papers, ColumnBatch) and 'paperID' in columns:
+            paperIDs = np.asarray(papers.column('paperID'), dtype=np.int64)
+            order = np.argsort(paperIDs, kind='stable')
+            for tablename, rows in folded.items():
+                values = np.zeros(len(papers), dtype=np.int64)
+                valid = np.zeros(len(papers), dtype=bool)
+                rows = np.asarray(rows, dtype=np.int64).reshape(-1, 2)
+                if len(papers):
+                    pos = order[np.minimum(np.searchsorted(paperIDs, rows[:, 0], sorter=order),
+                                           len(papers) - 1)]
+                    found = paperIDs[pos] == rows[:, 0]
+                    values[pos[found]] = rows[found, 1]
+                    valid[pos[found]] = True
+                    rows = rows[~found]
+                papers = papers.with_column(link_tables[tablename][0], values, np.int64,
+                                            len(columns), valid)
+                columns = columns + [link_tables[tablename][0]]
+                #Rows of papers that are not in the batch
+                folded[tablename] = rows.tolist()
+            table_rows['S2papers'] = (columns, papers)
+        for tablename, rows in folded.items():
+            self._updatePapers(link_tables[tablename][0], rows, chunksize)
+
+        return table_rows
+
+    def _fillYears(self, table_rows):
+        """Replaces the missing years of the papers in the rows of tables
+        S2papers and tmp_S2papers by 0 if table S2papers is partitioned by
+        year (see partition_years), since year is then part of the primary
+        key of the table. Both NULL years and records without year (see
+        missing_year) are replaced, so that they are in the same partition
+        :param table_rows: Dictionary with a pair (columns, rows) for each
+                           table (see saveRows). Rows of the papers must be
+                           given as a ColumnBatch
+        """
+        if not len(self.partition_years):
+            return table_rows
+        return {tablename: (el[0], el[1].fill_nulls('year', 0, missing_year))
+                if tablename in ['S2papers', 'tmp_S2papers'] else el
+                for tablename, el in table_rows.items()}
+
+    def _updatePapers(self, column, rows, chunksize=None):
+        """Sets a column of papers already in table S2papers. Papers are
+        joined with derived tables with the values of up to 10000 papers,
+        instead of running one UPDATE statement per paper (as in setField).
+        Pairs whose paper is not in the table are ignored
+        :param column: Name of the column
+        :param rows: List of (paperID, value) pairs
+        :param chunksize: Number of papers updated at once
+        """
+        if not len(rows):
+            return
+        chunksize = min(chunksize or len(rows), 10000)
+        for start in range(0, len(rows), chunksize):
+            batch = rows[start:start+chunksize]
+            self._c.execute('UPDATE S2papers p JOIN (' +
+                            ' UNION ALL '.join(['SELECT %s AS paperID, %s AS value'] * len(batch)) +
+                            ') t ON p.paperID = t.paperID SET p.' + column + ' = t.value',
+                            [value for el in batch for value in el])
+            self._rowsWritten(len(batch), lambda: 16 * len(batch))
 
-            self._c.execute(sql_cmd)
+        return
 
-        #Commit changes to database
+    def closeRows(self, source):
+        """Completes the Parquet files and sorted runs of a data file (see
+        saveRows), and commits its rows if they are inserted in a bulk-load
+        session (see BulkDMsql.bulkSession)
+        """
+        if self.parquet is not None:
+            self.parquet.close(source)
+        if self.runs is not None:
+            self.runs.close(source)
+        if self._commitEvery is not None:
+            self.commit()
+
+    def _loadRuns(self, stage, tables, chunksize, nwriters=None):
+        """Fills in tables with the rows spilled to sorted runs by saveRows
+        (see sort_dir), merging the runs of each table so that rows are
+        inserted in primary key order and without duplicates. The runs are
+        removed once loaded. The number of rows loaded is recorded in the
+        import manifest (source 'sorted <tablename>'), so that loading
+        continues after a failure if the runs have not changed
+
+        If table citations is partitioned (see partition_ids), the rows of
+        each partition are merged and loaded separately, by nwriters writer
+        threads (see writeConcurrently), so that different partitions are
+        filled in concurrently. The progress of each
+        partition is recorded under source 'sorted citations p<firstID>'
+        :param stage: Name of the import stage
+        :param tables: List of tables
+        :param chunksize: Number of rows read from each run at a time
+        :param nwriters: Number of partitions loaded concurrently. If None,
+                         one per writer thread of the manager (see writers)
+        """
+        if self.runs is None:
+            return
+        for tablename in tables:
+            if not len(self.runs.runs(tablename)):
+                continue
+            checksum = self.runs.checksum(tablename)
+            manifest = self.readManifest(stage)
+            columns = link_columns(tablename)
+
+            def load_range(DB, item):
+                #Loads the rows whose first element is in [low, high)
+                source, low, high = item
+                entry = manifest.get(source)
+                if entry is not None and entry['checksum'] == checksum:
+                    skip = entry['nrows'] or 0
+                    print('Resuming', source[7:], 'after', skip, 'rows')
+                else:
+                    skip = 0
+                nrows = 0
+                blocks = DB.runs.merge(tablename, chunksize, low, high)
+                for rows in (tqdm(blocks) if low is None else blocks):
+                    start = min(max(0, skip - nrows), len(rows))
+                    nrows += len(rows)
+                    if start == len(rows):
+                        continue
+                    DB.insertInTable(tablename, columns,
+                                     ColumnBatch.from_arrays(columns, [rows[start:, 0], rows[start:, 1]]),
+                                     chunksize=chunksize)
+                    DB.commit()
+                    DB.setManifest(stage, source, 'started', nrows=nrows, checksum=checksum)
+                if low is not None:
+                    pbar.update()
+
+            if tablename in self.partitioned:
+                self._extendPartitions()
+                first, last = self.runs.bounds(tablename)
+                items = [('sorted %s p%d' % (tablename, low), low, low + self.partition_ids)
+                         for low in range(first - first % self.partition_ids, last + 1,
+                                          self.partition_ids)]
+                print('Filling in table', tablename, 'in primary key order,', len(items),
+                      'partitions')
+                with tqdm(total=len(items)) as pbar:
+                    self.writeConcurrently(items, load_range, nwriters)
+            else:
+                items = [('sorted ' + tablename, None, None)]
+                print('Filling in table', tablename, 'in primary key order')
+                load_range(self, items[0])
+            self.runs.clear(tablename)
+            for source, low, high in items:
+                self._c.execute('DELETE FROM S2manifest WHERE stage=%s AND source=%s',
+                                (stage, source))
+            self._conn.commit()
+
+        return
+
+    def partitions(self, tablename):
+        """Returns the partitions of a table, as a list of pairs with the
+        name of the partition (e.g., p1990, see range_partitions) and its
+        approximate number of rows, in the order of their ranges. The list
+        is empty if the table is not partitioned
+        """
+        self._c.execute('SELECT PARTITION_NAME, TABLE_ROWS FROM information_schema.PARTITIONS ' +
+                        'WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s ' +
+                        'AND PARTITION_NAME IS NOT NULL ORDER BY PARTITION_ORDINAL_POSITION',
+                        (tablename,))
+
+        return [(el[0], el[1]) for el in self._c.fetchall()]
+
+    def rebuildPartition(self, tablename, partition):
+        """Rebuilds a partition of a table, reclaiming the space of the rows
+        deleted from it (e.g., by importDelta) and defragmenting its indices,
+        without rebuilding the rest of the table
+        :param tablename: Name of the table
+        :param partition: Name of the partition (see partitions)
+        """
+        self._c.execute('ALTER TABLE ' + tablename + ' REBUILD PARTITION ' + partition)
+        self._conn.commit()
+
+        return
+
+    def truncatePartition(self, tablename, partition):
+        """Drops all rows of a partition of a table, much faster than
+        deleting them, keeping the partition for loading its rows again.
+        Rows of other tables related to the papers or citations of the
+        partition are not removed
+        :param tablename: Name of the table
+        :param partition: Name of the partition (see partitions)
+        """
+        self._c.execute('ALTER TABLE ' + tablename + ' TRUNCATE PARTITION ' + partition)
+        self._conn.commit()
+
+        return
+
+    def _extendPartitions(self):
+        """Adds partitions to table citations, if it is partitioned (see
+        partition_ids), until they cover the paperIDs of table S2papers.
+        Only the last partition, which holds all larger paperIDs, is split,
+        so this is fast if no citations of these papers are in the table
+        """
+        if not self.partition_ids:
+            return
+        last = max([int(el[0][1:]) for el in self.partitions('citations')], default=None)
+        maxID = self._maxPaperID()
+        if last is None or maxID < last + self.partition_ids:
+            return
+        #The new last partition only holds paperIDs larger than maxID
+        lows = list(range(last, maxID + self.partition_ids + 1, self.partition_ids))
+        print('Adding', len(lows) - 1, 'partitions to table citations')
+        self._c.execute('ALTER TABLE citations REORGANIZE PARTITION p%d INTO (' % last +
+                        range_partitions(lows) + ')')
         self._conn.commit()
 
         return
 
-    def createDBindices(self):
+    def loadParquet(self, chunksize=100000, tables=None):
+        """Fills in the tables of the database from the Parquet files
+        written by previous imports (see parquet_dir), without reading the
+        data files. Rows from the staging tables of importAll are moved to
+        the final tables (see _fillFromStaging). Loading is not recorded in
+        the import manifest, and should be done on an empty database, or on
+        the database of an import with parquet_only, where only tables
+        S2venues, S2journals, S2fields and S2entities are filled in. Rows of
+        these tables whose IDs are already in the database are skipped
+        :param chunksize: Number of rows read and inserted at once
+        :param tables: List of tables to fill in. If None, all tables with
+                       Parquet files are filled in
+        """
+        if self.parquet is None:
+            print('Parquet directory (parquet_dir) is not set')
+            return
+
+        tables = tables or self.parquet.tables()
+        if 'S2papers' in tables:
+            self._addContentHash()
+        staging = [el for el in tables if el.startswith('tmp_')]
+        if len(staging):
+            self._createStaging([])
+        dimensions = {link_tables[el][1]: link_tables[el][0] for el in link_tables if link_tables[el][1]}
+        #S2papers is filled in first, since staging tables are joined with it
+        for tablename in sorted(tables, key=lambda el: el != 'S2papers'):
+            print('Filling in table', tablename, 'from Parquet files')
+            if tablename in dimensions:
+                #Values saved by _saveDimensions during the import
+                self._c.execute('SELECT MAX(' + dimensions[tablename] + ') FROM ' + tablename)
+                saved = self._c.fetchone()[0] or 0
+            for fname in tqdm(self.parquet.files(tablename)):
+                #Rows of the last paper of the previous batch (see below)
+                last_rows = set()
+                for batch in pq.ParquetFile(fname).iter_batches(batch_size=chunksize):
+                    rows = list(zip(*[el.to_pylist() for el in batch.columns]))
+                    if tablename in dimensions:
+                        pos = batch.schema.names.index(dimensions[tablename])
+                        rows = [el for el in rows if el[pos] > saved]
+                    if tablename == 'S2papers' and len(self.partition_years):
+                        #Missing years are stored as 0 (see _fillYears)
+                        pos = batch.schema.names.index('year')
+                        rows = [el[:pos] + (0 if el[pos] in (None, missing_year) else el[pos],) +
+                                el[pos+1:] for el in rows]
+                    if tablename in self.folded:
+                        self._updatePapers(link_tables[tablename][0], rows, chunksize)
+                        continue
+                    if self.schema_profile == 'lean' and tablename in link_tables:
+                        #Rows are the primary key of the table. Duplicated
+                        #rows of a paper may be split between two batches
+                        rows = [el for el in unique_rows(rows) if el not in last_rows]
+                        last_rows = set([el for el in rows if el[0] == rows[-1][0]]) \
+                                    if len(rows) else last_rows
+                    self.insertInTable(tablename, batch.schema.names, rows,
+                                       chunksize=chunksize, verbose=False)
+
+        # New papers invalidate the S2paperID to paperID index
+        S2index.remove(self.index_file)
+        if len(staging):
+            self._fillFromStaging()
+
+        return
+
+    def createDBschema(self):
         """
-        Create DB table structure
+        Create DB table structure, for the schema profile of the manager.
+        Tables S2papers and citations are partitioned if partition_years
+        or partition_ids are set
         """
-        for sql_cmd in indices:
-            print('Creating index:', sql_cmd)
+        sql_cmds = []
+        if len(self.partition_years):
+            sql_cmds += [partition_keys['S2papers'], 'ALTER TABLE S2papers PARTITION BY RANGE (year) (' +
+                         range_partitions([0] + self.partition_years) + ')']
+        if self.partition_ids:
+            #The primary key of the lean profile already includes paperID1
+            if self.schema_profile == 'default':
+                sql_cmds.append(partition_keys['citations'])
+            sql_cmds.append('ALTER TABLE citations PARTITION BY RANGE (paperID1) (' +
+                            range_partitions([0, self.partition_ids]) + ')')
+
+        for sql_cmd in schema_profiles[self.schema_profile][0] + sql_cmds + [manifest_schema]:
+
             self._c.execute(sql_cmd)
 
         #Commit changes to database
         self._conn.commit()
 
+        #The S2paperID to paperID index is no longer valid
+        S2index.remove(self.index_file)
+
+        return
+
+    def createDBindices(self, nthreads=1):
+        """
+        Create DB indices and foreign key constraints. Tables are created
+        without them, so that they can be built after the data is loaded.
+        Indices for different tables are built concurrently, using up to
+        nthreads connections. Existing indices and foreign keys are not
+        created again. If checks have been disabled with setChecks, foreign
+        keys are added without validating the rows already in the tables.
+        Partitioned tables support neither FULLTEXT indices nor foreign
+        keys, so they are not created for them. If any index or foreign key
+        cannot be created, the others are still built, and the error of the
+        first failed statement is raised at the end
+        """
+        sql_cmds = []
+        for sql_cmd in schema_profiles[self.schema_profile][1]:
+            indexname = re.search(r'INDEX\s+(\w+)', sql_cmd, re.IGNORECASE).group(1)
+            if 'FULLTEXT' in sql_cmd and sql_tablename(sql_cmd) in self.partitioned:
+                print('Skipping index', indexname, 'of partitioned table', sql_tablename(sql_cmd))
+            elif not self._hasIndex(sql_tablename(sql_cmd), indexname):
+                sql_cmds.append(sql_cmd)
+
+        failures = self.executeConcurrently(sql_cmds, nthreads)
+
+        # Foreign keys are added once all indices are available
+        sql_cmds = []
+        for sql_cmd in constraints:
+            column = re.search(r'FOREIGN KEY\s*\((\w+)\)', sql_cmd, re.IGNORECASE).group(1)
+            parent = re.search(r'REFERENCES\s+(\w+)', sql_cmd, re.IGNORECASE).group(1)
+            if sql_tablename(sql_cmd) in self.partitioned or parent in self.partitioned:
+                continue
+            if not self._hasForeignKey(sql_tablename(sql_cmd), column):
+                sql_cmds.append(sql_cmd)
+
+        failures += self.executeConcurrently(sql_cmds, nthreads)
+
+        if len(failures):
+            print('Indices and foreign keys not created:')
+            for sql_cmd, e in failures:
+                print('   ', sql_cmd)
+            raise failures[0][1]
+
+        return
+
+    def migrateSchema(self):
+        """
+        Converts the tables of a database created with the default schema
+        profile to the lean profile (see schema_profile). Venues and
+        journals are copied to table S2papers, and tables paperVenue and
+        paperJournal are dropped. Each of the other tables that relate
+        papers with other elements is copied, in primary key order and
+        without duplicates, to a new table without surrogate key, which
+        replaces it. Tables already converted are skipped, so the migration
+        can be resumed after a failure. Secondary indices and foreign keys
+        of the new tables are created by createDBindices
+        """
+        if self.schema_profile != 'lean':
+            print('Databases can only be migrated to the lean schema profile')
+            return
+
+        self._c.execute("SHOW COLUMNS FROM S2papers LIKE %s",
+                        (link_tables[folded_tables[0]][0],))
+        if not len(self._c.fetchall()):
+            print('Adding columns to table S2papers')
+            self._c.execute(lean_papers)
+
+        for tablename in folded_tables:
+            self._c.execute('SHOW TABLES LIKE %s', (tablename,))
+            if not len(self._c.fetchall()):
+                continue
+            column = link_tables[tablename][0]
+            print('Moving table', tablename, 'to column', column, 'of table S2papers')
+            self._c.execute('UPDATE S2papers p JOIN ' + tablename + ' t ' +
+                            'ON p.paperID = t.paperID SET p.' + column + ' = t.' + column)
+            self._conn.commit()
+            self._c.execute('DROP TABLE ' + tablename)
+
+        for sql_cmd in lean_links:
+            tablename = re.search(r'TABLE\s+(\w+)', sql_cmd).group(1)
+            key = re.search(r'PRIMARY KEY\s*\(([^)]*)\)', sql_cmd).group(1)
+            self._c.execute('SHOW COLUMNS FROM ' + tablename)
+            fields = self._c.fetchall()
+            #All columns except the surrogate key
+            columns = [el[0] for el in fields if 'auto_increment' not in el[5].lower()]
+            if len(columns) == len(fields):
+                continue
+            print('Converting table', tablename)
+            self._c.execute('DROP TABLE IF EXISTS lean_' + tablename)
+            self._c.execute(sql_cmd.replace('TABLE ' + tablename, 'TABLE lean_' + tablename, 1))
+            self._c.execute('INSERT IGNORE INTO lean_' + tablename + ' (' + ', '.join(columns) + ') ' +
+                            'SELECT ' + ', '.join(columns) + ' FROM ' + tablename + ' WHERE ' +
+                            ' AND '.join([el.strip() + ' IS NOT NULL' for el in key.split(',')]) +
+                            ' ORDER BY ' + key)
+            self._conn.commit()
+            self._c.execute('RENAME TABLE ' + tablename + ' TO old_' + tablename + ', ' +
+                            'lean_' + tablename + ' TO ' + tablename)
+            self._c.execute('DROP TABLE old_' + tablename)
+
         return
 
-    def importPapers(self, data_files, ncpu, chunksize=100000):
+    def importPapers(self, data_files, ncpu, chunksize=100000, assignIDs=False):
         """
         Import data from Semantic Scholar compressed data files
         available at the indicated location
-        Only paper data will be imported
+        Only paper data will be imported, together with the venues,
+        journals, fields of study and entities found in the papers
+
+        If assignIDs is True, paperIDs are assigned by the importer from the
+        position of each paper in the data files (see first_paperID), instead
+        of by the database. The S2paperID to paperID index is saved as papers
+        are inserted, so other stages do not need to read table S2papers back.
+        Tables paperField, paperVenue, paperJournal and paperEntity are also
+        filled in. This option should only be used with an empty database
+
+        Imported files are recorded in the import manifest (see
+        pendingFiles), so the import can be resumed after a failure
+
+        If ncpu is set, files are parsed by a pool of workers while their
+        results are written by writer threads with their own connections
+        (see writeConcurrently). Several writers are only used if assignIDs
+        is True, since otherwise the paperIDs of each file must be assigned
+        by the database before those of the next file. For the same reason,
+        workers only write their own rows (worker_writes) if assignIDs is True.
+        Otherwise, workers send the rows of each batch of chunksize papers to
+        the writers as soon as they are extracted (see stream_imap)
+
+        If block_size is set, the data files are decompressed by the main
+        process and split into blocks of lines that are decoded and
+        processed by the workers, so that large files do not leave most
+        workers idle at the end of the import. The rows of each block are
+        written as soon as the block has been processed, in the same order
+        as in the file (see stream_blocks)
         """
-        #STEP 1
-        #Read and Insert paper data
-        #We need to pass through all data files first to import venues, journalNames, entities
-        #and fields. We populate also the S2papers table
-        all_venues = []
-        all_journals = []
-        #all_entities = []
-        all_fields = []
+        stage = 'importPapers'
+        self._addContentHash()
+        if assignIDs:
+            tables = ['S2papers', 'paperVenue', 'paperJournal', 'paperField', 'paperEntity']
+        else:
+            tables = ['S2papers']
+
+        def remove_rows(gzf, entry):
+            #Papers of a file have consecutive paperIDs, starting at firstID
+            if entry['firstID'] is None:
+                print('Rows imported from', gzf, 'cannot be located. Duplicates may appear')
+            else:
+                self._removeRange(tables, entry['firstID'], entry['lastID'])
+            if self.parquet is not None:
+                self.parquet.remove(os.path.basename(gzf), tables)
+            if self.runs is not None:
+                self.runs.remove(os.path.basename(gzf), tables)
+
+        def start_file(DB, fileno, gzf):
+            #The file is recorded before its rows are inserted
+            if assignIDs:
+                firstID = first_paperID(fileno)
+                lastID = first_paperID(fileno + 1) - 1
+            else:
+                firstID = DB._maxPaperID() + 1
+                lastID = None
+            DB.setManifest(stage, os.path.basename(gzf), 'started', firstID=firstID, lastID=lastID)
+            return firstID
+
+        #Dimensions are saved by one writer at a time
+        dimensions_lock = threading.Lock()
+
+        def end_file(DB, gzf, firstID, npapers, interner, saved):
+            DB.closeRows(os.path.basename(gzf))
+            #Dimensions found so far are saved, so they are not lost if the
+            #import is interrupted
+            with dimensions_lock:
+                saved.update(DB._saveDimensions(interner, chunksize, saved))
+            if assignIDs:
+                #If papers are filtered, the paperIDs of a file processed in
+                #blocks are not consecutive, so the range reserved for the
+                #file is recorded
+                lastID = firstID + ids_per_file - 1
+            else:
+                lastID = DB._maxPaperID()
+            DB.setManifest(stage, os.path.basename(gzf), 'done', nrows=npapers, checksum=file_checksum(gzf),
+                           firstID=firstID, lastID=lastID)
 
         print('Filling in table S2papers')
 
-        gz_files = sorted([data_files+el for el in os.listdir(data_files) if el.startswith('s2-corpus')])
+        # New papers invalidate the S2paperID to paperID index
+        S2index.remove(self.index_file)
+
+        gz_files = list_S2files(data_files)
+        pending = self.pendingFiles(stage, gz_files, remove_rows)
+        resumed = len(pending) < len(gz_files)
 
         if ncpu:
             #Parallel processing
-            with Pool(ncpu) as p:
-                with tqdm(total = len(gz_files)) as pbar:
-                    for file_data in p.imap(process_paperFile, gz_files):
-                        pbar.update()
-                        #Populate tables with the new data
-                        self.insertInTable('S2papers', ['S2paperID', 'title', 'lowertitle', 
-                                'paperAbstract', 'entities', 'fieldsOfStudy', 's2PdfUrl',
-                                'pdfUrls', 'year', 'journalVolume', 'journalPages',
-                                'isDBLP', 'isMedline', 'doi', 'doiUrl', 'pmid'],
-                                file_data[0], chunksize=chunksize, verbose=False)
-                        all_venues += file_data[1]
-                        all_venues = list(set(all_venues))
-                        all_journals += file_data[2]
-                        all_journals = list(set(all_journals))
-                        all_fields += file_data[3]
-                        all_fields = list(set(all_fields))
-                        
-            pbar.close()
-            p.close()
-            p.join()
+            direct = self.worker_writes and assignIDs
+            if self.worker_writes and not assignIDs:
+                print('Rows are written by the parent process, since paperIDs are not assigned')
+
+            def direct_tasks():
+                #Files are recorded when they are submitted to the workers
+                for fileno, gzf in pending:
+                    yield (write_paperFile, gzf, start_file(self, fileno, gzf), chunksize)
+
+            def block_tasks():
+                #Blocks are read while the workers process the previous ones
+                for fileno, gzf in pending:
+                    if direct:
+                        firstID = start_file(self, fileno, gzf)
+                    elif assignIDs:
+                        firstID = first_paperID(fileno)
+                    npapers = 0
+                    for lines in read_S2blocks(gzf, self.block_size):
+                        if direct:
+                            task = (write_paperLines, lines,
+                                    check_firstID(firstID, npapers, len(lines)), chunksize,
+                                    os.path.basename(gzf))
+                        elif assignIDs:
+                            task = (process_paperLines, lines,
+                                    check_firstID(firstID, npapers, len(lines)))
+                        else:
+                            task = (process_paperLines, lines)
+                        npapers += len(lines)
+                        yield (fileno, gzf), task
+
+            if self.block_size:
+                tasks = None
+            elif direct:
+                tasks = direct_tasks()
+            elif assignIDs:
+                tasks = [(process_paperFile, gzf, first_paperID(fileno), chunksize)
+                            for fileno, gzf in pending]
+            else:
+                tasks = [(process_paperFile, gzf, None, chunksize) for fileno, gzf in pending]
+            nwriters = self.writers if assignIDs else 1
+            with InternManager() as manager:
+                interner = manager.Interner()
+                saved = self._loadDimensions(interner)
+                lookup = {'interner': interner, 'shared_memory': self.shared_memory,
+                          'queues': stream_queues(ncpu, nwriters)}
+                if direct:
+                    lookup['DB'] = self
+
+                def write_file(DB, item):
+                    (fileno, gzf), batches = item
+                    if direct:
+                        #The worker has already written the rows
+                        firstID = first_paperID(fileno)
+                        npapers = batches['S2papers']
+                    else:
+                        firstID = start_file(DB, fileno, gzf)
+                        npapers = 0
+                        #The rows come in batches, or in blocks if the file
+                        #is split (see stream_blocks)
+                        try:
+                            for rows in batches:
+                                #The first paperID of each batch identifies
+                                #its part of the S2index
+                                save_paperRows(DB, rows, firstID + npapers, assignIDs,
+                                               chunksize, os.path.basename(gzf))
+                                npapers += len(rows['S2papers'])
+                        except Exception:
+                            drain_batches(batches)
+                            raise
+                    end_file(DB, gzf, firstID, npapers, interner, saved)
+                    pbar.update()
+
+                with Pool(ncpu, initializer=init_worker, initargs=(lookup,)) as p:
+                    with tqdm(total = len(pending)) as pbar:
+                        if self.block_size and direct:
+                            items = imap_blocks(p, block_tasks(), ncpu, merge_counts)
+                        elif self.block_size:
+                            items = stream_blocks(p, block_tasks(), ncpu)
+                        elif direct:
+                            items = zip(pending, bounded_imap(p, tasks, ncpu))
+                        else:
+                            items = zip(pending, stream_imap(p, lookup['queues'], tasks, ncpu))
+                        #Blocks are queued for the files taken by the writers
+                        #(see stream_blocks), so skipped files are drained
+                        self.writeConcurrently(items, write_file, nwriters,
+                                               discard=None if direct else
+                                               lambda item: drain_batches(item[1]))
+                p.close()
+                p.join()
 
         else:
 
+            _lookup['interner'] = Interner()
+            saved = self._loadDimensions(_lookup['interner'])
+            pbar = tqdm(total=len(pending))
+            npart = 0
+
+            for fileno, gzf in pending:
+                pbar.update(1)
+                npapers = 0
+                firstID = start_file(self, fileno, gzf)
+
+                #Files are read in batches of chunksize papers, that are
+                #inserted in the database before reading the next batch
+                for papers in read_S2batches(gzf, chunksize):
+                    if assignIDs:
+                        rows = process_paperBatch(papers,
+                            check_firstID(firstID, npapers, len(papers)), links=True)
+                    else:
+                        rows = process_paperBatch(papers)
+                    npapers += len(papers)
+                    save_paperRows(self, rows, npart, assignIDs, chunksize,
+                                   os.path.basename(gzf))
+                    npart += 1
+
+                end_file(self, gzf, firstID, npapers, _lookup['interner'], saved)
+
+            pbar.close()
+            _lookup.clear()
+
+        self._loadRuns(stage, tables[1:], chunksize, max(ncpu, self.writers))
+
+        if assignIDs:
+            if resumed:
+                #Parts for the files imported in previous executions are not
+                #available, so the index will be built from table S2papers
+                S2index.remove(self.index_file)
+            else:
+                print('Generating S2 to ID index')
+                print('Number of papers in the index:', S2index.merge_parts(self.index_file))
+
+        return
+        
+    def importAll(self, data_files, ncpu, chunksize=100000, assignIDs=False):
+        """
+        Import data from Semantic Scholar compressed data files
+        available at the indicated location, filling in tables S2papers,
+        S2venues, S2journals, S2fields, S2entities, citations, paperAuthor,
+        paperField, paperVenue, paperJournal and paperEntity in a single
+        pass over the data files
+
+        By default, rows for the tables relating papers with other elements
+        are kept in staging tables, where papers are identified by their
+        S2paperID. Once all papers have been inserted, the staging tables
+        are joined with S2papers to obtain the paperIDs
+
+        If assignIDs is True, paperIDs are assigned by the importer (see
+        importPapers), and rows are inserted directly in the final tables.
+        Citations are kept in spool files until the S2paperID to paperID
+        index is complete, and the cited papers can be looked up
+
+        Unlike the other import methods, importAll does not record the
+        imported files in the import manifest, and cannot be resumed. It
+        should be used with an empty database
+        """
+        self._addContentHash()
+        if not assignIDs:
+            self._createStaging([])
+
+        print('Filling in table S2papers and related tables')
+
+        # New papers invalidate the S2paperID to paperID index
+        S2index.remove(self.index_file)
+        for fname in glob.glob(self.index_file + '.cites*.npy'):
+            os.remove(fname)
+        if self.runs is not None:
+            for tablename in link_tables:
+                self.runs.clear(tablename)
+
+        gz_files = list_S2files(data_files)
+
+        if ncpu:
+            #Parallel processing
+            if self.worker_writes:
+                tasks = [(write_allFile, gzf, first_paperID(fileno) if assignIDs else None,
+                          chunksize) for fileno, gzf in enumerate(gz_files)]
+            elif assignIDs:
+                tasks = [(process_allFile, gzf, first_paperID(fileno), chunksize)
+                            for fileno, gzf in enumerate(gz_files)]
+            else:
+                tasks = [(process_allFile, gzf, None, chunksize) for gzf in gz_files]
+            with InternManager() as manager:
+                interner = manager.Interner()
+                lookup = {'interner': interner, 'shared_memory': self.shared_memory,
+                          'queues': stream_queues(ncpu, self.writers)}
+                if self.worker_writes:
+                    lookup['DB'] = self
+
+                def write_file(DB, item):
+                    fileno, batches = item
+                    if not self.worker_writes:
+                        source = os.path.basename(gz_files[fileno])
+                        npapers = 0
+                        try:
+                            for rows in batches:
+                                #The first paperID of each batch identifies
+                                #its part of the S2index
+                                save_allRows(DB, rows, first_paperID(fileno) + npapers,
+                                             assignIDs, chunksize, source)
+                                npapers += len(rows['S2papers'])
+                        except Exception:
+                            drain_batches(batches)
+                            raise
+                        DB.closeRows(source)
+                    pbar.update()
+
+                with Pool(ncpu, initializer=init_worker, initargs=(lookup,)) as p:
+                    with tqdm(total = len(gz_files)) as pbar:
+                        if self.worker_writes:
+                            items = bounded_imap(p, tasks, ncpu)
+                        else:
+                            items = stream_imap(p, lookup['queues'], tasks, ncpu)
+                        self.writeConcurrently(enumerate(items), write_file)
+                p.close()
+                p.join()
+                print('Filling in tables S2venues, S2journals, S2fields and S2entities')
+                self._saveDimensions(interner, chunksize)
+
+        else:
+            _lookup['interner'] = Interner()
             pbar = tqdm(total=len(gz_files))
+            npart = 0
+            for fileno, gzf in enumerate(gz_files):
+                pbar.update(1)
+                npapers = 0
+                for papers in read_S2batches(gzf, chunksize):
+                    if assignIDs:
+                        rows = process_allBatch(papers,
+                            check_firstID(first_paperID(fileno), npapers, len(papers)))
+                        npapers += len(papers)
+                    else:
+                        rows = process_allBatch(papers)
+                    save_allRows(self, rows, npart, assignIDs, chunksize,
+                                 os.path.basename(gzf))
+                    npart += 1
+                self.closeRows(os.path.basename(gzf))
+            pbar.close()
+            print('Filling in tables S2venues, S2journals, S2fields and S2entities')
+            self._saveDimensions(_lookup['interner'], chunksize)
+            _lookup.clear()
+
+        if assignIDs:
+            print('Generating S2 to ID index')
+            print('Number of papers in the index:', S2index.merge_parts(self.index_file))
+            index = S2index(self.index_file)
+
+            print('Filling in table citations')
+            self._extendPartitions()
+            for fname in sorted(glob.glob(self.index_file + '.cites*.citing.npy')):
+                citing = np.load(fname)
+                cited = index.lookup_digests(np.load(fname.replace('.citing.npy', '.cited.npy')))
+                valid = cited > 0
+                #Parquet files of citations are written for each spool file
+                source = os.path.basename(fname).replace('.citing.npy', '')
+                self.saveRows({'citations': (link_columns('citations'),
+                                             np.column_stack((citing[valid], cited[valid])).tolist())},
+                              source, chunksize)
+                self.closeRows(source)
+                os.remove(fname)
+                os.remove(fname.replace('.citing.npy', '.cited.npy'))
+            self._loadRuns('importAll', list(link_tables), chunksize, max(ncpu, self.writers))
+
+            return
+
+        self._fillFromStaging()
 
+        return
+
+    def _createStaging(self, sql_cmds):
+        """Creates the staging tables for the tables that relate papers with
+        other elements, and any additional tables in sql_cmds, removing
+        those left by previous executions
+        """
+        print('Creating staging tables')
+        for sql_cmd in staging_schema + sql_cmds:
+            self._c.execute('DROP TABLE IF EXISTS ' + re.search(r'TABLE\s+(\w+)', sql_cmd).group(1))
+            self._c.execute(sql_cmd)
+        self._conn.commit()
+
+        return
+
+    def _fillFromStaging(self):
+        """Fills in the tables that relate papers with other elements with
+        the rows of the staging tables, where papers are identified by their
+        S2paperID, and drops the staging tables. In the lean schema profile,
+        duplicated rows are skipped, and venues and journals are stored in
+        table S2papers
+        """
+        # The join with the staging tables needs the index on S2paperID
+        if not self._hasIndex('S2papers', 'S2id'):
+            print('Creating index:', indices[0])
+            self._c.execute(indices[0])
+        self._extendPartitions()
+
+        #Rows are the primary key of the tables in the lean schema profile
+        insert = 'INSERT IGNORE INTO ' if self.schema_profile == 'lean' else 'INSERT INTO '
+        for tablename in link_tables:
+            print('Filling in table', tablename)
+            column = link_tables[tablename][0]
+            if tablename in self.folded:
+                self._c.execute('UPDATE S2papers p JOIN tmp_' + tablename + ' t ' +
+                        'ON p.S2paperID = t.S2paperID SET p.' + column + ' = t.' + column)
+            elif tablename == 'citations':
+                self._c.execute(insert + """citations (paperID1, paperID2)
+                        SELECT p1.paperID, p2.paperID FROM tmp_citations t
+                        JOIN S2papers p1 ON p1.S2paperID = t.S2paperID
+                        JOIN S2papers p2 ON p2.S2paperID = t.paperID2""")
+            else:
+                self._c.execute(insert + tablename + ' (paperID, ' + column + ') ' +
+                        'SELECT p.paperID, t.' + column + ' FROM tmp_' + tablename + ' t ' +
+                        'JOIN S2papers p ON p.S2paperID = t.S2paperID')
+            self._c.execute('DROP TABLE tmp_' + tablename)
+            self._conn.commit()
+
+        return
+
+    def importDelta(self, data_files, ncpu, chunksize=100000):
+        """
+        Updates the database with a new release of the Semantic Scholar
+        corpus, available at the indicated location. Papers are compared
+        with those in the database by their S2paperID and content hash
+        (see content_hash). New papers are inserted, modified papers are
+        updated, and papers that are no longer in the corpus are deleted.
+        Rows in the tables that relate papers with other elements are only
+        replaced for new, modified and deleted papers. Lemmas (LEMAS) are
+        kept for modified papers whose title and abstract have not changed
+
+        Changes are kept in staging tables until all data files have been
+        read, so the database is not modified if the import fails before
+        that point. The import manifest is updated with the new data files
+        """
+        print('Reading papers in the database')
+        #In databases created before content hashes were introduced, all
+        #papers will be considered modified
+        self._addContentHash()
+        _lookup['state'] = self._paperState(chunksize)
+        seen = np.zeros(len(_lookup['state'][0]), dtype=bool)
+
+        self._createStaging(delta_schema)
+
+        def save_rows(DB, rows):
+            seen[rows.pop('seen')] = True
+            DB.insertConcurrently(DB._fillYears({tablename: (delta_columns(tablename), rows[tablename])
+                                                 for tablename in rows}), chunksize=chunksize)
+
+        print('Comparing data files with the database')
+        gz_files = list_S2files(data_files)
+        checksums = {}
+
+        if ncpu:
+            #Parallel processing. Workers inherit the state arrays
+            with InternManager() as manager:
+                interner = manager.Interner()
+                saved = self._loadDimensions(interner)
+
+                def write_file(DB, item):
+                    gzf, batches = item
+                    try:
+                        for rows in batches:
+                            save_rows(DB, rows)
+                    except Exception:
+                        drain_batches(batches)
+                        raise
+                    checksums[gzf] = file_checksum(gzf)
+                    pbar.update()
+
+                lookup = {'interner': interner, 'shared_memory': self.shared_memory,
+                          'queues': stream_queues(ncpu, self.writers)}
+                with Pool(ncpu, initializer=init_worker, initargs=(lookup,)) as p:
+                    with tqdm(total = len(gz_files)) as pbar:
+                        tasks = [(process_deltaFile, gzf, chunksize) for gzf in gz_files]
+                        items = stream_imap(p, lookup['queues'], tasks, ncpu)
+                        self.writeConcurrently(zip(gz_files, items), write_file)
+                p.close()
+                p.join()
+                self._saveDimensions(interner, chunksize, saved)
+
+        else:
+            _lookup['interner'] = Interner()
+            saved = self._loadDimensions(_lookup['interner'])
+            pbar = tqdm(total=len(gz_files))
             for gzf in gz_files:
                 pbar.update(1)
-                
-                file_data = process_paperFile(gzf)
-                #Populate tables with the new data
-                self.insertInTable('S2papers', ['S2paperID', 'title', 'lowertitle', 
-                                'paperAbstract', 'entities', 'fieldsOfStudy', 's2PdfUrl',
-                                'pdfUrls', 'year', 'journalVolume', 'journalPages',
-                                'isDBLP', 'isMedline', 'doi', 'doiUrl', 'pmid'],
-                                file_data[0], chunksize=chunksize, verbose=False)
-                all_venues += file_data[1]
-                all_venues = list(set(all_venues))
-                all_journals += file_data[2]
-                all_journals = list(set(all_journals))
-                all_fields += file_data[3]
-                all_fields = list(set(all_fields))
-
+                for papers in read_S2batches(gzf, chunksize):
+                    save_rows(self, process_deltaBatch(papers))
+                checksums[gzf] = file_checksum(gzf)
             pbar.close()
+            self._saveDimensions(_lookup['interner'], chunksize, saved)
+
+        # Papers in the database that were not found in the data files
+        deleted = _lookup['state'][1][~seen].tolist()
+        self.insertInTable('tmp_delta', delta_columns('tmp_delta'), [[el, 1] for el in deleted],
+                           chunksize=chunksize, verbose=False)
+        _lookup.clear()
+
+        self._c.execute('SELECT COUNT(*) FROM tmp_S2papers WHERE paperID=0')
+        print('New papers:', self._c.fetchone()[0])
+        self._c.execute('SELECT COUNT(*) FROM tmp_delta WHERE deleted=0')
+        print('Modified papers:', self._c.fetchone()[0])
+        print('Deleted papers:', len(deleted))
+
+        print('Removing rows of modified and deleted papers')
+        for tablename in link_tables:
+            if tablename not in self.folded:
+                self._c.execute('DELETE t FROM ' + tablename + ' t JOIN tmp_delta d ' +
+                                'ON t.' + link_columns(tablename)[0] + ' = d.paperID')
+        if len(self.folded):
+            self._c.execute('UPDATE S2papers p JOIN tmp_delta d ON p.paperID = d.paperID SET ' +
+                            ', '.join(['p.' + link_tables[el][0] + ' = NULL' for el in self.folded]))
+        self._c.execute('DELETE t FROM citations t JOIN tmp_delta d ' +
+                        'ON t.paperID2 = d.paperID WHERE d.deleted=1')
+        self._c.execute('DELETE p FROM S2papers p JOIN tmp_delta d ' +
+                        'ON p.paperID = d.paperID WHERE d.deleted=1')
+        self._conn.commit()
+
+        print('Updating modified papers')
+        # Lemmas are removed if the title or the abstract have changed. The
+        # order of the assignments of a multiple-table UPDATE is not
+        # guaranteed, so this is done before updating the other columns.
+        # Texts are compared as binary strings, since the collation of the
+        # columns ignores case and accents
+        self._c.execute('UPDATE S2papers p JOIN tmp_S2papers t ON p.paperID = t.paperID ' +
+                        'SET p.LEMAS = NULL, p.langid = NULL ' +
+                        'WHERE NOT (BINARY p.title <=> BINARY t.title AND ' +
+                        'BINARY p.paperAbstract <=> BINARY t.paperAbstract)')
+        self._c.execute('UPDATE S2papers p JOIN tmp_S2papers t ON p.paperID = t.paperID SET ' +
+                        ', '.join(['p.' + el + ' = t.' + el for el in papers_columns]))
+        self._conn.commit()
+
+        print('Inserting new papers')
+        self._c.execute('INSERT INTO S2papers (' + ', '.join(papers_columns) + ') ' +
+                        'SELECT ' + ', '.join(papers_columns) + ' FROM tmp_S2papers ' +
+                        'WHERE paperID=0')
+        self._c.execute('DROP TABLE tmp_S2papers')
+        self._c.execute('DROP TABLE tmp_delta')
+        self._conn.commit()
 
-        # We sort data in alphabetical order and insert in table
-        all_venues.sort()
-        all_journals.sort()
-        all_fields.sort()
-        print('Filling in tables S2venues, S2journals and S2fields')
-        self.insertInTable('S2venues', 'venueName', [[el] for el in all_venues])
-        self.insertInTable('S2journals', 'journalName', [[el] for el in all_journals])
-        self.insertInTable('S2fields', 'fieldName', [[el] for el in all_fields])
-        """if len(all_entities):
-            all_entities.sort()
-            self.insertInTable('S2entities', 'entityname', [[el] for el in all_entities])
+        # Changes in S2papers invalidate the S2paperID to paperID index
+        S2index.remove(self.index_file)
+
+        self._fillFromStaging()
+
+        # The new data files replace those in the import manifest
+        for stage in ['importPapers', 'importCitations', 'importFields',
+                      'importAuthors', 'importEntities']:
+            self._c.execute('DELETE FROM S2manifest WHERE stage=%s', (stage,))
+            for gzf in gz_files:
+                self.setManifest(stage, os.path.basename(gzf), 'done', checksum=checksums[gzf])
+        # Modified papers have to be lemmatized again, so the lemmatization
+        # cannot be resumed from the last paper processed
+        self._c.execute("DELETE FROM S2manifest WHERE stage='lemmatize'")
+        self._conn.commit()
+
+        return
+
+    def _addContentHash(self):
+        """Adds column contentHash to table S2papers in databases created
+        before content hashes were introduced, since it is included in the
+        rows of the papers (see papers_columns)
         """
+        self._c.execute("SHOW COLUMNS FROM S2papers LIKE 'contentHash'")
+        if not len(self._c.fetchall()):
+            print('Adding column contentHash to table S2papers')
+            self._c.execute('ALTER TABLE S2papers ADD COLUMN contentHash CHAR(32) AFTER pmid')
+            self._conn.commit()
 
         return
-        
-    def importCitations(self, data_files, chunksize):
-        """Imports Citation information"""
 
-        # First, we need to create a dictionary to access the paperID 
-        # corresponding to each S2paperID
-        print('Generating S2 to ID dictionary')
+    def _paperState(self, chunksize=100000):
+        """Returns the S2paperID digests (see to_digests), paperIDs and
+        content hashes of all papers in table S2papers, as three numpy
+        arrays sorted by digest. Papers without content hash get an
+        empty one
+        """
+        all_keys = []
+        all_ids = []
+        all_hashes = []
+        for rows in tqdm(self.streamTable('S2papers', 'paperID, S2paperID, contentHash',
+                                          batchsize=chunksize)):
+            paperIDs, S2paperIDs, contentHashes = zip(*rows)
+            digests, valid = to_digests(S2paperIDs)
+            all_keys.append(digests[valid])
+            all_ids.append(np.array(paperIDs, dtype=np.uint32)[valid])
+            all_hashes.append(np.array([bytes.fromhex(el) if el else b''
+                                        for el in contentHashes], dtype='S16')[valid])
+
+        if not len(all_keys):
+            return (np.zeros(0, dtype='S20'), np.zeros(0, dtype=np.uint32),
+                    np.zeros(0, dtype='S16'))
+        keys = np.concatenate(all_keys)
+        order = np.argsort(keys, kind='stable')
+
+        return keys[order], np.concatenate(all_ids)[order], np.concatenate(all_hashes)[order]
+
+    def _saveDimensions(self, interner, chunksize, saved=None):
+        """Fills in tables S2venues, S2journals, S2fields and S2entities
+        with the values and IDs assigned by an Interner
+        :param saved: Dictionary with the largest ID already saved in each
+                      table. Only values with larger IDs are inserted
+
+        Returns:
+        A dictionary with the largest ID saved in each table
+        """
+        saved = dict(saved or {})
+        for tablename in link_tables:
+            dimension, name_column = link_tables[tablename][1:]
+            if dimension:
+                items = interner.items(dimension, saved.get(dimension, 0))
+                self.insertInTable(dimension, [link_tables[tablename][0], name_column],
+                        [[el[1], el[0]] for el in items],
+                        chunksize=chunksize, verbose=False)
+                if len(items):
+                    saved[dimension] = items[-1][1]
+                    if self.parquet is not None:
+                        #Values are written in a file named after their first ID
+                        source = 'ids%09d' % items[0][1]
+                        self.parquet.write(source, {dimension: ([link_tables[tablename][0], name_column],
+                                                                [[el[1], el[0]] for el in items])})
+                        self.parquet.close(source)
+
+        return saved
+
+    def _loadDimensions(self, interner):
+        """Loads in an Interner the values and IDs already saved in tables
+        S2venues, S2journals, S2fields and S2entities, so that new values
+        get new IDs
+
+        Returns:
+        A dictionary with the largest ID saved in each table
+        """
+        saved = {}
+        for tablename in link_tables:
+            id_column, dimension, name_column = link_tables[tablename]
+            if dimension:
+                df = self.readDBtable(dimension, selectOptions=name_column + ', ' + id_column)
+                items = [(el[0], int(el[1])) for el in df.values.tolist()]
+                interner.load(dimension, items)
+                saved[dimension] = max([el[1] for el in items], default=0)
+
+        return saved
+
+    def _maxPaperID(self):
+        """Returns the largest paperID in table S2papers, or 0"""
+        self._c.execute('SELECT MAX(paperID) FROM S2papers')
+        return self._c.fetchone()[0] or 0
+
+    def _removeRange(self, tables, firstID, lastID=None):
+        """Deletes the rows of a range of paperIDs from a list of tables
+        :param tables: List of table names
+        :param firstID: First paperID of the range
+        :param lastID: Last paperID of the range. If None, all rows with
+                       paperID larger than or equal to firstID are deleted
+        """
+        for tablename in tables:
+            if tablename in self.folded:
+                #Rows are stored in table S2papers (lean schema profile)
+                if 'S2papers' in tables:
+                    continue
+                column = 'paperID'
+                sql_cmd = 'UPDATE S2papers SET ' + link_tables[tablename][0] + '=NULL WHERE paperID>=%s'
+            else:
+                column = link_columns(tablename)[0] if tablename in link_tables else 'paperID'
+                sql_cmd = 'DELETE FROM ' + tablename + ' WHERE ' + column + '>=%s'
+            args = [firstID]
+            if lastID is not None:
+                sql_cmd += ' AND ' + column + '<=%s'
+                args.append(lastID)
+            self._c.execute(sql_cmd, args)
+        self._conn.commit()
 
-        S2_to_ID = {}
+        return
 
-        for df in self.readDBchunks('S2papers', 'paperID', chunksize=chunksize,
-                        selectOptions='paperID, S2paperID', verbose=True):
-            ID_to_S2_list = df.values.tolist()
-            S2_to_ID_list = [[el[1], el[0]] for el in ID_to_S2_list]
-            aux_dict = dict(S2_to_ID_list)
-            S2_to_ID = {**S2_to_ID, **aux_dict}
+    def readManifest(self, stage):
+        """Returns the entries of the import manifest (table S2manifest)
+        for an import stage
+        :param stage: Name of the stage (e.g., 'importPapers')
 
-        # A pass through all data files is needed to fill in tables citations
+        Returns:
+        A dictionary with an entry for each data file (or query, for the
+        lemmatization). Each entry is a dictionary with keys status, nrows,
+        checksum, firstID and lastID
+        """
+        #Databases created before the manifest was introduced lack the table
+        self._c.execute(manifest_schema)
+        self._c.execute('SELECT source, status, nrows, checksum, firstID, lastID ' +
+                        'FROM S2manifest WHERE stage=%s', (stage,))
+        keys = ['status', 'nrows', 'checksum', 'firstID', 'lastID']
+
+        return {el[0]: dict(zip(keys, el[1:])) for el in self._c.fetchall()}
+
+    def setManifest(self, stage, source, status, nrows=None, checksum=None,
+                    firstID=None, lastID=None):
+        """Creates or replaces an entry of the import manifest
+        :param stage: Name of the stage (e.g., 'importPapers')
+        :param source: Name of the data file (without the directory), or
+                       query for the lemmatization
+        :param status: 'started' before the rows of the source are written,
+                       and 'done' once all of them have been written
+        :param nrows: Number of rows (papers, citations, ...) written
+        :param checksum: MD5 checksum of the data file
+        :param firstID, lastID: Range of paperIDs of the rows written
+        """
+        self._c.execute('REPLACE INTO S2manifest (stage, source, status, nrows, checksum, ' +
+                        'firstID, lastID) VALUES (%s, %s, %s, %s, %s, %s, %s)',
+                        (stage, source[:255], status, nrows, checksum, firstID, lastID))
+        self._conn.commit()
 
-        def process_Citations(paperEntry):
-            """This function takes a dictionary with paper information as input
-            and returns a list ready to insert in citations table
-            """
-            cite_list = []
-            for el in paperEntry['outCitations']:
-                try:
-                    cite_list.append([S2_to_ID[paperEntry['id']], S2_to_ID[el]])
-                except:
-                    pass
-            return cite_list
+        return
 
-        gz_files = sorted([data_files+el for el in os.listdir(data_files) if el.startswith('s2-corpus')])
-        print('Filling in citations ...')
-        bar = tqdm(total=len(gz_files))
-        for gzf in gz_files:
-            bar.update(1)
-            with gzip.open(gzf, 'rt', encoding='utf8') as f:
-                papers_infile = f.read().replace('}\n{','},{')
-                papers_infile = json.loads('['+papers_infile+']')
+    def pendingFiles(self, stage, gz_files, remove_rows):
+        """Returns the data files that have to be imported by a stage,
+        according to the import manifest. Files recorded as 'done' are
+        skipped, unless their checksum has changed. The rows written from
+        any other recorded file (i.e., a file whose import was interrupted)
+        are removed with remove_rows, so that the file can be imported again
+        without duplicating rows
+        :param stage: Name of the stage
+        :param gz_files: Sorted list of data files
+        :param remove_rows: Function called with the data file and its
+                            manifest entry to remove the rows of the file
+
+        Returns:
+        A list of (fileno, gzfile) pairs, where fileno is the position of
+        the file in gz_files
+        """
+        manifest = self.readManifest(stage)
+        pending = []
+        for fileno, gzf in enumerate(gz_files):
+            entry = manifest.get(os.path.basename(gzf))
+            if entry is not None:
+                if entry['status'] == 'done' and entry['checksum'] == file_checksum(gzf):
+                    continue
+                elif entry['status'] == 'done':
+                    print('File', gzf, 'has changed since it was imported')
+                print('Removing rows imported from', gzf)
+                remove_rows(gzf, entry)
+            pending.append((fileno, gzf))
+
+        if len(pending) < len(gz_files):
+            print('Skipping', len(gz_files) - len(pending), 'files already imported')
+
+        return pending
+
+    def importCitations(self, data_files, ncpu, chunksize=100000):
+        """Imports Citation information"""
 
-                lista_citas = []
-                for paper in papers_infile:
-                    lista_citas += process_Citations(paper)
+        # First, we need the index to access the paperID 
+        # corresponding to each S2paperID
+        _lookup['S2index'] = self.openS2index(chunksize)
+
+        # Citations of new papers are kept in their own partitions
+        self._extendPartitions()
 
-                #Populate table with the new data
-                self.insertInTable('citations', ['paperID1', 'paperID2'], lista_citas, chunksize=chunksize, verbose=True)
-        bar.close()
+        # A pass through all data files is needed to fill in tables citations
+        print('Filling in citations ...')
+        self._importLinks(data_files, ncpu, chunksize, process_Citations,
+                          'importCitations', ['citations'])
 
-        del S2_to_ID
+        _lookup.clear()
 
         return
 
-    def importFields(self, data_files, chunksize):
+    def importFields(self, data_files, ncpu, chunksize=100000):
         """Imports Journals, Volumes, and Field of Study associated to each paper"""
 
         # We extract venues, journals and fields as dictionaries for inserting new data in tables
         df = self.readDBtable('S2venues', selectOptions='venueName, venueID')
-        venues_dict = dict(df.values.tolist())
+        _lookup['venues'] = dict(df.values.tolist())
         df = self.readDBtable('S2journals', selectOptions='journalName, journalID')
-        journals_dict = dict(df.values.tolist())
+        _lookup['journals'] = dict(df.values.tolist())
         df = self.readDBtable('S2fields', selectOptions='fieldName, fieldID')
-        fields_dict = dict(df.values.tolist())
+        _lookup['fields'] = dict(df.values.tolist())
 
-        #Now, we need to create a dictionary to access the paperID 
+        #Now, we need the index to access the paperID 
         # corresponding to each S2paperID
-        print('Generating S2 to ID dictionary')
-
-        S2_to_ID = {}
-
-        for df in self.readDBchunks('S2papers', 'paperID', chunksize=chunksize,
-                        selectOptions='paperID, S2paperID', verbose=True):
-            ID_to_S2_list = df.values.tolist()
-            S2_to_ID_list = [[el[1], el[0]] for el in ID_to_S2_list]
-            aux_dict = dict(S2_to_ID_list)
-            S2_to_ID = {**S2_to_ID, **aux_dict}
-
+        _lookup['S2index'] = self.openS2index(chunksize)
 
         # A pass through all data files is needed to extract the data of interest
         # and fill in the tables
-
-        def process_Fields(paperEntry):
-            """This function takes a dictionary with paper information as input
-            and returns lists ready to insert in the corresponding tables
-            """
-            fields_list = [[S2_to_ID[paperEntry['id']], fields_dict[el]] 
-                            for el in paperEntry['fieldsOfStudy']]
-            journal_list = [[S2_to_ID[paperEntry['id']], journals_dict[paperEntry['journalName']]]]
-            venues_list = [[S2_to_ID[paperEntry['id']], venues_dict[paperEntry['venue']]]]
-
-            return fields_list, journal_list, venues_list
-
-        gz_files = sorted([data_files+el for el in os.listdir(data_files) if el.startswith('s2-corpus')])
         print('Filling in venue, journal and field of study data ...')
-        bar = tqdm(total=len(gz_files))
-        for gzf in gz_files:
-            bar.update(1)
-            with gzip.open(gzf, 'rt', encoding='utf8') as f:
-                papers_infile = f.read().replace('}\n{','},{')
-                papers_infile = json.loads('['+papers_infile+']')
-
-                lista_fields = []
-                lista_journals = []
-                lista_venues = []
-                for paper in papers_infile:
-                    try:
-                        all_lists = process_Fields(paper)
-                    except:
-                        all_lists = [[],[],[]]
-                    lista_fields += all_lists[0]
-                    lista_journals += all_lists[1]
-                    lista_venues += all_lists[2]
+        self._importLinks(data_files, ncpu, chunksize, process_Fields,
+                          'importFields', ['paperField', 'paperVenue', 'paperJournal'])
 
-                #Populate tables
-                self.insertInTable('paperField', ['paperID', 'fieldID'], lista_fields, chunksize=chunksize, verbose=True)
-                self.insertInTable('paperVenue', ['paperID', 'venueID'], lista_venues, chunksize=chunksize, verbose=True)
-                self.insertInTable('paperJournal', ['paperID', 'journalID'], lista_journals, chunksize=chunksize, verbose=True)
-        bar.close()
+        _lookup.clear()
 
-        del S2_to_ID
-
-        return
         return
 
-    def importAuthors(self, data_files):
+    def importAuthors(self, data_files, ncpu, chunksize=100000):
         """Imports Authorship information"""
         """
                 thisfile_authors = []
@@ -381,118 +2273,142 @@ class S2manager(BaseDMsql):
 
         """
 
-
-        # First, we need to create a dictionary to access the paperID 
+        # First, we need the index to access the paperID 
         # corresponding to each S2paperID
-        print('Generating S2 to ID dictionary')
-
-        chunksize = 100000
-        cont = 0
-        S2_to_ID = {}
-        df = self.readDBtable('S2papers', limit=chunksize, selectOptions='paperID, S2paperID',
-                               filterOptions='paperID>0', orderOptions='paperID ASC')
-        while len(df):
-            cont = cont+len(df)
-            #Next time, we will read from the largest retrieved ID. This is the
-            #last element of the dataframe, given that we requested an ordered df
-            smallest_id = df['paperID'][0]
-            largest_id = df['paperID'][len(df)-1]
-            print('Number of elements processed:', cont)
-            print('Last Id read:', largest_id)
-            ID_to_S2_list = df.values.tolist()
-            S2_to_ID_list = [[el[1], el[0]] for el in ID_to_S2_list]
-            aux_dict = dict(S2_to_ID_list)
-            S2_to_ID = {**S2_to_ID, **aux_dict}
-            df = self.readDBtable('S2papers', limit=chunksize, selectOptions='paperID, S2paperID',
-                    filterOptions = 'paperID>'+str(largest_id), orderOptions='paperID ASC')
-
-        # A pass through all data files is needed to fill in table PaperAuthor
-
-        def process_Authorship(paperEntry):
-            """This function takes a dictionary with paper information as input
-            and returns a list ready to insert in PaperAuthor
-            """
-            author_list = [[S2_to_ID[paperEntry['id']], el['ids'][0]] 
-                            for el in paperEntry['authors'] if len(el['ids'])]
-
-            return author_list
+        _lookup['S2index'] = self.openS2index(chunksize)
 
-        gz_files = [data_files+el for el in os.listdir(data_files) if el.startswith('s2-corpus')]
+        # A pass through all data files is needed to fill in table paperAuthor
         print('Filling in authorship information ... ')
-        bar = tqdm.tqdm(total=len(gz_files))
-        for fileno, gzf in enumerate(gz_files):
-            bar.update(1)
-            with gzip.open(gzf, 'rt', encoding='utf8') as f:
-                papers_infile = f.read().replace('}\n{','},{')
-                papers_infile = json.loads('['+papers_infile+']')
-
-                lista_author_paper = []
-                for paper in papers_infile:
-                    lista_author_paper += process_Authorship(paper)
-                    
-                #Populate tables with the new data
-                self.insertInTable('PaperAuthor', ['paperID', 'authorID'], lista_author_paper, chunksize=100000, verbose=True)
+        self._importLinks(data_files, ncpu, chunksize, process_Authorship,
+                          'importAuthors', ['paperAuthor'])
+
+        _lookup.clear()
 
         return
 
-    def importEntities(self, data_files):
+    def importEntities(self, data_files, ncpu, chunksize=100000):
         """Imports Entities associated to each paper"""
 
-        # First, we need to create a dictionary to access the paperID 
+        # First, we need the index to access the paperID 
         # corresponding to each S2paperID
-        print('Generating S2 to ID dictionary')
-
-        chunksize = 100000
-        cont = 0
-        S2_to_ID = {}
-        df = self.readDBtable('S2papers', limit=chunksize, selectOptions='paperID, S2paperID',
-                               filterOptions='paperID>0', orderOptions='paperID ASC')
-        while len(df):
-            cont = cont+len(df)
-            #Next time, we will read from the largest retrieved ID. This is the
-            #last element of the dataframe, given that we requested an ordered df
-            smallest_id = df['paperID'][0]
-            largest_id = df['paperID'][len(df)-1]
-            print('Number of elements processed:', cont)
-            print('Last Id read:', largest_id)
-            ID_to_S2_list = df.values.tolist()
-            S2_to_ID_list = [[el[1], el[0]] for el in ID_to_S2_list]
-            aux_dict = dict(S2_to_ID_list)
-            S2_to_ID = {**S2_to_ID, **aux_dict}
-            df = self.readDBtable('S2papers', limit=chunksize, selectOptions='paperID, S2paperID',
-                    filterOptions = 'paperID>'+str(largest_id), orderOptions='paperID ASC')
+        _lookup['S2index'] = self.openS2index(chunksize)
 
         # We extract also a dictionary with entities values
-        df = self.readDBtable('S2entities', selectOptions='entityname, entityID')
-        entities_dict = dict(df.values.tolist())        
+        df = self.readDBtable('S2entities', selectOptions='entityName, entityID')
+        _lookup['entities'] = dict(df.values.tolist())
 
-        # A pass through all data files is needed to fill in table PaperAuthor
+        # A pass through all data files is needed to fill in table paperEntity
+        print('Filling in entities information ... ')
+        self._importLinks(data_files, ncpu, chunksize, process_Entities,
+                          'importEntities', ['paperEntity'])
 
-        def process_Entities(paperEntry):
-            """This function takes a dictionary with paper information as input
-            and returns a list ready to insert in PaperEntity
-            """
-            entities_list = [[S2_to_ID[paperEntry['id']], entities_dict[el]] 
-                            for el in paperEntry['entities']]
+        _lookup.clear()
 
-            return entities_list
+        return
 
-        gz_files = [data_files+el for el in os.listdir(data_files) if el.startswith('s2-corpus')]
-        print('Filling in entities information ... ')
-        bar = tqdm.tqdm(total=len(gz_files))
-        for fileno, gzf in enumerate(gz_files):
-            bar.update(1)
-            with gzip.open(gzf, 'rt', encoding='utf8') as f:
-                papers_infile = f.read().replace('}\n{','},{')
-                papers_infile = json.loads('['+papers_infile+']')
+    def openS2index(self, chunksize=100000):
+        """Returns the S2index to access the paperID corresponding
+        to each S2paperID. The index is built from table S2papers
+        if it is not available yet
+        """
+        if not S2index.exists(self.index_file):
+            print('Generating S2 to ID index')
+
+            def read_chunks():
+                for rows in tqdm(self.streamTable('S2papers', 'S2paperID, paperID',
+                                                  batchsize=chunksize)):
+                    S2paperIDs, paperIDs = zip(*rows)
+                    yield list(S2paperIDs), list(paperIDs)
+
+            npapers = S2index.build(self.index_file, read_chunks())
+            print('Number of papers in the index:', npapers)
+
+        return S2index(self.index_file)
+
+    def _importLinks(self, data_files, ncpu, chunksize, process_batch, stage, tables):
+        """Fills in the tables that relate papers with other elements
+        with the rows extracted from all data files by process_batch
+        The lookup dictionaries needed by process_batch must be available
+        in _lookup before calling this method. If ncpu is set, files
+        are processed by a pool of workers that inherit them from the
+        parent process, and written by writer threads (see writeConcurrently)
+        Imported files are recorded in the import manifest under the name
+        of the stage, so the import can be resumed after a failure. Rows
+        of the papers of an interrupted file are removed from tables
+        """
+        def write_file(DB, item):
+            gzf, batches = item
+            if self.worker_writes:
+                #The worker has already written the rows
+                nrows = batches
+            else:
+                DB.setManifest(stage, os.path.basename(gzf), 'started')
+                nrows = 0
+                try:
+                    for rows in batches:
+                        nrows += save_linkRows(DB, rows, chunksize, os.path.basename(gzf))
+                except Exception:
+                    drain_batches(batches)
+                    raise
+                DB.closeRows(os.path.basename(gzf))
+            DB.setManifest(stage, os.path.basename(gzf), 'done', nrows=nrows,
+                           checksum=file_checksum(gzf))
+            pbar.update()
+
+        def direct_tasks():
+            #Files are recorded when they are submitted to the workers
+            for gzf in pending:
+                self.setManifest(stage, os.path.basename(gzf), 'started')
+                yield (write_linkFile, process_batch, gzf, chunksize)
+
+        def remove_rows(gzf, entry):
+            #Papers of a file have consecutive paperIDs, unless some of
+            #them were imported again later
+            paperIDs = np.concatenate([np.zeros(0, dtype=np.uint32)] +
+                                      [np.array(paper_IDs(papers), dtype=np.uint32)
+                                       for papers in read_S2batches(gzf, chunksize)])
+            for firstID, lastID in id_ranges(paperIDs):
+                self._removeRange(tables, firstID, lastID)
+            if self.parquet is not None:
+                self.parquet.remove(os.path.basename(gzf), tables)
+            if self.runs is not None:
+                self.runs.remove(os.path.basename(gzf), tables)
+
+        gz_files = list_S2files(data_files)
+        pending = [gzf for fileno, gzf in self.pendingFiles(stage, gz_files, remove_rows)]
 
-                lista_entity_paper = []
-                for paper in papers_infile:
-                    lista_entity_paper += process_Entities(paper)
-                lista_entity_paper = list(set([tuple(el) for el in lista_entity_paper]))
+        if ncpu:
+            #Parallel processing
+            if self.worker_writes:
+                tasks = direct_tasks()
+                lookup = {'DB': self}
+            else:
+                tasks = [(process_linkFile, process_batch, gzf, chunksize) for gzf in pending]
+                lookup = {'queues': stream_queues(ncpu, self.writers)}
+            with Pool(ncpu, initializer=init_worker, initargs=(lookup,)) as p:
+                with tqdm(total = len(pending)) as pbar:
+                    if self.worker_writes:
+                        items = bounded_imap(p, tasks, ncpu)
+                    else:
+                        items = stream_imap(p, lookup['queues'], tasks, ncpu)
+                    self.writeConcurrently(zip(pending, items), write_file)
+            p.close()
+            p.join()
 
-                #Populate tables with the new data
-                self.insertInTable('PaperEntity', ['paperID', 'entityID'], lista_entity_paper, chunksize=100000, verbose=True)
+        else:
+            pbar = tqdm(total=len(pending))
+            for gzf in pending:
+                pbar.update(1)
+                self.setManifest(stage, os.path.basename(gzf), 'started')
+                nrows = 0
+                for papers in read_S2batches(gzf, chunksize):
+                    nrows += save_linkRows(self, process_batch(papers), chunksize,
+                                           os.path.basename(gzf))
+                self.closeRows(os.path.basename(gzf))
+                self.setManifest(stage, os.path.basename(gzf), 'done', nrows=nrows, checksum=file_checksum(gzf))
+            pbar.close()
+
+        self._loadRuns(stage, tables, chunksize, max(ncpu, self.writers))
 
         return
 
@@ -535,6 +2451,8 @@ schema = [
     doi VARCHAR(128),
     doiUrl VARCHAR(256),
     pmid VARCHAR(16),
+    #MD5 digest of the imported fields of the paper, for updates (see importDelta)
+    contentHash CHAR(32),
 
     ESP_contri TINYINT(1),
     AIselection TINYINT(1),
@@ -598,10 +2516,7 @@ schema = [
 
     paperAuthorID INT UNSIGNED AUTO_INCREMENT PRIMARY KEY,
     paperID INT UNSIGNED,
-    authorID INT UNSIGNED,
-
-    FOREIGN KEY (paperID)  REFERENCES S2papers (paperID),
-    FOREIGN KEY (authorID) REFERENCES S2authors (authorID)
+    authorID INT UNSIGNED
 
     )""",
 
@@ -610,10 +2525,7 @@ schema = [
 
 	paperEntityID INT UNSIGNED AUTO_INCREMENT PRIMARY KEY,
     paperID INT UNSIGNED,
-    entityID INT UNSIGNED,
-
-    FOREIGN KEY (paperID)  REFERENCES S2papers (paperID),
-    FOREIGN KEY (entityID) REFERENCES S2entities (entityID)
+    entityID INT UNSIGNED
 
     )""",
 
@@ -657,6 +2569,67 @@ schema = [
 
 ]
 
+#Lean schema profile (see S2manager.schema_profile). The tables relating
+#papers with other elements have no surrogate key, and use the related pair
+#as primary key, so the clustered index holds the rows themselves and
+#duplicated rows are rejected. Tables paperVenue and paperJournal are not
+#created, and the venue and journal of each paper are stored in S2papers
+lean_papers = ('ALTER TABLE S2papers ADD COLUMN venueID MEDIUMINT UNSIGNED AFTER year, ' +
+               'ADD COLUMN journalID MEDIUMINT UNSIGNED AFTER venueID')
+
+lean_links = [
+
+"""CREATE TABLE paperAuthor(
+
+    paperID INT UNSIGNED,
+    authorID INT UNSIGNED,
+
+    PRIMARY KEY (paperID, authorID)
+
+    )""",
+
+
+"""CREATE TABLE paperEntity(
+
+    paperID INT UNSIGNED,
+    entityID INT UNSIGNED,
+
+    PRIMARY KEY (paperID, entityID)
+
+    )""",
+
+
+"""CREATE TABLE paperField(
+
+    paperID INT UNSIGNED,
+    fieldID INT UNSIGNED,
+
+    PRIMARY KEY (paperID, fieldID)
+
+    )""",
+
+"""CREATE TABLE citations(
+
+    paperID1 INT UNSIGNED,
+    paperID2 INT UNSIGNED,
+
+    isInfluential TINYINT(1),
+    MethodIntent TINYINT(1),
+    BackgrIntent TINYINT(1),
+    ResultIntent TINYINT(1),
+
+    PRIMARY KEY (paperID1, paperID2)
+
+    )"""
+
+]
+
+#Tables S2papers, S2authors and the dimension tables are shared by both profiles
+lean_schema = schema[:6] + [lean_papers] + lean_links
+
+#Secondary indices and foreign keys are not included in the schema. They
+#are created by createDBindices once the data has been loaded
+
 indices = [
 
 'CREATE INDEX S2id on S2papers (S2paperID)',
@@ -664,4 +2637,121 @@ indices = [
 'CREATE INDEX paper2 on citations (paperID2)',
 'CREATE FULLTEXT INDEX pdfurls on S2papers (pdfUrls)',
 'CREATE FULLTEXT INDEX FOS on S2papers (fieldsOfStudy)'
-]
\ No newline at end of file
+]
+
+#Secondary indices of InnoDB include the primary key, so in the lean profile
+#the index on the second column of each pair covers the lookups in the
+#opposite direction (e.g., the papers citing a paper)
+lean_indices = [
+
+indices[0],
+'CREATE INDEX paper2 on citations (paperID2)',
+'CREATE INDEX author on paperAuthor (authorID)',
+'CREATE INDEX entity on paperEntity (entityID)',
+'CREATE INDEX field on paperField (fieldID)',
+'CREATE INDEX venue on S2papers (venueID)',
+'CREATE INDEX journal on S2papers (journalID)'
+] + indices[3:]
+
+#Primary keys of the partitioned tables (see S2manager.partition_years and
+#partition_ids), which must include the column used for partitioning. Papers
+#without year are stored with year 0. The primary key of table citations in
+#the lean profile already includes paperID1
+partition_keys = {
+
+'S2papers': 'ALTER TABLE S2papers MODIFY year SMALLINT UNSIGNED NOT NULL DEFAULT 0, ' +
+            'DROP PRIMARY KEY, ADD PRIMARY KEY (paperID, year)',
+'citations': 'ALTER TABLE citations DROP PRIMARY KEY, ADD PRIMARY KEY (citationID, paperID1)'
+}
+
+#Tables and indices of each schema profile
+schema_profiles = {'default': (schema, indices), 'lean': (lean_schema, lean_indices)}
+
+constraints = [
+
+'ALTER TABLE paperAuthor ADD FOREIGN KEY (paperID) REFERENCES S2papers (paperID)',
+'ALTER TABLE paperAuthor ADD FOREIGN KEY (authorID) REFERENCES S2authors (authorID)',
+'ALTER TABLE paperEntity ADD FOREIGN KEY (paperID) REFERENCES S2papers (paperID)',
+'ALTER TABLE paperEntity ADD FOREIGN KEY (entityID) REFERENCES S2entities (entityID)'
+]
+
+#Import manifest, with the data files imported by each stage (see
+#S2manager.pendingFiles) and the progress of the lemmatization
+manifest_schema = """CREATE TABLE IF NOT EXISTS S2manifest(
+
+    stage VARCHAR(32),
+    #Name of the data file, or query for the lemmatization
+    source VARCHAR(255),
+    status VARCHAR(8),
+    nrows BIGINT UNSIGNED,
+    checksum CHAR(32),
+    firstID INT UNSIGNED,
+    lastID INT UNSIGNED,
+    updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+
+    PRIMARY KEY (stage, source)
+
+    ) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_520_ci"""
+
+#Staging tables used by importAll and importDelta. Papers are identified by
+#their S2paperID until S2papers has been completely filled in
+staging_schema = [
+
+"""CREATE TABLE tmp_citations(
+
+    S2paperID CHAR(40),
+    #S2paperID of the cited paper
+    paperID2 CHAR(40)
+
+    ) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_520_ci""",
+
+"""CREATE TABLE tmp_paperAuthor(
+
+    S2paperID CHAR(40),
+    authorID INT UNSIGNED
+
+    ) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_520_ci""",
+
+"""CREATE TABLE tmp_paperField(
+
+    S2paperID CHAR(40),
+    fieldID INT UNSIGNED
+
+    ) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_520_ci""",
+
+"""CREATE TABLE tmp_paperVenue(
+
+    S2paperID CHAR(40),
+    venueID INT UNSIGNED
+
+    ) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_520_ci""",
+
+"""CREATE TABLE tmp_paperJournal(
+
+    S2paperID CHAR(40),
+    journalID INT UNSIGNED
+
+    ) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_520_ci""",
+
+"""CREATE TABLE tmp_paperEntity(
+
+    S2paperID CHAR(40),
+    entityID INT UNSIGNED
+
+    ) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_520_ci"""
+]
+
+#Additional staging tables used by importDelta, for the new and modified
+#papers (with the same columns as S2papers), and for the paperIDs of the
+#modified and deleted papers
+delta_schema = [
+
+'CREATE TABLE tmp_S2papers SELECT paperID, ' + ', '.join(papers_columns) + ' FROM S2papers LIMIT 0',
+
+"""CREATE TABLE tmp_delta(
+
+    paperID INT UNSIGNED PRIMARY KEY,
+    deleted TINYINT(1)
+
+    )"""
+]
@@ -0,0 +1,158 @@
+"""
+Columnar (Parquet) output for the rows extracted from the Semantic
+Scholar corpus
+
+The rows of each table extracted from a data file are written in file
+<parquet_dir>/<tablename>/<source>.parquet, where source is the name of
+the data file. Each table is thus a partitioned dataset that can be
+scanned by analytics tools (pyarrow, pandas, Spark, ...) much faster than
+reading it from the database, and that can be used for loading the
+database again without parsing the corpus (see S2manager.loadParquet).
+
+Files are written to a temporary name until all rows of the data file
+have been written (see ParquetSink.close), so files from interrupted
+imports are never mistaken for complete ones.
+
+pyarrow is only required if Parquet output is used.
+
+"""
+
+import os
+import glob
+import threading
+import numpy as np
+
+from dbmanager.column_batch import ColumnBatch
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+
+def batch_table(batch, columns):
+    """Converts a ColumnBatch into a pyarrow Table. The arrays of string
+    columns are used as the buffers of the Arrow columns, so values are
+    not converted to Python strings
+    :param batch: ColumnBatch
+    :param columns: List with the columns to include
+    """
+    arrays = []
+    for col in columns:
+        el = batch.arrays(col)
+        mask = None if el['valid'] is None else ~el['valid']
+        if 'values' in el:
+            arrays.append(pa.array(el['values'], mask=mask))
+        else:
+            nulls = None
+            if mask is not None:
+                nulls = pa.py_buffer(np.packbits(el['valid'], bitorder='little'))
+            arrays.append(pa.LargeStringArray.from_buffers(
+                len(batch), pa.py_buffer(el['offsets']), pa.py_buffer(el['data']),
+                nulls, -1 if mask is None else int(mask.sum())))
+
+    return pa.Table.from_arrays(arrays, names=columns)
+
+
+class ParquetSink(object):
+
+    """Writes rows of several tables to one Parquet file per data file
+    and table
+    ====================================================
+    Public methods:
+    - write: Appends rows of several tables to the files of a data file
+    - close: Completes the files of a data file
+    - remove: Deletes the files of a data file
+    - tables: Returns the tables with Parquet files
+    - files: Returns the complete Parquet files of a table
+    =====================================================
+    """
+
+    def __init__(self, parquet_dir):
+        """
+        :param parquet_dir: Directory for the Parquet files
+        """
+        if pa is None:
+            raise ImportError('pyarrow is required for writing Parquet files')
+        self.parquet_dir = parquet_dir
+        #Open writers for each (source, tablename). Different data files
+        #can be written from different threads
+        self._writers = {}
+        self._lock = threading.Lock()
+
+    def _fname(self, source, tablename):
+        return os.path.join(self.parquet_dir, tablename, source + '.parquet')
+
+    def write(self, source, table_rows):
+        """Appends rows to the files of a data file. The schema of each file
+        is inferred from the first rows written (columns without any value
+        are considered strings)
+        :param source: Name of the data file
+        :param table_rows: Dictionary with a pair (columns, rows) for each
+                           table, as in BulkDMsql.insertConcurrently. Rows
+                           can be given as a list or as a ColumnBatch
+        """
+        for tablename, (columns, rows) in table_rows.items():
+            with self._lock:
+                writer = self._writers.get((source, tablename))
+            if isinstance(rows, ColumnBatch):
+                table = batch_table(rows, columns)
+                rows = None
+            if writer is None:
+                if rows is None:
+                    arrays = table.columns
+                else:
+                    arrays = [pa.array(list(el)) for el in zip(*rows)] if len(rows) else \
+                             [pa.array([], type=pa.string()) for el in columns]
+                schema = pa.schema([(col, pa.string() if pa.types.is_null(arr.type) else arr.type)
+                                    for col, arr in zip(columns, arrays)])
+                fname = self._fname(source, tablename)
+                os.makedirs(os.path.dirname(fname), exist_ok=True)
+                writer = pq.ParquetWriter(fname + '.tmp', schema)
+                with self._lock:
+                    self._writers[(source, tablename)] = writer
+            if rows is None:
+                if table.num_rows:
+                    writer.write_table(table.cast(writer.schema))
+            elif len(rows):
+                writer.write_table(pa.Table.from_pydict(
+                    {col: list(el) for col, el in zip(columns, zip(*rows))}, schema=writer.schema))
+
+    def close(self, source):
+        """Completes the files of a data file, once all its rows have been
+        written
+        :param source: Name of the data file
+        """
+        with self._lock:
+            keys = [el for el in self._writers if el[0] == source]
+            writers = [self._writers.pop(el) for el in keys]
+        for (source, tablename), writer in zip(keys, writers):
+            writer.close()
+            fname = self._fname(source, tablename)
+            os.replace(fname + '.tmp', fname)
+
+    def remove(self, source, tables=None):
+        """Deletes the (complete or partial) files of a data file
+        :param source: Name of the data file. Files of parts of the data
+                       file (source.<part>) are also removed
+        :param tables: List of tables. If None, files of all tables are
+                       removed
+        """
+        for tablename in (tables or self.tables()):
+            for fname in glob.glob(os.path.join(glob.escape(self.parquet_dir), tablename,
+                                                glob.escape(source) + '*.parquet*')):
+                os.remove(fname)
+
+    def tables(self):
+        """Returns the sorted list of tables with Parquet files"""
+        if not os.path.isdir(self.parquet_dir):
+            return []
+        return sorted([el for el in os.listdir(self.parquet_dir)
+                       if os.path.isdir(os.path.join(self.parquet_dir, el))])
+
+    def files(self, tablename):
+        """Returns the sorted list of complete Parquet files of a table"""
+        return sorted(glob.glob(os.path.join(glob.escape(self.parquet_dir), tablename,
+                                             '*.parquet')))
@@ -0,0 +1,372 @@
+"""
+Streaming reader for Semantic Scholar corpus files
+
+Semantic Scholar distributes its corpus as a collection of gzip
+files (s2-corpus-*.gz) where each line contains the JSON record of
+one paper. The functions in this module decode the records one at
+a time, so that the memory needed to process a file does not depend
+on its size.
+
+Files are read in binary mode, and the records are decoded directly
+from the bytes of each line with one of the available JSON decoders
+(see decoders). The fastest decoder for the corpus can be selected with
+select_decoder, that benchmarks the decoders on a sample data file.
+
+Decompression can also use faster backends than the gzip module (see
+gzip_backends): the isal and zlib-ng bindings, or a pigz subprocess
+that decompresses the file in parallel with the reading process.
+
+For building subsets of the corpus, papers can be filtered right after
+they are decoded, and fields that are not needed can be discarded (see
+set_filter), so that no rows are built or written for them.
+
+"""
+
+import os
+import gzip
+import json
+import time
+import shutil
+import hashlib
+import subprocess
+import contextlib
+
+try:
+    from isal import igzip
+except ImportError:
+    igzip = None
+
+try:
+    from zlib_ng import gzip_ng
+except ImportError:
+    gzip_ng = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import simdjson
+except ImportError:
+    simdjson = None
+
+
+#Available JSON decoders. Each of them returns the dictionary of a
+#paper given the bytes of its record
+decoders = {'json': json.loads}
+if orjson is not None:
+    decoders['orjson'] = orjson.loads
+if simdjson is not None:
+    decoders['simdjson'] = simdjson.loads
+
+#Decoder used by decode_S2line
+_decoder = {'name': 'json', 'loads': json.loads}
+
+
+@contextlib.contextmanager
+def pigz_open(gzfile):
+    """Opens a gzip file for reading in binary mode through a pigz -dc
+    subprocess. Raises an error if pigz fails once the file has been read
+    :param gzfile: String containing the name of the file to read
+    """
+    proc = subprocess.Popen(['pigz', '-dc', gzfile], stdout=subprocess.PIPE)
+    try:
+        yield proc.stdout
+    except BaseException:
+        #Reading was interrupted (e.g., the generator using the file was closed)
+        proc.kill()
+        proc.stdout.close()
+        proc.wait()
+        raise
+    proc.stdout.close()
+    if proc.wait():
+        raise IOError('pigz failed decompressing ' + gzfile)
+
+
+#Available gzip decompression backends, in order of preference. Each of
+#them opens a gzip file for reading in binary mode
+gzip_backends = {}
+if igzip is not None:
+    gzip_backends['isal'] = lambda gzfile: igzip.open(gzfile, 'rb')
+if gzip_ng is not None:
+    gzip_backends['zlib-ng'] = lambda gzfile: gzip_ng.open(gzfile, 'rb')
+if shutil.which('pigz') is not None:
+    gzip_backends['pigz'] = pigz_open
+gzip_backends['gzip'] = lambda gzfile: gzip.open(gzfile, 'rb')
+
+#Backend used by read_S2lines (the first available one, by default)
+_gzip_backend = {'name': next(iter(gzip_backends))}
+
+
+def set_gzip_backend(name):
+    """Selects the backend used for decompressing the corpus
+    :param name: Name of one of the available backends (see gzip_backends)
+    """
+    if name not in gzip_backends:
+        raise ValueError('Gzip backend ' + name + ' is not available. ' +
+                         'Available backends: ' + ', '.join(gzip_backends))
+    _gzip_backend['name'] = name
+
+
+def get_gzip_backend():
+    """Returns the name of the backend used for decompressing the corpus"""
+    return _gzip_backend['name']
+
+
+def set_decoder(name):
+    """Selects the JSON decoder used for reading the corpus
+    :param name: Name of one of the available decoders (see decoders)
+    """
+    if name not in decoders:
+        raise ValueError('JSON decoder ' + name + ' is not available. ' +
+                         'Available decoders: ' + ', '.join(sorted(decoders)))
+    _decoder['name'] = name
+    _decoder['loads'] = decoders[name]
+
+
+#Filter applied to the decoded papers (see set_filter)
+_filter = {}
+
+#Fields that are needed for importing a paper, and cannot be discarded
+required_fields = ['id', 'title', 'year', 'sources']
+
+
+def set_filter(sources=None, years=None, fields=None, has_abstract=False,
+               skip_fields=None):
+    """Selects the papers of the corpus that are read, and the fields
+    of the papers that are kept. Papers are selected if they satisfy all
+    conditions. Calling set_filter without arguments removes the filter
+    :param sources: List of sources (e.g., ['DBLP', 'Medline']). Papers
+                    from any of them are selected
+    :param years: Tuple (first, last) with the range of publication years.
+                  Papers without year are not selected. Any of the limits
+                  can be None. A tuple with a single year N selects the
+                  range (N, N)
+    :param fields: List of fields of study. Papers in any of them are
+                   selected
+    :param has_abstract: If True, only papers with an abstract are selected
+    :param skip_fields: List of fields of the paper records that are not
+                        stored (e.g., ['pdfUrls', 'entities']). They are
+                        replaced by empty values of the same type
+    """
+    skip_fields = list(skip_fields or [])
+    for el in skip_fields:
+        if el in required_fields:
+            raise ValueError('Field ' + el + ' is required and cannot be skipped')
+    years = tuple(years or ())
+    if len(years) == 1:
+        years = years * 2
+    elif len(years) not in (0, 2):
+        raise ValueError('Range of years should be a single year or first-last, got ' +
+                         '-'.join([str(el) if el is not None else '' for el in years]))
+
+    _filter.clear()
+    if sources:
+        _filter['sources'] = set(sources)
+    if years and years != (None, None):
+        _filter['years'] = years
+    if fields:
+        _filter['fields'] = set(fields)
+    if has_abstract:
+        _filter['has_abstract'] = True
+    if len(skip_fields):
+        _filter['skip_fields'] = skip_fields
+
+
+def filter_paper(paperEntry):
+    """Applies the filter selected with set_filter to a paper
+    :param paperEntry: Dictionary with the information of the paper
+
+    Returns:
+    The dictionary, without the skipped fields, or None if the paper is
+    not selected
+    """
+    if 'sources' in _filter and _filter['sources'].isdisjoint(paperEntry['sources']):
+        return None
+    if 'years' in _filter:
+        year = paperEntry.get('year')
+        first, last = _filter['years']
+        if (year is None or (first is not None and year < first) or
+                (last is not None and year > last)):
+            return None
+    if 'fields' in _filter and _filter['fields'].isdisjoint(paperEntry['fieldsOfStudy']):
+        return None
+    if 'has_abstract' in _filter and not paperEntry['paperAbstract'].strip():
+        return None
+    for el in _filter.get('skip_fields', []):
+        if paperEntry.get(el) is not None:
+            paperEntry[el] = type(paperEntry[el])()
+
+    return paperEntry
+
+
+def decode_S2line(line):
+    """Returns the dictionary of a paper given its JSON record (bytes),
+    using the selected decoder. Records rejected by the decoder (e.g.,
+    strings with unpaired surrogates, that other decoders refuse) are
+    decoded with the json module
+    """
+    try:
+        return _decoder['loads'](line)
+    except ValueError:
+        return json.loads(line)
+
+
+def benchmark_decoders(gzfile, nlines=2000, names=None):
+    """Measures the time taken by each JSON decoder to decode the first
+    records of a Semantic Scholar gzip file. Decoders that do not return
+    the same dictionaries as the json module are discarded
+    :param gzfile: String containing the name of the file to read
+    :param nlines: Number of records used for the benchmark
+    :param names: List with the names of the decoders. If None, all
+                  available decoders are measured
+
+    Returns:
+    A dictionary with the time (in seconds) taken by each decoder
+    """
+    sample = []
+    for line in read_S2lines(gzfile):
+        sample.append(line)
+        if len(sample) == nlines:
+            break
+    expected = [json.loads(el) for el in sample]
+
+    times = {}
+    for name in (names or sorted(decoders)):
+        loads = decoders[name]
+        try:
+            start = time.perf_counter()
+            papers = [loads(el) for el in sample]
+            elapsed = time.perf_counter() - start
+        except ValueError:
+            continue
+        if papers == expected:
+            times[name] = elapsed
+
+    return times
+
+
+def select_decoder(gzfile, nlines=2000):
+    """Selects the fastest JSON decoder for a sample of the corpus
+    (see benchmark_decoders)
+    :param gzfile: String containing the name of a sample data file
+
+    Returns:
+    The name of the selected decoder
+    """
+    times = benchmark_decoders(gzfile, nlines)
+    set_decoder(min(times, key=times.get) if len(times) else 'json')
+
+    return _decoder['name']
+
+
+def list_S2files(data_files):
+    """Returns the sorted list of Semantic Scholar gzip files available
+    at the indicated location
+    :param data_files: Directory containing the s2-corpus-*.gz files
+    """
+    return sorted([os.path.join(data_files, el) for el in os.listdir(data_files)
+                   if el.startswith('s2-corpus')])
+
+
+def file_checksum(fname, blocksize=2**20):
+    """Returns the MD5 checksum (hexadecimal string) of a file"""
+    md5 = hashlib.md5()
+    with open(fname, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            md5.update(block)
+    return md5.hexdigest()
+
+
+def read_S2lines(gzfile):
+    """Generator over the (non-empty) lines of a Semantic Scholar gzip
+    file, without decoding the JSON records. This allows decompressing
+    a file in one process while the records are decoded in others
+    :param gzfile: String containing the name of the file to read
+
+    Yields:
+    A bytes object with the JSON record of each paper
+    """
+    with gzip_backends[_gzip_backend['name']](gzfile) as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield line
+
+
+def read_S2file(gzfile):
+    """Generator over the papers in a Semantic Scholar gzip file.
+    Records are decoded one by one when they are requested
+    :param gzfile: String containing the name of the file to read
+
+    Yields:
+    A dictionary with the information of each paper
+    """
+    for paperEntry in decode_S2lines(read_S2lines(gzfile)):
+        yield paperEntry
+
+
+def decode_S2lines(lines):
+    """Generator over the papers in an iterable of JSON records (bytes)
+    that are selected by the filter (see set_filter)
+    """
+    if not len(_filter):
+        for line in lines:
+            yield decode_S2line(line)
+        return
+
+    for line in lines:
+        paperEntry = filter_paper(decode_S2line(line))
+        if paperEntry is not None:
+            yield paperEntry
+
+
+def chunks(iterable, chunksize):
+    """Yield successive lists of at most chunksize elements
+    taken from any iterable (including generators)
+    """
+    chunk = []
+    for el in iterable:
+        chunk.append(el)
+        if len(chunk) == chunksize:
+            yield chunk
+            chunk = []
+    if len(chunk):
+        yield chunk
+
+
+def read_S2blocks(gzfile, blocksize):
+    """Generator over blocks of (non-decoded) lines of a Semantic Scholar
+    gzip file (see read_S2lines). At least one block is returned, even if
+    the file contains no papers
+    :param gzfile: String containing the name of the file to read
+    :param blocksize: Maximum number of lines in each block
+
+    Yields:
+    Lists with at most blocksize records (bytes)
+    """
+    empty = True
+    for block in chunks(read_S2lines(gzfile), blocksize):
+        empty = False
+        yield block
+    if empty:
+        yield []
+
+
+def read_S2batches(gzfile, chunksize, process=None):
+    """Generator over fixed-size batches of rows built from the papers
+    in a Semantic Scholar gzip file
+    :param gzfile: String containing the name of the file to read
+    :param chunksize: Maximum number of papers in each batch
+    :param process: Function that transforms a paper dictionary into
+                    a row. If None, the paper dictionaries are returned
+
+    Yields:
+    Lists with at most chunksize elements
+    """
+    papers = read_S2file(gzfile)
+    if process is not None:
+        papers = map(process, papers)
+    for batch in chunks(papers, chunksize):
+        yield batch
@@ -0,0 +1,216 @@
+"""
+External sort of the rows of the tables that relate papers with other
+elements (citations, paperAuthor, paperField, ...)
+
+Rows extracted from the data files arrive in the order of the files, so
+inserting them directly makes InnoDB insert in random positions of the
+clustered index, and duplicated rows cannot be detected. Instead, the
+rows of each data file can be spilled to disk as sorted runs without
+duplicates, and loaded once all data files have been processed, merging
+the runs of each table so that rows are inserted in primary key order
+and without duplicates (see S2manager.sort_dir).
+
+Rows are pairs of unsigned 32-bit integers (e.g., paperID1, paperID2),
+which are packed into a single 64-bit key for sorting. Runs are saved in
+<sort_dir>/<tablename>/<source>.<run>.npy, where source is the name of
+the data file, and only get their final name once all rows of the data
+file have been spilled (see RunSpool.close), as for the Parquet output.
+
+"""
+
+import os
+import glob
+import shutil
+import hashlib
+import threading
+import numpy as np
+
+
+def pack_rows(rows):
+    """Returns the sorted array of 64-bit keys of a list of rows
+    :param rows: List of pairs of unsigned 32-bit integers, or array
+                 with two columns
+    """
+    rows = np.asarray(rows, dtype=np.uint64).reshape(-1, 2)
+    return np.sort((rows[:, 0] << np.uint64(32)) | rows[:, 1])
+
+
+def unpack_keys(keys):
+    """Returns an array with two columns (uint32) with the rows of an array
+    of 64-bit keys (see pack_rows)
+    """
+    return np.column_stack(((keys >> np.uint64(32)).astype(np.uint32),
+                            (keys & np.uint64(0xffffffff)).astype(np.uint32)))
+
+
+class RunSpool(object):
+
+    """Spills the rows of several tables to sorted runs on disk, and
+    merges the runs of each table
+    ====================================================
+    Public methods:
+    - write: Adds rows of several tables from a data file
+    - close: Spills the remaining rows of a data file
+    - remove: Deletes the runs of a data file
+    - tables: Returns the tables with runs
+    - runs: Returns the complete runs of a table
+    - merge: Returns the rows of a table sorted and without duplicates
+    - bounds: Returns the range of the first elements of the rows of a table
+    - checksum: Returns a digest identifying the runs of a table
+    - clear: Deletes all runs of a table
+    =====================================================
+    """
+
+    def __init__(self, sort_dir, run_rows=1<<22):
+        """
+        :param sort_dir: Directory for the runs
+        :param run_rows: Maximum number of rows of a table and data file
+                         kept in memory before they are spilled to a run
+        """
+        self.sort_dir = sort_dir
+        self.run_rows = run_rows
+        #Arrays of keys and number of runs spilled for each (source,
+        #tablename). Different data files can be written from different
+        #threads
+        self._buffers = {}
+        self._nruns = {}
+        self._lock = threading.Lock()
+
+    def _fname(self, source, tablename, run):
+        return os.path.join(self.sort_dir, tablename, '%s.%05d.npy' % (source, run))
+
+    def _spill(self, source, tablename, keys):
+        """Saves an array of keys as a new run, with a temporary name"""
+        keys = np.unique(keys)
+        with self._lock:
+            run = self._nruns.get((source, tablename), 0)
+            self._nruns[(source, tablename)] = run + 1
+        fname = self._fname(source, tablename, run)
+        os.makedirs(os.path.dirname(fname), exist_ok=True)
+        with open(fname + '.tmp', 'wb') as fout:
+            np.save(fout, keys)
+
+    def write(self, source, table_rows):
+        """Adds rows of several tables from a data file
+        :param source: Name of the data file
+        :param table_rows: Dictionary with a pair (columns, rows) for each
+                           table, as in BulkDMsql.insertConcurrently
+        """
+        for tablename, (columns, rows) in table_rows.items():
+            if not len(rows):
+                continue
+            keys = pack_rows(rows)
+            with self._lock:
+                buffer = self._buffers.setdefault((source, tablename), [])
+                buffer.append(keys)
+                if sum([len(el) for el in buffer]) < self.run_rows:
+                    continue
+                del self._buffers[(source, tablename)]
+            self._spill(source, tablename, np.concatenate(buffer))
+
+    def close(self, source):
+        """Spills the rows of a data file that are still in memory, and
+        gives the runs of the data file their final names
+        :param source: Name of the data file
+        """
+        with self._lock:
+            keys = [el for el in self._buffers if el[0] == source]
+            buffers = [self._buffers.pop(el) for el in keys]
+        for (source, tablename), buffer in zip(keys, buffers):
+            self._spill(source, tablename, np.concatenate(buffer))
+        with self._lock:
+            keys = [el for el in self._nruns if el[0] == source]
+            nruns = [self._nruns.pop(el) for el in keys]
+        for (source, tablename), nrun in zip(keys, nruns):
+            for run in range(nrun):
+                fname = self._fname(source, tablename, run)
+                os.replace(fname + '.tmp', fname)
+
+    def remove(self, source, tables=None):
+        """Deletes the (complete or partial) runs of a data file
+        :param source: Name of the data file. Runs of parts of the data
+                       file (source.<part>) are also removed
+        :param tables: List of tables. If None, runs of all tables are
+                       removed
+        """
+        for tablename in (tables or self.tables()):
+            for fname in glob.glob(os.path.join(glob.escape(self.sort_dir), tablename,
+                                                glob.escape(source) + '*.npy*')):
+                os.remove(fname)
+
+    def tables(self):
+        """Returns the sorted list of tables with runs"""
+        if not os.path.isdir(self.sort_dir):
+            return []
+        return sorted([el for el in os.listdir(self.sort_dir)
+                       if os.path.isdir(os.path.join(self.sort_dir, el)) and '.' not in el])
+
+    def runs(self, tablename):
+        """Returns the sorted list of complete runs of a table"""
+        return sorted(glob.glob(os.path.join(glob.escape(self.sort_dir), tablename, '*.npy')))
+
+    def merge(self, tablename, blocksize=1<<20, low=None, high=None):
+        """Merges the complete runs of a table
+        :param tablename: Name of the table
+        :param blocksize: Number of rows read from each run at a time
+        :param low, high: If not None, only rows whose first element is in
+                          the range [low, high) are merged
+
+        Returns:
+        An iterator over arrays with two columns (uint32) with the rows of
+        the table, sorted and without duplicates
+        """
+        runs = [np.load(el, mmap_mode='r') for el in self.runs(tablename)]
+        if low is not None:
+            #Keys of the range are contiguous in each run
+            start = np.uint64(low) << np.uint64(32)
+            stop = np.uint64(high) << np.uint64(32) if high < 1<<32 else None
+            runs = [run[np.searchsorted(run, start):
+                        len(run) if stop is None else np.searchsorted(run, stop)]
+                    for run in runs]
+        pos = [0] * len(runs)
+        while True:
+            active = [idx for idx in range(len(runs)) if pos[idx] < len(runs[idx])]
+            if not len(active):
+                break
+            blocks = [runs[idx][pos[idx]:pos[idx]+blocksize] for idx in active]
+            #Keys of the runs that are not in the blocks are larger than
+            #the last key of their block, so all keys up to the smallest
+            #last key are in the blocks, and can be merged now
+            bound = min([el[-1] for el in blocks])
+            parts = []
+            for idx, block in zip(active, blocks):
+                nkeys = np.searchsorted(block, bound, side='right')
+                parts.append(block[:nkeys])
+                pos[idx] += nkeys
+            yield unpack_keys(np.unique(np.concatenate(parts)))
+
+    def bounds(self, tablename):
+        """Returns the smallest and largest first elements of the rows in
+        the complete runs of a table, or None if there are no runs
+        """
+        runs = [np.load(el, mmap_mode='r') for el in self.runs(tablename)]
+        if not len(runs):
+            return None
+        return (int(min([el[0] for el in runs]) >> np.uint64(32)),
+                int(max([el[-1] for el in runs]) >> np.uint64(32)))
+
+    def checksum(self, tablename):
+        """Returns the MD5 digest (hexadecimal string) of the names and
+        sizes of the complete runs of a table, which changes whenever runs
+        are added or removed
+        """
+        content = '\n'.join(['%s %d' % (os.path.basename(el), os.path.getsize(el))
+                             for el in self.runs(tablename)])
+        return hashlib.md5(content.encode('utf8')).hexdigest()
+
+    def clear(self, tablename):
+        """Deletes all runs of a table, once they have been loaded. The
+        directory of the table is renamed first, so that runs are never
+        partially removed
+        """
+        dirname = os.path.join(self.sort_dir, tablename)
+        if os.path.isdir(dirname):
+            shutil.rmtree(dirname + '.removed', ignore_errors=True)
+            os.replace(dirname, dirname + '.removed')
+            shutil.rmtree(dirname + '.removed')
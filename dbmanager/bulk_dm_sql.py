@@ -0,0 +1,799 @@
+"""
+Extension of BaseDMsql with bulk loading facilities for MySQL databases
+
+BaseDMsql.insertInTable builds multi-row INSERT statements that have to
+be generated by the client and parsed by the server. For large tables,
+BulkDMsql can instead write the rows into tab-separated spool files and
+ingest them with LOAD DATA LOCAL INFILE. The bulk path is selected per
+table, and INSERT statements are used for all other tables, or if the
+server does not accept LOAD DATA LOCAL INFILE.
+
+Full table scans can be streamed through an unbuffered server-side cursor
+(see BulkDMsql.streamQuery), instead of paginating with LIMIT queries that
+build a pandas DataFrame for each page.
+
+Rows can be inserted in batches whose size is chosen for each table from
+the size of its rows, the max_allowed_packet of the server, and the
+throughput measured for previous batches (see BatchSizer), instead of a
+fixed number of rows for all tables.
+
+Import stages can run in a bulk-load session (see BulkDMsql.bulkSession),
+in which all connections of the manager skip unique and foreign key
+checks and binary logging, and commit every given number of rows or bytes
+instead of after every statement.
+
+Rows produced by other processes (e.g., the workers of a multiprocessing
+Pool) can be written by writer threads with their own connections (see
+BulkDMsql.writeConcurrently), so that the database ingests data while
+new rows are being produced. Rows for several independent tables can
+also be inserted concurrently, over connections taken from a pool shared
+by the manager and all its clones (see BulkDMsql.insertConcurrently).
+
+"""
+
+import os
+import re
+import copy
+import queue
+import inspect
+import contextlib
+import time
+import tempfile
+import threading
+import MySQLdb
+import MySQLdb.cursors
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+from dbmanager.dbManager.base_dm_sql import BaseDMsql
+from dbmanager.column_batch import ColumnBatch
+
+
+#Characters that need to be escaped in a field of a spool file, using
+#the default escape character of LOAD DATA (backslash)
+_escape_table = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n',
+                               '\r': '\\r', '\0': '\\0'})
+
+#Error codes of LOAD DATA LOCAL INFILE statements rejected because local
+#files are disabled by the server (1148, 3948) or the client (2068)
+_load_unsupported = (1148, 2068, 3948)
+
+
+def tsv_field(value):
+    """Returns the representation of a value in a spool file for
+    LOAD DATA. NULL values are represented as \\N
+    """
+    if value is None:
+        return '\\N'
+    elif isinstance(value, str):
+        return value.translate(_escape_table)
+    elif isinstance(value, bool):
+        return str(int(value))
+    elif isinstance(value, bytes):
+        return value.decode('utf8').translate(_escape_table)
+    else:
+        return str(value)
+
+
+def session_sql(settings):
+    """Returns the SET SESSION statement for a dictionary of session
+    variables
+    """
+    return 'SET SESSION ' + ', '.join(['{0}={1}'.format(name, value)
+                                       for name, value in settings.items()])
+
+
+def sql_tablename(sql_cmd):
+    """Returns the name of the table modified by a CREATE INDEX or
+    ALTER TABLE statement
+    """
+    match = re.search(r'\bALTER\s+TABLE\s+`?(\w+)', sql_cmd, re.IGNORECASE)
+    if match is None:
+        match = re.search(r'\bON\s+`?(\w+)', sql_cmd, re.IGNORECASE)
+    return match.group(1)
+
+
+def write_tsv(fout, arguments):
+    """Writes rows in a spool file for LOAD DATA
+    :param fout: File object opened in text mode with utf8 encoding
+    :param arguments: List of rows (lists or tuples) to write
+    """
+    for row in arguments:
+        fout.write('\t'.join([tsv_field(el) for el in row]))
+        fout.write('\n')
+
+
+#Session variables of a bulk-load session (see BulkDMsql.bulkSession).
+#Variables that cannot be changed by the user of the connection (e.g.,
+#sql_log_bin requires administrative privileges) are skipped
+bulk_settings = {'autocommit': 0, 'unique_checks': 0, 'foreign_key_checks': 0,
+                 'sql_log_bin': 0}
+
+
+def row_bytes(arguments, nsample=200):
+    """Returns the average number of bytes of a row in a spool file for
+    LOAD DATA, which is also a good estimate of its size in an INSERT
+    statement
+    :param arguments: List of rows, or ColumnBatch
+    :param nsample: Number of rows used for the estimate, evenly spaced
+                    in the list
+    """
+    if not len(arguments):
+        return 1
+    if isinstance(arguments, ColumnBatch):
+        return max(1, arguments.nbytes() // len(arguments) + len(arguments.columns))
+    step = max(1, len(arguments) // nsample)
+    sample = [arguments[idx] for idx in range(0, len(arguments), step)]
+    nbytes = sum([len('\t'.join([tsv_field(el) for el in row]).encode('utf8', 'replace')) + 1
+                  for row in sample])
+
+    return max(1, nbytes // len(sample))
+
+
+class BatchSizer(object):
+
+    """Chooses the number of bytes of each batch of rows inserted in a
+    table. Each table starts with start_bytes, and the size is changed by
+    a factor after every batch: while the throughput (bytes per second)
+    improves the size keeps moving in the same direction, and otherwise
+    the direction is reversed with a smaller factor, so that the size
+    converges to the one with the best throughput. Sizes are bounded by
+    max_allowed_packet for INSERT statements, and by max_load_bytes for
+    spool files of LOAD DATA
+    """
+
+    def __init__(self, start_bytes=4<<20, min_bytes=64<<10, max_load_bytes=256<<20):
+        self.start_bytes = start_bytes
+        self.min_bytes = min_bytes
+        self.max_load_bytes = max_load_bytes
+        #max_allowed_packet of the server (set by BulkDMsql)
+        self.max_packet = None
+        #For each table, current size, factor and throughput of last batch
+        self._tables = {}
+        #Batches of the same table can be inserted from different threads
+        self._lock = threading.Lock()
+
+    def _limit(self, load):
+        if load:
+            return self.max_load_bytes
+        #Leave room for the SQL syntax and the escaping of the values
+        return max(self.min_bytes, (self.max_packet or 4<<20) // 2)
+
+    def rows(self, tablename, nbytes, load):
+        """Returns the number of rows of the next batch of a table
+        :param tablename: Name of the table
+        :param nbytes: Average number of bytes of a row (see row_bytes)
+        :param load: True if rows are inserted with LOAD DATA
+        """
+        with self._lock:
+            state = self._tables.setdefault(tablename, {'bytes': self.start_bytes,
+                                                        'factor': 2.0, 'rate': None})
+            target = min(state['bytes'], self._limit(load))
+
+        return max(1, int(target // nbytes))
+
+    def update(self, tablename, nbytes, seconds, load):
+        """Records the time used for inserting a batch of a table, and
+        adjusts the size of the next batches
+        :param tablename: Name of the table
+        :param nbytes: Number of bytes of the batch
+        :param seconds: Time used for inserting the batch
+        :param load: True if rows were inserted with LOAD DATA
+        """
+        with self._lock:
+            state = self._tables[tablename]
+            #The last (short) batch of a list of rows is not representative
+            if nbytes < state['bytes'] / 2:
+                return
+            rate = nbytes / max(seconds, 1e-6)
+            if state['rate'] is not None and rate < state['rate']:
+                #Reverse the direction, with a factor closer to 1 (but
+                #keep probing sizes about 20% larger and smaller)
+                factor = 1 / state['factor']
+                state['factor'] = factor ** 0.5 if abs(factor - 1) > 0.2 else factor
+            state['rate'] = rate
+            state['bytes'] = min(max(state['bytes'] * state['factor'], self.min_bytes),
+                                 self._limit(load))
+
+    def sizes(self):
+        """Returns the current batch size (bytes) of each table"""
+        with self._lock:
+            return {tablename: int(el['bytes']) for tablename, el in self._tables.items()}
+
+
+class BulkDMsql(BaseDMsql):
+
+    """Extension of BaseDMsql with LOAD DATA ingestion
+    ====================================================
+    Public methods:
+    - setLoadTables: Selects the tables that will be filled in with LOAD DATA
+    - insertInTable: Inserts rows in a table, using LOAD DATA for the
+                     selected tables, and INSERT statements otherwise
+    - insertBatches: Inserts rows in a table in batches of adaptive size
+    - executeInserts: Inserts rows in a table using INSERT statements
+    - loadInTable: Inserts rows in a table using LOAD DATA LOCAL INFILE
+    - setSession: Sets session variables in all connections
+    - setChecks: Enables or disables unique and foreign key checks
+    - bulkSession: Context manager for a bulk-load session
+    - commit: Commits the transactions of the manager's connections
+    - executeConcurrently: Executes index and constraint creation statements
+                           for different tables over separate connections
+    - clone: Returns a copy of the manager with its own connection
+    - acquire, release: Take and return managers with their own connections
+                        from the connection pool
+    - insertConcurrently: Inserts rows in several tables concurrently
+    - writeConcurrently: Writes items produced by an iterable with writer
+                         threads, each with its own connection
+    - streamQuery: Streams the result of a query in batches of rows
+    - streamTable: Streams selected columns and rows of a table
+    =====================================================
+    """
+
+    def __init__(self, *args, load_tables=None, spool_dir=None, writers=1, pool_size=4,
+                 adaptive_batches=False, **kwargs):
+        """
+        Initialization of the manager. Apart from the arguments of BaseDMsql,
+        :param load_tables: List of tables that will be filled in with LOAD DATA
+        :param spool_dir: Directory for the spool files. If None, the default
+                          directory for temporary files is used
+        :param writers: Default number of writer threads of writeConcurrently
+        :param pool_size: Maximum number of connections in the connection pool
+        :param adaptive_batches: If True, rows are inserted in batches whose
+                                 size is adjusted for each table (see
+                                 BatchSizer), and the chunksize argument of
+                                 insertInTable is ignored
+        """
+        super().__init__(*args, **kwargs)
+
+        #Connection arguments are kept for opening additional connections
+        self._connArgs = inspect.signature(BaseDMsql.__init__).bind(
+                                self, *args, **kwargs).arguments
+        self._loadConn = None
+        #Session variables that are set when a new connection is opened
+        self._session = {}
+        #Number of rows and bytes between commits in a bulk-load session
+        #(None outside bulk-load sessions), and rows and bytes written by
+        #the manager since the last commit
+        self._commitEvery = None
+        self._pending = [0, 0]
+        self.spool_dir = spool_dir
+        self.writers = max(1, writers)
+        self.pool_size = max(1, pool_size)
+        #The pool and its slots are shared by all clones of the manager
+        self._pool = queue.LifoQueue()
+        self._poolSlots = threading.BoundedSemaphore(self.pool_size)
+        #The batch sizes are also shared by all clones
+        self.sizer = BatchSizer() if adaptive_batches else None
+        self.setLoadTables(load_tables)
+
+    def setLoadTables(self, load_tables):
+        """Selects the tables that will be filled in with LOAD DATA
+        :param load_tables: List of table names, or None
+        """
+        self.load_tables = set(load_tables or [])
+
+    def _connect(self, **options):
+        """Opens a new connection to the database with the arguments
+        used for creating the manager
+        :param options: Additional arguments for MySQLdb.connect
+        """
+        params = {'host': self._connArgs.get('db_server'),
+                  'user': self._connArgs.get('db_user'),
+                  'passwd': self._connArgs.get('db_password'),
+                  'db': self._connArgs.get('db_name'),
+                  'charset': 'utf8mb4'}
+        if self._connArgs.get('unix_socket'):
+            params['unix_socket'] = self._connArgs.get('unix_socket')
+        if self._connArgs.get('db_port'):
+            params['port'] = int(self._connArgs.get('db_port'))
+        params.update(options)
+
+        conn = MySQLdb.connect(**params)
+        if len(self._session):
+            cursor = conn.cursor()
+            cursor.execute(session_sql(self._session))
+            cursor.close()
+
+        return conn
+
+    def setSession(self, settings):
+        """Sets session variables in all connections of the manager
+        (including those opened afterwards). Variables that cannot be set
+        are reported and skipped
+        :param settings: Dictionary with the value of each variable
+
+        Returns:
+        The dictionary of variables that have been set
+        """
+        applied = {}
+        for name, value in settings.items():
+            try:
+                self._c.execute(session_sql({name: value}))
+                applied[name] = value
+            except MySQLdb.Error as e:
+                print('Session variable', name, 'cannot be set (', e, ')')
+        if not len(applied):
+            return applied
+        #A new dictionary, since the previous one is shared with the clones
+        self._session = dict(self._session, **applied)
+
+        if self._loadConn is not None:
+            cursor = self._loadConn.cursor()
+            cursor.execute(session_sql(applied))
+            cursor.close()
+        #Idle connections of the pool are closed, so that new ones are
+        #opened with the new settings
+        while True:
+            try:
+                DB = self._pool.get_nowait()
+            except queue.Empty:
+                break
+            DB.commit()
+            DB._closeClone()
+
+        return applied
+
+    def setChecks(self, enabled):
+        """Enables or disables unique and foreign key checks in all
+        connections of the manager (including those opened afterwards).
+        Checks should be disabled only while bulk loading data that are
+        known to be consistent
+        :param enabled: Boolean
+        """
+        self.setSession({'foreign_key_checks': int(enabled), 'unique_checks': int(enabled)})
+
+        return
+
+    @contextlib.contextmanager
+    def bulkSession(self, commit_rows=None, commit_bytes=None):
+        """Context manager for a bulk-load session (e.g., one import
+        stage). All connections of the manager (see setSession) use the
+        settings in bulk_settings, and rows inserted by the manager and its
+        clones are committed every commit_rows rows or commit_bytes bytes,
+        whichever comes first, as well as when a clone is returned to the
+        connection pool and when commit is called. The previous settings
+        are restored, after a final commit, when the session ends
+        :param commit_rows: Number of rows between commits (None for no limit)
+        :param commit_bytes: Number of bytes between commits (None for no limit)
+        """
+        self._c.execute('SELECT ' + ', '.join(['@@SESSION.' + el for el in bulk_settings]))
+        previous = dict(zip(bulk_settings, [int(el) for el in self._c.fetchone()]))
+        self.commit()
+        applied = self.setSession(bulk_settings)
+        self._commitEvery = (commit_rows or 0, commit_bytes or 0)
+        try:
+            yield self
+        finally:
+            self.commit()
+            self._commitEvery = None
+            self.setSession({el: previous[el] for el in applied})
+
+    def commit(self):
+        """Commits the transactions of the connections of the manager"""
+        self._conn.commit()
+        if self._loadConn is not None:
+            self._loadConn.commit()
+        self._pending = [0, 0]
+
+    def _rowsWritten(self, nrows, nbytes):
+        """Records rows written by the manager, and commits them if
+        required by the bulk-load session, or always outside bulk-load
+        sessions
+        :param nrows: Number of rows
+        :param nbytes: Function returning the number of bytes of the rows
+                       (only called if commits depend on bytes)
+        """
+        if self._commitEvery is None:
+            self.commit()
+            return
+        commit_rows, commit_bytes = self._commitEvery
+        self._pending[0] += nrows
+        if commit_bytes:
+            self._pending[1] += nbytes()
+        if (commit_rows and self._pending[0] >= commit_rows) or \
+           (commit_bytes and self._pending[1] >= commit_bytes):
+            self.commit()
+
+    def _hasIndex(self, tablename, indexname):
+        """Returns True if the table has an index with the given name"""
+        self._c.execute('SHOW INDEX FROM ' + tablename + " WHERE Key_name='" + indexname + "'")
+        return len(self._c.fetchall()) > 0
+
+    def _hasForeignKey(self, tablename, column):
+        """Returns True if a column of a table has a foreign key constraint"""
+        self._c.execute('SELECT CONSTRAINT_NAME FROM information_schema.KEY_COLUMN_USAGE ' +
+                        'WHERE TABLE_SCHEMA=DATABASE() AND TABLE_NAME=%s AND COLUMN_NAME=%s ' +
+                        'AND REFERENCED_TABLE_NAME IS NOT NULL', (tablename, column))
+        return len(self._c.fetchall()) > 0
+
+    def executeConcurrently(self, sql_cmds, nthreads=1):
+        """Executes a list of CREATE INDEX or ALTER TABLE statements.
+        Statements for the same table are executed sequentially, in the
+        given order, but statements for different tables are executed
+        concurrently over separate connections, using up to nthreads
+        threads. Errors are reported, but do not stop the execution
+        :param sql_cmds: List of SQL statements
+        :param nthreads: Maximum number of concurrent connections
+
+        Returns:
+        A list of pairs (statement, error) with the statements that failed
+        """
+        by_table = {}
+        for sql_cmd in sql_cmds:
+            by_table.setdefault(sql_tablename(sql_cmd), []).append(sql_cmd)
+
+        def execute_table(table_cmds):
+            failures = []
+            conn = self._connect()
+            cursor = conn.cursor()
+            for sql_cmd in table_cmds:
+                print('Executing:', sql_cmd)
+                try:
+                    cursor.execute(sql_cmd)
+                    conn.commit()
+                except MySQLdb.Error as e:
+                    print('Error executing:', sql_cmd, '(', e, ')')
+                    failures.append((sql_cmd, e))
+            cursor.close()
+            conn.close()
+            return failures
+
+        with ThreadPoolExecutor(max_workers=max(1, nthreads)) as executor:
+            failures = list(executor.map(execute_table, by_table.values()))
+
+        return [el for table_failures in failures for el in table_failures]
+
+    def clone(self, shared_pool=True):
+        """Returns a copy of the manager that uses a new connection to the
+        database, so that it can be used from another thread. The session
+        settings of the manager (see setSession) are applied to the new
+        connection
+        :param shared_pool: If False, the clone gets its own (empty)
+                            connection pool. This is required for clones
+                            used in other processes (e.g., the workers of
+                            a multiprocessing Pool), which must not use the
+                            connections of the parent process
+        """
+        DB = copy.copy(self)
+        DB._conn = self._connect()
+        DB._c = DB._conn.cursor()
+        DB._loadConn = None
+        DB._pending = [0, 0]
+        DB.load_tables = set(self.load_tables)
+        if not shared_pool:
+            DB._pool = queue.LifoQueue()
+            DB._poolSlots = threading.BoundedSemaphore(self.pool_size)
+            if self.sizer is not None:
+                DB.sizer = BatchSizer()
+                DB.sizer.max_packet = self.sizer.max_packet
+
+        return DB
+
+    def _closeClone(self):
+        """Closes the connections of a clone (see clone) that is no longer
+        used. Uncommitted changes are rolled back
+        """
+        self._c.close()
+        self._conn.close()
+        if self._loadConn is not None:
+            self._loadConn.close()
+            self._loadConn = None
+
+    def acquire(self):
+        """Returns a clone of the manager from the connection pool, creating
+        it if there are no idle clones. Waits if pool_size clones are already
+        in use. Clones must be returned to the pool with release
+        """
+        self._poolSlots.acquire()
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            try:
+                return self.clone()
+            except Exception:
+                self._poolSlots.release()
+                raise
+
+    def release(self, DB):
+        """Returns a clone obtained with acquire to the connection pool.
+        In a bulk-load session, its pending rows are committed first
+        """
+        if DB._commitEvery is not None:
+            DB.commit()
+        self._pool.put(DB)
+        self._poolSlots.release()
+
+    def streamQuery(self, sql_cmd, params=None, batchsize=100000, arrays=False):
+        """Executes a query and yields its result in batches. Rows are read
+        through an unbuffered server-side cursor over a new connection, so
+        the query is planned only once, the result is never kept in memory
+        as a whole, and the connection of the manager can be used (e.g., for
+        updating the rows that are being read) while the result is consumed
+        :param sql_cmd: SELECT statement
+        :param params: Parameters of the statement, if any
+        :param batchsize: Number of rows of each batch
+        :param arrays: If True, each batch is a dictionary with a numpy
+                       array of values for each column of the result
+                       (numeric columns get a numeric dtype, and all other
+                       columns, or columns with NULL values, dtype object).
+                       Otherwise, each batch is a list of tuples
+        """
+        conn = self._connect(cursorclass=MySQLdb.cursors.SSCursor)
+        try:
+            cursor = conn.cursor()
+            #Batches are processed by the client while the server waits
+            #for the rest of the result to be read
+            cursor.execute('SET SESSION net_write_timeout=86400')
+            cursor.execute(sql_cmd, params)
+            columns = [el[0] for el in cursor.description]
+            while True:
+                rows = cursor.fetchmany(batchsize)
+                if not len(rows):
+                    break
+                if arrays:
+                    yield {col: np.array(values) if all(isinstance(el, (int, float))
+                                                        for el in values)
+                                else np.array(values, dtype=object)
+                           for col, values in zip(columns, zip(*rows))}
+                else:
+                    yield list(rows)
+            cursor.close()
+        finally:
+            conn.close()
+
+    def streamTable(self, tablename, selectOptions=None, filterOptions=None,
+                    orderOptions=None, batchsize=100000, arrays=False):
+        """Streams the rows of a table in batches (see streamQuery)
+        :param tablename: Name of the table
+        :param selectOptions: Columns to read (all columns if None)
+        :param filterOptions: Condition of the WHERE clause, if any
+        :param orderOptions: ORDER BY clause, if any
+        :param batchsize: Number of rows of each batch
+        :param arrays: If True, batches are dictionaries of numpy arrays
+        """
+        sql_cmd = 'SELECT ' + (selectOptions or '*') + ' FROM ' + tablename
+        if filterOptions:
+            sql_cmd += ' WHERE ' + filterOptions
+        if orderOptions:
+            sql_cmd += ' ORDER BY ' + orderOptions
+
+        return self.streamQuery(sql_cmd, batchsize=batchsize, arrays=arrays)
+
+    def insertConcurrently(self, table_rows, chunksize=None, verbose=False):
+        """Inserts rows in several tables. Each table is filled in over its
+        own connection, taken from the connection pool, so that the tables
+        are filled in concurrently
+        :param table_rows: Dictionary with a pair (columns, arguments) for
+                           each table (see insertInTable)
+        :param chunksize: See insertInTable
+        :param verbose: See insertInTable
+        """
+        items = [(tablename, columns, arguments)
+                 for tablename, (columns, arguments) in table_rows.items() if len(arguments)]
+        if len(items) <= 1:
+            for tablename, columns, arguments in items:
+                self.insertInTable(tablename, columns, arguments,
+                                   chunksize=chunksize, verbose=verbose)
+            return
+
+        def insert(item):
+            DB = self.acquire()
+            try:
+                DB.insertInTable(*item, chunksize=chunksize, verbose=verbose)
+            finally:
+                self.release(DB)
+
+        with ThreadPoolExecutor(max_workers=len(items)) as executor:
+            list(executor.map(insert, items))
+
+        return
+
+    def writeConcurrently(self, items, write, nwriters=None, queuesize=None,
+                          discard=None):
+        """Writes the items produced by an iterable (e.g., the results of
+        the workers of a multiprocessing Pool) with writer threads, each of
+        them with its own clone of the manager. Items are passed to the
+        writers through a bounded queue, so iteration stops while the
+        writers are busy and the queue is full. If a writer fails, the
+        remaining items are discarded and the error is raised again
+        :param items: Iterable over the items to write
+        :param write: Function called as write(DB, item) in a writer thread,
+                      where DB is the clone of the manager of the thread
+        :param nwriters: Number of writer threads. If None, self.writers
+        :param queuesize: Maximum number of items waiting in the queue. If
+                          None, one per writer
+        :param discard: If not None, function called as discard(item) for
+                        the items discarded after a writer has failed (e.g.,
+                        to consume items that the iteration waits for)
+        """
+        nwriters = nwriters or self.writers
+        items_queue = queue.Queue(maxsize=queuesize or nwriters)
+        errors = []
+
+        def writer():
+            DB = self.clone()
+            while True:
+                item = items_queue.get()
+                if item is None:
+                    break
+                if not len(errors):
+                    try:
+                        write(DB, item)
+                    except Exception as e:
+                        errors.append(e)
+                elif discard is not None:
+                    discard(item)
+            if DB._commitEvery is not None:
+                DB.commit()
+            DB._closeClone()
+
+        threads = [threading.Thread(target=writer) for el in range(nwriters)]
+        for thread in threads:
+            thread.start()
+        try:
+            for item in items:
+                if len(errors):
+                    break
+                items_queue.put(item)
+        finally:
+            for thread in threads:
+                items_queue.put(None)
+            for thread in threads:
+                thread.join()
+
+        if len(errors):
+            raise errors[0]
+
+        return
+
+    def insertInTable(self, tablename, columns, arguments, chunksize=None, verbose=False):
+        """
+        Inserts new records in a table. If the table has been selected
+        with setLoadTables, rows are ingested with LOAD DATA. Otherwise,
+        or if the server does not accept LOAD DATA LOCAL INFILE, INSERT
+        statements are used (see executeInserts)
+        Rows can be given as a list or as a ColumnBatch. If the manager
+        uses adaptive batches, chunksize is ignored (see insertBatches)
+        """
+        if self.sizer is not None and len(arguments):
+            return self.insertBatches(tablename, columns, arguments, verbose=verbose)
+
+        return self._insertRows(tablename, columns, arguments, chunksize, verbose)
+
+    def insertBatches(self, tablename, columns, arguments, verbose=False):
+        """Inserts new records in a table, in batches whose size is chosen
+        from the size of the rows, the max_allowed_packet of the server and
+        the throughput of previous batches of the same table (see BatchSizer)
+        :param tablename: Name of the table
+        :param columns: Name of the column, or list of names of the columns
+        :param arguments: List of rows (lists or tuples), or ColumnBatch
+        :param verbose: If True, information about the progress is shown
+        """
+        if self.sizer.max_packet is None:
+            self._c.execute('SELECT @@max_allowed_packet')
+            self.sizer.max_packet = int(self._c.fetchone()[0])
+        nbytes = row_bytes(arguments)
+        start = 0
+        while start < len(arguments):
+            load = tablename in self.load_tables
+            nrows = self.sizer.rows(tablename, nbytes, load)
+            batch = arguments[start:start+nrows]
+            init_time = time.time()
+            self._insertRows(tablename, columns, batch, len(batch), False)
+            self.sizer.update(tablename, len(batch) * nbytes, time.time() - init_time, load)
+            start += len(batch)
+            if verbose:
+                print('Inserted', start, 'of', len(arguments), 'rows in table', tablename,
+                      '(batches of', nrows, 'rows)')
+
+        return
+
+    def _insertRows(self, tablename, columns, arguments, chunksize, verbose):
+        """Inserts rows with LOAD DATA or INSERT statements (see
+        insertInTable)
+        """
+        if tablename in self.load_tables:
+            try:
+                return self.loadInTable(tablename, columns, arguments,
+                                        chunksize=chunksize, verbose=verbose)
+            except MySQLdb.OperationalError as e:
+                #Other errors may happen after some spool files have been
+                #loaded, and inserting all rows again would duplicate them
+                if e.args[0] not in _load_unsupported:
+                    raise
+                print('LOAD DATA not available for table', tablename, '(', e, ')')
+                print('Using INSERT statements instead')
+                self.load_tables.discard(tablename)
+
+        return self.executeInserts(tablename, columns, arguments,
+                                   chunksize=chunksize, verbose=verbose)
+
+    def executeInserts(self, tablename, columns, arguments, chunksize=None, verbose=False):
+        """
+        Inserts new records in a table using multi-row INSERT statements.
+        Unlike BaseDMsql.insertInTable, which commits after every chunk,
+        rows are committed as decided by _rowsWritten (i.e., after every
+        chunk, or at the cadence of the bulk-load session)
+        :param tablename: Name of the table
+        :param columns: Name of the column, or list of names of the columns
+        :param arguments: List of rows (lists or tuples) to insert, or a
+                          ColumnBatch
+        :param chunksize: If not None, rows are inserted in statements of
+                          at most chunksize rows
+        :param verbose: If True, information about the progress is shown
+        """
+        if isinstance(columns, str):
+            columns = [columns]
+        if not len(arguments):
+            return
+        if isinstance(arguments, ColumnBatch):
+            arguments = arguments.rows(columns)
+        elif not isinstance(arguments[0], (list, tuple)):
+            arguments = [[el] for el in arguments]
+        if not chunksize:
+            chunksize = len(arguments)
+
+        sql_cmd = ('INSERT INTO ' + tablename + ' (' + ','.join(columns) + ') VALUES (' +
+                   ','.join(['%s'] * len(columns)) + ')')
+        for start in range(0, len(arguments), chunksize):
+            batch = arguments[start:start+chunksize]
+            self._c.executemany(sql_cmd, batch)
+            self._rowsWritten(len(batch), lambda: row_bytes(batch) * len(batch))
+            if verbose:
+                print('Inserted', min(start+chunksize, len(arguments)), 'of',
+                      len(arguments), 'rows in table', tablename)
+
+        return
+
+    def loadInTable(self, tablename, columns, arguments, chunksize=None, verbose=False):
+        """
+        Inserts new records in a table using LOAD DATA LOCAL INFILE. Rows
+        are written into a tab-separated spool file, which is removed
+        after the data have been loaded
+        :param tablename: Name of the table
+        :param columns: Name of the column, or list of names of the columns
+        :param arguments: List of rows (lists or tuples) to insert, or a
+                          ColumnBatch, whose spool files are written
+                          without building the rows (see ColumnBatch.tsv)
+        :param chunksize: If not None, rows are written and loaded in
+                          spool files of at most chunksize rows
+        :param verbose: If True, information about the progress is shown
+        """
+        if isinstance(columns, str):
+            columns = [columns]
+        if not len(arguments):
+            return
+        if not chunksize:
+            chunksize = len(arguments)
+
+        if self._loadConn is None:
+            self._loadConn = self._connect(local_infile=1)
+        cursor = self._loadConn.cursor()
+
+        for start in range(0, len(arguments), chunksize):
+            fd, spool_file = tempfile.mkstemp(suffix='.tsv', prefix=tablename + '_',
+                                              dir=self.spool_dir)
+            try:
+                if isinstance(arguments, ColumnBatch):
+                    with os.fdopen(fd, 'wb') as fout:
+                        fout.write(arguments[start:start+chunksize].tsv(columns))
+                else:
+                    with os.fdopen(fd, 'w', encoding='utf8', newline='\n') as fout:
+                        write_tsv(fout, arguments[start:start+chunksize])
+                sql_cmd = ("LOAD DATA LOCAL INFILE '" + spool_file.replace('\\', '/') + "' " +
+                           'INTO TABLE ' + tablename + ' CHARACTER SET utf8mb4 ' +
+                           "FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' " +
+                           "LINES TERMINATED BY '\\n' " +
+                           '(' + ','.join(columns) + ')')
+                cursor.execute(sql_cmd)
+                nbytes = os.path.getsize(spool_file)
+                self._rowsWritten(min(chunksize, len(arguments) - start), lambda: nbytes)
+            finally:
+                os.remove(spool_file)
+            if verbose:
+                print('Loaded', min(start+chunksize, len(arguments)), 'of',
+                      len(arguments), 'rows in table', tablename)
+
+        cursor.close()
+
+        return
@@ -0,0 +1,415 @@
+"""
+Columnar batches of rows
+
+A ColumnBatch keeps the rows of a table column by column: numeric columns
+are typed numpy arrays, and string columns are stored as an array of
+offsets into a single buffer with the UTF-8 bytes of all values. Both kinds
+of columns have an optional validity mask for NULL values.
+
+This avoids building one Python list per row, and allows writing the
+rows in a spool file for LOAD DATA (see ColumnBatch.tsv) or in a Parquet
+file without creating per-row objects, since the escaping of the values
+and the assembly of the lines are vectorized with numpy.
+
+Batches are pickled as a few arrays, which is much cheaper than pickling
+lists of rows. They can also be moved between processes through shared
+memory (see ColumnBatch.share and SharedBatch.attach), so that the result
+of a worker of a multiprocessing Pool is not sent through a pipe.
+
+"""
+
+import numpy as np
+from multiprocessing import shared_memory, resource_tracker
+
+
+#Characters that need to be escaped in a spool file for LOAD DATA, and
+#the character that follows the escape character (backslash) for each
+_escape_chars = np.array([ord('\\'), ord('\t'), ord('\n'), ord('\r'), 0], dtype=np.uint8)
+_escape_codes = np.arange(256, dtype=np.uint8)
+_escape_codes[_escape_chars] = [ord('\\'), ord('t'), ord('n'), ord('r'), ord('0')]
+
+
+def _scatter(out, data, offsets, starts):
+    """Copies the segments of a buffer to the indicated positions of
+    another buffer
+    :param out: Destination buffer (uint8 array)
+    :param data: Source buffer (uint8 array)
+    :param offsets: Array with the limits of the segments in data
+                    (len(offsets) = number of segments + 1)
+    :param starts: Array with the position in out of each segment
+    """
+    lengths = np.diff(offsets)
+    out[np.repeat(starts - offsets[:-1], lengths) + np.arange(offsets[0], offsets[-1])] = \
+        data[offsets[0]:offsets[-1]]
+
+
+def _escape(offsets, data):
+    """Escapes the special characters of the values of a string column
+    for LOAD DATA
+
+    Returns:
+    The offsets and buffer of the escaped values
+    """
+    escaped = np.isin(data, _escape_chars)
+    if not escaped.any():
+        return offsets, data
+    #Number of escaped characters before each position
+    before = np.concatenate(([0], np.cumsum(escaped)))
+    pos = np.arange(len(data)) + before[:-1]
+    out = np.empty(len(data) + before[-1], dtype=np.uint8)
+    out[pos] = data
+    out[pos[escaped]] = ord('\\')
+    out[pos[escaped] + 1] = _escape_codes[data[escaped]]
+
+    return offsets + before[offsets], out
+
+
+def _with_nulls(offsets, data, valid):
+    """Replaces the values of the invalid (NULL) positions of a column by
+    the NULL representation of LOAD DATA (\\N)
+
+    Returns:
+    The offsets and buffer of the new values
+    """
+    if valid is None or valid.all():
+        return offsets, data
+    lengths = np.where(valid, np.diff(offsets), 2)
+    new_offsets = np.concatenate(([0], np.cumsum(lengths)))
+    out = np.empty(new_offsets[-1], dtype=np.uint8)
+    _scatter_rows(out, data, offsets, new_offsets[:-1], valid)
+    out[new_offsets[:-1][~valid]] = ord('\\')
+    out[new_offsets[:-1][~valid] + 1] = ord('N')
+
+    return new_offsets, out
+
+
+def _scatter_rows(out, data, offsets, starts, rows):
+    """Same as _scatter, only for the segments selected by a boolean array"""
+    lengths = np.where(rows, np.diff(offsets), 0)
+    src = np.repeat(offsets[:-1], lengths) + _ranges(lengths)
+    out[np.repeat(starts, lengths) + _ranges(lengths)] = data[src]
+
+
+def _ranges(lengths):
+    """Returns the concatenation of arange(n) for each n in lengths"""
+    total = int(lengths.sum())
+    ends = np.cumsum(lengths)
+    return np.arange(total) - np.repeat(ends - lengths, lengths)
+
+
+class ColumnBatch(object):
+
+    """Rows of a table stored column by column
+    ====================================================
+    Public methods:
+    - from_lists: Creates a batch from a list of values for each column
+    - from_arrays: Creates a batch from a numpy array for each column
+    - concat: Creates a batch with the rows of several batches
+    - with_column: Returns a copy of the batch with an additional column
+    - fill_nulls: Returns a copy of the batch without NULL values in a column
+    - column: Returns the values of a column
+    - arrays: Returns the arrays that store a column
+    - nbytes: Returns the size of the values of the batch
+    - rows: Returns the rows as a list of tuples
+    - tsv: Returns the rows in the format of a spool file for LOAD DATA
+    - share: Copies the batch to a shared memory block
+    =====================================================
+    """
+
+    def __init__(self, columns, data, nrows):
+        """
+        :param columns: List with the names of the columns
+        :param data: Dictionary with the arrays of each column. Numeric
+                     columns have keys 'values' and 'valid', and string
+                     columns have keys 'offsets', 'data' and 'valid'
+                     (valid is None if there are no NULL values)
+        :param nrows: Number of rows
+        """
+        self.columns = list(columns)
+        self._data = data
+        self._nrows = nrows
+
+    @staticmethod
+    def from_lists(columns, lists, dtypes=None):
+        """Creates a batch from the values of each column
+        :param columns: List with the names of the columns
+        :param lists: List with a list of values for each column. None
+                      values are NULL
+        :param dtypes: Dictionary with the numpy dtype of each numeric
+                       column. Other columns are strings
+        """
+        dtypes = dtypes or {}
+        data = {}
+        nrows = len(lists[0]) if len(lists) else 0
+        for col, values in zip(columns, lists):
+            valid = np.fromiter((el is not None for el in values), dtype=bool, count=nrows)
+            if valid.all():
+                valid = None
+            if col in dtypes:
+                if valid is not None:
+                    values = [0 if el is None else el for el in values]
+                data[col] = {'values': np.array(values, dtype=dtypes[col]), 'valid': valid}
+            else:
+                encoded = [b'' if el is None else
+                           (el if isinstance(el, str) else str(el)).encode('utf8', 'surrogatepass')
+                           for el in values]
+                offsets = np.zeros(nrows + 1, dtype=np.int64)
+                np.cumsum(np.fromiter(map(len, encoded), dtype=np.int64, count=nrows),
+                          out=offsets[1:])
+                data[col] = {'offsets': offsets,
+                             'data': np.frombuffer(b''.join(encoded), dtype=np.uint8),
+                             'valid': valid}
+
+        return ColumnBatch(columns, data, nrows)
+
+    @staticmethod
+    def from_arrays(columns, arrays):
+        """Creates a batch with numeric columns, without NULL values
+        :param columns: List with the names of the columns
+        :param arrays: List with a numpy array for each column
+        """
+        data = {col: {'values': np.asarray(values), 'valid': None}
+                for col, values in zip(columns, arrays)}
+
+        return ColumnBatch(columns, data, len(arrays[0]) if len(arrays) else 0)
+
+    @staticmethod
+    def concat(batches):
+        """Returns a batch with the rows of several batches with the same
+        columns
+        """
+        batches = [el for el in batches if len(el)] or batches[:1]
+        if len(batches) == 1:
+            return batches[0]
+        data = {}
+        for col in batches[0].columns:
+            parts = [el._data[col] for el in batches]
+            if any(el['valid'] is not None for el in parts):
+                valid = np.concatenate([np.ones(len(batch), dtype=bool) if el['valid'] is None
+                                        else el['valid'] for el, batch in zip(parts, batches)])
+            else:
+                valid = None
+            if 'values' in parts[0]:
+                data[col] = {'values': np.concatenate([el['values'] for el in parts]),
+                             'valid': valid}
+            else:
+                starts = np.cumsum([0] + [len(el['data']) for el in parts[:-1]])
+                data[col] = {'offsets': np.concatenate([parts[0]['offsets'][:1]] +
+                                                       [el['offsets'][1:] + start
+                                                        for el, start in zip(parts, starts)]),
+                             'data': np.concatenate([el['data'] for el in parts]),
+                             'valid': valid}
+
+        return ColumnBatch(batches[0].columns, data, sum([len(el) for el in batches]))
+
+    def with_column(self, name, values, dtype, position=0, valid=None):
+        """Returns a copy of the batch with an additional numeric column
+        :param name: Name of the column
+        :param values: List or array with the values of the column
+        :param dtype: numpy dtype of the column
+        :param position: Position of the new column
+        :param valid: Boolean array with False for NULL values, or None if
+                      the column has no NULL values
+        """
+        data = dict(self._data)
+        data[name] = {'values': np.asarray(values, dtype=dtype), 'valid': valid}
+        columns = self.columns[:position] + [name] + self.columns[position:]
+
+        return ColumnBatch(columns, data, self._nrows)
+
+    def fill_nulls(self, name, value, sentinel=None):
+        """Returns a copy of the batch where the NULL values of a numeric
+        column are replaced by a value
+        :param name: Name of the column
+        :param value: Value for the NULL positions
+        :param sentinel: If not None, positions holding this value (e.g.,
+                         a placeholder for missing values) are also replaced
+        """
+        el = self._data[name]
+        valid = el['valid']
+        if sentinel is not None:
+            valid = (el['values'] != sentinel) & (True if valid is None else valid)
+        if valid is None or valid.all():
+            return self
+        data = dict(self._data)
+        data[name] = {'values': np.where(valid, el['values'], value).astype(el['values'].dtype),
+                      'valid': None}
+
+        return ColumnBatch(self.columns, data, self._nrows)
+
+    def __len__(self):
+        return self._nrows
+
+    def __getitem__(self, key):
+        """Returns a batch with a slice of the rows"""
+        start, stop, step = key.indices(self._nrows)
+        if step != 1:
+            raise ValueError('Only contiguous slices of a ColumnBatch are supported')
+        stop = max(start, stop)
+        data = {}
+        for col, el in self._data.items():
+            valid = None if el['valid'] is None else el['valid'][start:stop]
+            if 'values' in el:
+                data[col] = {'values': el['values'][start:stop], 'valid': valid}
+            else:
+                offsets = el['offsets'][start:stop+1]
+                data[col] = {'offsets': offsets - offsets[0],
+                             'data': el['data'][offsets[0]:offsets[-1]], 'valid': valid}
+
+        return ColumnBatch(self.columns, data, stop - start)
+
+    def __iter__(self):
+        return iter(self.rows())
+
+    def column(self, name):
+        """Returns the values of a column. Numeric columns without NULL
+        values are returned as numpy arrays, and other columns as lists
+        """
+        el = self._data[name]
+        if 'values' in el:
+            if el['valid'] is None:
+                return el['values']
+            return [value if flag else None
+                    for value, flag in zip(el['values'].tolist(), el['valid'])]
+
+        data = el['data'].tobytes()
+        offsets = el['offsets'].tolist()
+        values = [data[offsets[idx]:offsets[idx+1]].decode('utf8', 'surrogatepass')
+                  for idx in range(self._nrows)]
+        if el['valid'] is not None:
+            values = [value if flag else None for value, flag in zip(values, el['valid'])]
+
+        return values
+
+    def arrays(self, name):
+        """Returns the dictionary with the arrays of a column (see
+        __init__), e.g. for building the column of another columnar
+        format without converting the values to Python objects
+        """
+        return self._data[name]
+
+    def nbytes(self):
+        """Returns the number of bytes of the values of the batch (the
+        UTF-8 bytes of string columns, and the size of the arrays of
+        numeric columns)
+        """
+        return sum([el['values'].nbytes if 'values' in el else len(el['data'])
+                    for el in self._data.values()])
+
+    def rows(self, columns=None):
+        """Returns the rows of the batch, as a list of tuples
+        :param columns: List with the columns of each row. If None, all
+                        columns of the batch are included
+        """
+        values = []
+        for col in (columns or self.columns):
+            column = self.column(col)
+            values.append(column.tolist() if isinstance(column, np.ndarray) else column)
+
+        return list(zip(*values))
+
+    def _text(self, col):
+        """Returns the offsets and buffer of the values of a column in the
+        format of a spool file for LOAD DATA
+        """
+        el = self._data[col]
+        if 'values' in el:
+            values = el['values']
+            if values.dtype.kind == 'b':
+                values = values.astype(np.int8)
+            text = values.astype('S32')
+            lengths = np.char.str_len(text).astype(np.int64)
+            data = text.view(np.uint8).reshape(self._nrows, 32)[
+                np.arange(32) < lengths[:, None]]
+            offsets = np.concatenate(([0], np.cumsum(lengths)))
+        else:
+            offsets, data = _escape(el['offsets'], el['data'])
+
+        return _with_nulls(offsets, data, el['valid'])
+
+    def tsv(self, columns=None):
+        """Returns the rows of the batch in the format of a spool file for
+        LOAD DATA (tab-separated fields, escaped with backslashes, and
+        NULL values represented as \\N), as in bulk_dm_sql.write_tsv
+        :param columns: List with the columns of each row. If None, all
+                        columns of the batch are included
+
+        Returns:
+        A bytes object with the UTF-8 encoded file
+        """
+        columns = columns or self.columns
+        if not self._nrows:
+            return b''
+        fields = [self._text(col) for col in columns]
+        lengths = np.column_stack([np.diff(el[0]) for el in fields])
+        #Each field is followed by a tab, or by a newline at the end of the line
+        line_lengths = lengths.sum(axis=1) + len(columns)
+        line_starts = np.concatenate(([0], np.cumsum(line_lengths)))
+        out = np.full(line_starts[-1], ord('\t'), dtype=np.uint8)
+        out[line_starts[1:] - 1] = ord('\n')
+        field_starts = line_starts[:-1, None] + np.cumsum(lengths, axis=1) - lengths + \
+                       np.arange(len(columns))
+        for idx, (offsets, data) in enumerate(fields):
+            _scatter(out, data, offsets, field_starts[:, idx])
+
+        return out.tobytes()
+
+    def share(self):
+        """Copies the arrays of the batch to a block of shared memory
+
+        Returns:
+        A SharedBatch, that can be sent to other processes (e.g., as the
+        result of a task of a multiprocessing Pool) at a negligible cost
+        """
+        arrays = []
+        for col in self.columns:
+            for key, arr in self._data[col].items():
+                if arr is not None:
+                    arrays.append((col, key, np.ascontiguousarray(arr)))
+        size = sum([el[2].nbytes for el in arrays])
+        shm = shared_memory.SharedMemory(create=True, size=max(1, size))
+        #The block is released by the process that attaches it, so the
+        #resource tracker must not remove it when this process ends
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        layout = []
+        start = 0
+        for col, key, arr in arrays:
+            shm.buf[start:start+arr.nbytes] = arr.view(np.uint8).reshape(-1)
+            layout.append((col, key, arr.dtype.str, len(arr), start))
+            start += arr.nbytes
+        shm.close()
+
+        return SharedBatch(shm.name, self.columns, self._nrows, layout)
+
+
+class SharedBatch(object):
+
+    """Reference to a ColumnBatch copied to shared memory (see
+    ColumnBatch.share)
+    """
+
+    def __init__(self, name, columns, nrows, layout):
+        self.name = name
+        self.columns = columns
+        self.nrows = nrows
+        self.layout = layout
+
+    def __len__(self):
+        return self.nrows
+
+    def attach(self):
+        """Returns the ColumnBatch, and releases the shared memory block.
+        It can only be called once
+        """
+        shm = shared_memory.SharedMemory(name=self.name)
+        try:
+            data = dict([(col, {'valid': None}) for col in self.columns])
+            for col, key, dtype, length, start in self.layout:
+                dtype = np.dtype(dtype)
+                data[col][key] = np.frombuffer(shm.buf, dtype=dtype, count=length,
+                                               offset=start).copy()
+        finally:
+            shm.close()
+            shm.unlink()
+
+        return ColumnBatch(self.columns, data, self.nrows)
@@ -0,0 +1,70 @@
+"""
+Tests of the comparison of the papers of a new corpus release with those
+in the database (see S2manager.process_deltaBatch)
+
+S2manager requires MySQLdb and the BaseDMsql submodule, so the tests are
+skipped if it cannot be imported
+
+"""
+
+import numpy as np
+import pytest
+
+S2manager = pytest.importorskip('dbmanager.S2manager')
+
+
+def paper(num, **fields):
+    """Returns the record of a paper of the corpus"""
+    entry = {'id': '%040x' % num, 'title': 'Title %d' % num, 'paperAbstract': 'Abstract',
+             'entities': [], 'fieldsOfStudy': ['Medicine'], 's2PdfUrl': '', 'pdfUrls': [],
+             'year': 2000, 'journalVolume': '', 'journalPages': '', 'sources': [],
+             'doi': '', 'doiUrl': '', 'pmid': '', 'venue': '', 'journalName': '',
+             'outCitations': ['%040x' % (num + 1)], 'inCitations': [], 'authors': []}
+    entry.update(fields)
+    return entry
+
+
+def set_state(papers, paperIDs):
+    """Sets the papers of the database used by process_deltaBatch"""
+    keys, valid = S2manager.to_digests([el['id'] for el in papers])
+    hashes = np.array([bytes.fromhex(S2manager.content_hash(el)) for el in papers],
+                      dtype='S16')
+    order = np.argsort(keys, kind='stable')
+    S2manager._lookup['state'] = (keys[order], np.array(paperIDs, dtype=np.uint32)[order],
+                                  hashes[order])
+
+
+@pytest.fixture(autouse=True)
+def lookup():
+    S2manager._lookup['interner'] = S2manager.Interner()
+    yield
+    S2manager._lookup.pop('interner', None)
+    S2manager._lookup.pop('state', None)
+
+
+def test_empty_state():
+    """All papers are new if the database is empty"""
+    set_state([], [])
+    papers = [paper(el) for el in range(5)]
+    rows = S2manager.process_deltaBatch(papers)
+    assert rows['seen'] == []
+    assert rows['tmp_delta'] == []
+    assert len(rows['tmp_S2papers']) == 5
+    assert rows['tmp_S2papers'].column('paperID').tolist() == [0] * 5
+    assert len(rows['tmp_citations']) == 5
+
+
+def test_unchanged_and_modified():
+    old = [paper(el) for el in range(4)]
+    set_state(old, [10, 11, 12, 13])
+    papers = [old[0], paper(1, title='Changed'), old[2], paper(100)]
+    rows = S2manager.process_deltaBatch(papers)
+    assert sorted(rows['seen']) == [0, 1, 2]
+    assert rows['tmp_S2papers'].column('paperID').tolist() == [11, 0]
+    assert rows['tmp_delta'] == [[11, 0]]
+    #Citations of unchanged papers are only kept if the cited paper is new
+    cites = [tuple(el) for el in rows['tmp_citations']]
+    assert (old[0]['id'], old[1]['id']) not in cites
+    assert (old[2]['id'], '%040x' % 3) not in cites
+    assert ('%040x' % 1, '%040x' % 2) in cites
+    assert ('%040x' % 100, '%040x' % 101) in cites
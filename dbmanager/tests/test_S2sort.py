@@ -0,0 +1,125 @@
+"""
+Tests of the merge of sorted runs (see S2sort.RunSpool), which must
+return the same rows as np.unique over all rows written
+
+"""
+
+import numpy as np
+import pytest
+
+from dbmanager.S2sort import RunSpool, pack_rows, unpack_keys
+
+
+def random_rows(rng, nrows, maxfirst=1000, maxsecond=1<<32):
+    """Random pairs of unsigned 32-bit integers, with many duplicates if
+    maxfirst and maxsecond are small
+    """
+    return np.column_stack((rng.integers(0, maxfirst, size=nrows),
+                            rng.integers(0, maxsecond, size=nrows))).astype(np.uint32)
+
+
+def write_files(spool, rng, nfiles, maxfirst=1000, maxsecond=1<<32):
+    """Writes the rows of several data files, in several calls per file
+
+    Returns:
+    An array with all rows written
+    """
+    written = []
+    for fileno in range(nfiles):
+        source = 's2-corpus-%03d.gz' % fileno
+        for el in range(int(rng.integers(1, 5))):
+            rows = random_rows(rng, int(rng.integers(0, 300)), maxfirst, maxsecond)
+            spool.write(source, {'citations': (['paperID1', 'paperID2'], rows.tolist())})
+            written.append(rows)
+        spool.close(source)
+
+    return np.concatenate(written)
+
+
+def merged(spool, tablename, **kwargs):
+    blocks = list(spool.merge(tablename, **kwargs))
+    if not len(blocks):
+        return np.zeros((0, 2), dtype=np.uint32)
+    return np.concatenate(blocks)
+
+
+def test_pack_rows():
+    rows = np.array([[0, 0], [5, 1], [0, (1<<32) - 1], [(1<<32) - 1, (1<<32) - 1],
+                     [5, 0]], dtype=np.uint32)
+    keys = pack_rows(rows.tolist())
+    assert np.all(np.diff(keys.astype(np.float64)) >= 0)
+    assert np.array_equal(unpack_keys(keys), np.unique(rows, axis=0))
+
+
+@pytest.mark.parametrize('seed, run_rows, blocksize', [(0, 1<<22, 1<<20), (1, 50, 1<<20),
+                                                       (2, 50, 7), (3, 1, 3), (4, 100, 1)])
+def test_merge(tmp_path, seed, run_rows, blocksize):
+    rng = np.random.default_rng(seed)
+    spool = RunSpool(str(tmp_path), run_rows=run_rows)
+    #Small ranges, so that the same rows are found in different runs
+    rows = write_files(spool, rng, 6, maxfirst=50, maxsecond=20)
+    assert spool.tables() == ['citations']
+    result = merged(spool, 'citations', blocksize=blocksize)
+    assert result.dtype == np.uint32
+    assert np.array_equal(result, np.unique(rows, axis=0))
+
+
+def test_merge_large_values(tmp_path):
+    rng = np.random.default_rng(5)
+    spool = RunSpool(str(tmp_path), run_rows=64)
+    rows = write_files(spool, rng, 4, maxfirst=1<<32)
+    assert np.array_equal(merged(spool, 'citations', blocksize=16), np.unique(rows, axis=0))
+
+
+@pytest.mark.parametrize('low, high', [(0, 100), (0, 1), (10, 11), (250, 500), (999, 1<<32),
+                                       (400, 400), (2000, 3000), (0, 1<<32)])
+def test_merge_range(tmp_path, low, high):
+    rng = np.random.default_rng(6)
+    spool = RunSpool(str(tmp_path), run_rows=80)
+    rows = write_files(spool, rng, 5)
+    expected = np.unique(rows[(rows[:, 0] >= low) & (rows[:, 0] < high)], axis=0)
+    result = merged(spool, 'citations', blocksize=13, low=low, high=high)
+    assert np.array_equal(result.reshape(-1, 2), expected.reshape(-1, 2))
+
+
+def test_merge_partitions(tmp_path):
+    """The ranges of consecutive partitions cover all rows once"""
+    rng = np.random.default_rng(7)
+    spool = RunSpool(str(tmp_path), run_rows=100)
+    rows = write_files(spool, rng, 5)
+    lows = [0, 100, 101, 500, 900]
+    highs = lows[1:] + [1<<32]
+    result = np.concatenate([merged(spool, 'citations', low=low, high=high)
+                             for low, high in zip(lows, highs)])
+    assert np.array_equal(result, np.unique(rows, axis=0))
+
+
+def test_incomplete_runs(tmp_path):
+    """Runs of a data file that has not been closed are not merged"""
+    rng = np.random.default_rng(8)
+    spool = RunSpool(str(tmp_path), run_rows=10)
+    rows = write_files(spool, rng, 2)
+    spool.write('s2-corpus-999.gz', {'citations': (['paperID1', 'paperID2'],
+                                                   random_rows(rng, 100).tolist())})
+    assert np.array_equal(merged(spool, 'citations'), np.unique(rows, axis=0))
+    spool.remove('s2-corpus-999.gz')
+    assert len(spool.runs('citations'))
+
+
+def test_bounds(tmp_path):
+    rng = np.random.default_rng(9)
+    spool = RunSpool(str(tmp_path), run_rows=30)
+    assert spool.bounds('citations') is None
+    rows = write_files(spool, rng, 3)
+    assert spool.bounds('citations') == (int(rows[:, 0].min()), int(rows[:, 0].max()))
+
+
+def test_clear(tmp_path):
+    rng = np.random.default_rng(10)
+    spool = RunSpool(str(tmp_path), run_rows=30)
+    write_files(spool, rng, 2)
+    checksum = spool.checksum('citations')
+    spool.clear('citations')
+    assert spool.tables() == []
+    assert len(merged(spool, 'citations')) == 0
+    assert spool.checksum('citations') != checksum
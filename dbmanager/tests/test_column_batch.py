@@ -0,0 +1,150 @@
+"""
+Tests of the spool files written by ColumnBatch.tsv, which must be
+byte-for-byte equal to those written by bulk_dm_sql.write_tsv from the
+same rows
+
+bulk_dm_sql requires MySQLdb and the BaseDMsql submodule, so the batches
+are compared with expected_tsv, which follows the format of LOAD DATA,
+and expected_tsv is compared with write_tsv when bulk_dm_sql can be
+imported
+
+"""
+
+import io
+import pickle
+import numpy as np
+import pytest
+
+from dbmanager.column_batch import ColumnBatch
+
+
+#Characters escaped with a backslash in the fields of a spool file
+_escape_table = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n',
+                               '\r': '\\r', '\0': '\\0'})
+
+columns = ['paperID', 'title', 'year', 'isDBLP', 'doi']
+dtypes = {'paperID': np.int64, 'year': np.int32, 'isDBLP': np.int8}
+
+
+def expected_tsv(rows):
+    """Returns the spool file for LOAD DATA with a list of rows: fields
+    separated by tabs, lines ended by newlines, special characters escaped
+    with a backslash and NULL values represented as \\N
+    """
+    def field(value):
+        if value is None:
+            return '\\N'
+        elif isinstance(value, str):
+            return value.translate(_escape_table)
+        return str(int(value))
+
+    return ''.join(['\t'.join([field(el) for el in row]) + '\n'
+                    for row in rows]).encode('utf8')
+
+
+def sample_rows():
+    """Rows with special characters, non-ASCII text, empty strings and
+    NULL values in numeric and string columns
+    """
+    return [
+        (1, 'Plain title', 1990, 1, '10.1000/1'),
+        (2, 'Tab\there, newline\nthere', 2001, 0, ''),
+        (3, 'Back\\slash \\N and \r\n and \0', None, 1, None),
+        (4, '', 0, 0, 'doi\t'),
+        (5, None, 2020, None, '\\'),
+        (2**40, 'Ñandú, 数据, émigré 🙂', 1850, 1, '\n'),
+        (-7, '\t\t\n\\', 9999, 0, 'x'),
+        ]
+
+
+def random_rows(nrows, seed):
+    """Random rows, with about 10% of NULL values in each column"""
+    rng = np.random.default_rng(seed)
+    alphabet = list('ab \\\t\n\r\0éñ数')
+
+    def maybe(value):
+        return None if rng.random() < 0.1 else value
+
+    return [(maybe(int(rng.integers(-2**40, 2**40))),
+             maybe(''.join(rng.choice(alphabet, size=int(rng.integers(0, 12))))),
+             maybe(int(rng.integers(0, 2100))),
+             maybe(int(rng.integers(0, 2))),
+             maybe(''.join(rng.choice(alphabet, size=int(rng.integers(0, 4))))))
+            for el in range(nrows)]
+
+
+def make_batch(rows):
+    return ColumnBatch.from_lists(columns, [list(el) for el in zip(*rows)] if len(rows)
+                                  else [[] for el in columns], dtypes)
+
+
+@pytest.mark.parametrize('rows', [sample_rows(), random_rows(500, 0), random_rows(1, 1)])
+def test_tsv(rows):
+    assert make_batch(rows).tsv() == expected_tsv(rows)
+
+
+def test_tsv_columns():
+    rows = sample_rows()
+    selected = ['doi', 'paperID', 'title']
+    assert make_batch(rows).tsv(selected) == \
+        expected_tsv([(el[4], el[0], el[1]) for el in rows])
+
+
+def test_tsv_empty():
+    assert make_batch([]).tsv() == b''
+    assert make_batch(sample_rows())[3:3].tsv() == b''
+
+
+def test_tsv_without_nulls():
+    rows = [el for el in random_rows(200, 2) if None not in el]
+    batch = make_batch(rows)
+    assert all([batch.arrays(col)['valid'] is None for col in columns])
+    assert batch.tsv() == expected_tsv(rows)
+
+
+@pytest.mark.parametrize('start, stop', [(0, 7), (0, 1), (2, 5), (6, 7), (-3, None), (5, 100)])
+def test_tsv_slice(start, stop):
+    rows = sample_rows()
+    assert make_batch(rows)[start:stop].tsv() == expected_tsv(rows[start:stop])
+
+
+def test_tsv_concat():
+    parts = [sample_rows(), random_rows(50, 3), [], [el for el in random_rows(50, 4) if None not in el]]
+    batch = ColumnBatch.concat([make_batch(el) for el in parts])
+    assert batch.tsv() == expected_tsv([row for el in parts for row in el])
+
+    batch = ColumnBatch.concat([make_batch(parts[3]), make_batch(parts[0])])
+    assert batch.tsv() == expected_tsv(parts[3] + parts[0])
+
+
+def test_tsv_with_column():
+    rows = random_rows(100, 5)
+    batch = make_batch(rows)[10:60].with_column('venueID', np.arange(50), np.uint32, position=2)
+    assert batch.tsv() == expected_tsv([el[:2] + (idx,) + el[2:]
+                                        for idx, el in enumerate(rows[10:60])])
+
+
+def test_shared_memory():
+    rows = sample_rows() + random_rows(300, 6)
+    batch = make_batch(rows)
+    #SharedBatch objects are sent to other processes pickled
+    shared = pickle.loads(pickle.dumps(batch.share()))
+    assert len(shared) == len(rows)
+    attached = shared.attach()
+    assert attached.tsv() == expected_tsv(rows)
+    assert attached.rows() == batch.rows()
+
+
+def test_shared_memory_slice():
+    rows = random_rows(100, 7)
+    attached = make_batch(rows)[40:90].share().attach()
+    assert attached.tsv() == expected_tsv(rows[40:90])
+
+
+@pytest.mark.parametrize('rows', [sample_rows(), random_rows(200, 8)])
+def test_write_tsv(rows):
+    """expected_tsv describes the spool files of bulk_dm_sql.write_tsv"""
+    bulk_dm_sql = pytest.importorskip('dbmanager.bulk_dm_sql')
+    fout = io.StringIO(newline='\n')
+    bulk_dm_sql.write_tsv(fout, rows)
+    assert fout.getvalue().encode('utf8') == expected_tsv(rows)
@@ -10,6 +10,7 @@ Import FIS Database to MySQL DB
 
 import argparse
 import configparser
+import contextlib
 
 from dbmanager.FISmanager import FISmanager
 
@@ -54,6 +55,8 @@ def main(download=False, resetDB=False, importData=False,
     #
     data_folder = cf.get('FIS', 'download_folder')
     ttsleep = int(cf.get('FIS', 'ttsleep'))
+    load_tables = [el.strip() for el in cf.get('FIS', 'load_data_tables', fallback='').split(',') if el.strip()]
+    bulk_session = cf.get('FIS', 'bulk_session', fallback='False') == 'True'
 
     ####################################################
     #1. Data download
@@ -149,11 +152,12 @@ def main(download=False, resetDB=False, importData=False,
             print('socket')
             DB = FISmanager (db_name=dbNAME, db_connector=dbCONNECTOR, path2db=None,
                         db_server=dbSERVER, db_user=dbUSER, db_password=dbPASS,
-                        unix_socket=dbSOCKET)
+                        unix_socket=dbSOCKET, load_tables=load_tables)
         else:
             print('tcp')
             DB = FISmanager (db_name=dbNAME, db_connector=dbCONNECTOR, path2db=None,
-                        db_server=dbSERVER, db_user=dbUSER, db_password=dbPASS)
+                        db_server=dbSERVER, db_user=dbUSER, db_password=dbPASS,
+                        load_tables=load_tables)
 
     ####################################################
     #3. If activated, remove and create again database tables
@@ -168,7 +172,9 @@ def main(download=False, resetDB=False, importData=False,
     # 4. If activated project information will be inserted in the table
     if importData:
         print('Importing projects data ...')
-        DB.importData(data_folder)
+        #See BulkDMsql.bulkSession
+        with DB.bulkSession() if bulk_session else contextlib.nullcontext():
+            DB.importData(data_folder)
 
 
 
@@ -5,13 +5,17 @@ Import Semantic Scholar Database to MySQL DB
 
 """
 
+import os
 import argparse
+import contextlib
 import configparser
 import ipdb
 import time
 import re
 
 from dbmanager.S2manager import S2manager
+from dbmanager.S2reader import list_S2files, set_decoder, select_decoder, \
+                               set_gzip_backend, get_gzip_backend, set_filter
 #from lemmatizer.ENlemmatizer import ENLemmatizer
 
 try:
@@ -26,8 +30,9 @@ def clean_utf8(rawdata):
     return regex.sub(' ', rawdata)
 
 
-def main(resetDB=False, importPapers=False, importCitations=False, importFields=False,
-		importAuthors=False, importEntities=False, lemmatize=False, lemmas_query=None):
+def main(resetDB=False, importAll=False, importDelta=False, importPapers=False, importCitations=False, importFields=False,
+		importAuthors=False, importEntities=False, loadParquet=False, migrateSchema=False,
+		rebuildPartition=None, truncatePartition=None, lemmatize=False, lemmas_query=None):
     """
     """
 
@@ -45,11 +50,50 @@ def main(resetDB=False, importPapers=False, importCitations=False, importFields=
     dbNAME = cf.get('S2', 'dbNAME')
     ncpu = int(cf.get('S2', 'ncpu'))
     chunksize = int(cf.get('S2', 'chunksize'))
+    index_file = cf.get('S2', 'index_file', fallback='S2index')
+    assignIDs = cf.get('S2', 'assign_ids', fallback='False') == 'True'
+    load_tables = [el.strip() for el in cf.get('S2', 'load_data_tables', fallback='').split(',') if el.strip()]
+    spool_dir = cf.get('S2', 'spool_dir', fallback='') or None
+    writers = int(cf.get('S2', 'writers', fallback='1'))
+    pool_size = int(cf.get('S2', 'pool_size', fallback='4'))
+    adaptive_batches = cf.get('S2', 'adaptive_batches', fallback='False') == 'True'
+    bulk_session = cf.get('S2', 'bulk_session', fallback='False') == 'True'
+    commit_rows = int(cf.get('S2', 'commit_rows', fallback='0'))
+    commit_bytes = int(cf.get('S2', 'commit_bytes', fallback='0'))
+    worker_writes = cf.get('S2', 'worker_writes', fallback='False') == 'True'
+    block_size = int(cf.get('S2', 'block_size', fallback='0'))
+    json_decoder = cf.get('S2', 'json_decoder', fallback='auto')
+    gzip_backend = cf.get('S2', 'gzip_backend', fallback='auto')
+    filter_sources = [el.strip() for el in cf.get('S2', 'filter_sources', fallback='').split(',') if el.strip()]
+    filter_years = [int(el) if el.strip() else None
+                    for el in (cf.get('S2', 'filter_years', fallback='') or '-').split('-')]
+    filter_fields = [el.strip() for el in cf.get('S2', 'filter_fields', fallback='').split(',') if el.strip()]
+    filter_has_abstract = cf.get('S2', 'filter_has_abstract', fallback='False') == 'True'
+    skip_fields = [el.strip() for el in cf.get('S2', 'skip_fields', fallback='').split(',') if el.strip()]
+    parquet_dir = cf.get('S2', 'parquet_dir', fallback='') or None
+    parquet_only = cf.get('S2', 'parquet_only', fallback='False') == 'True'
+    shared_memory = cf.get('S2', 'shared_memory', fallback='False') == 'True'
+    sort_dir = cf.get('S2', 'sort_dir', fallback='') or None
+    sort_run_rows = int(cf.get('S2', 'sort_run_rows', fallback=str(1<<22)))
+    schema_profile = cf.get('S2', 'schema_profile', fallback='default')
+    partition_years = [int(el) for el in cf.get('S2', 'partition_years', fallback='').split(',') if el.strip()]
+    partition_ids = int(cf.get('S2', 'partition_ids', fallback='0'))
 
     #########################
     # Datafiles
     #
     data_files = cf.get('S2', 'data_files')
+    # Decompression backend and JSON decoder used for reading the data files
+    if gzip_backend != 'auto':
+        set_gzip_backend(gzip_backend)
+    print('Gzip backend:', get_gzip_backend())
+    # Only papers satisfying the filter are imported
+    set_filter(sources=filter_sources, years=tuple(filter_years), fields=filter_fields,
+               has_abstract=filter_has_abstract, skip_fields=skip_fields)
+    if json_decoder != 'auto':
+        set_decoder(json_decoder)
+    elif os.path.isdir(data_files) and len(list_S2files(data_files)):
+        print('JSON decoder:', select_decoder(list_S2files(data_files)[0]))
 
     ####################################################
     #1. Database connection
@@ -58,11 +102,31 @@ def main(resetDB=False, importPapers=False, importCitations=False, importFields=
         print('socket')
         DB = S2manager (db_name=dbNAME, db_connector=dbCONNECTOR, path2db=None,
                     db_server=dbSERVER, db_user=dbUSER, db_password=dbPASS,
-                    unix_socket=dbSOCKET)
+                    unix_socket=dbSOCKET, index_file=index_file,
+                    load_tables=load_tables, spool_dir=spool_dir, writers=writers,
+                    pool_size=pool_size, worker_writes=worker_writes, block_size=block_size,
+                    parquet_dir=parquet_dir, parquet_only=parquet_only,
+                    shared_memory=shared_memory, adaptive_batches=adaptive_batches,
+                    sort_dir=sort_dir, sort_run_rows=sort_run_rows,
+                    schema_profile=schema_profile, partition_years=partition_years,
+                    partition_ids=partition_ids)
     else:
         print('tcp')
         DB = S2manager (db_name=dbNAME, db_connector=dbCONNECTOR, path2db=None,
-                    db_server=dbSERVER, db_user=dbUSER, db_password=dbPASS)
+                    db_server=dbSERVER, db_user=dbUSER, db_password=dbPASS,
+                    index_file=index_file, load_tables=load_tables, spool_dir=spool_dir,
+                    writers=writers, pool_size=pool_size, worker_writes=worker_writes,
+                    block_size=block_size, parquet_dir=parquet_dir, parquet_only=parquet_only,
+                    shared_memory=shared_memory, adaptive_batches=adaptive_batches,
+                    sort_dir=sort_dir, sort_run_rows=sort_run_rows,
+                    schema_profile=schema_profile, partition_years=partition_years,
+                    partition_ids=partition_ids)
+
+    def bulk_stage():
+        """Session for an import stage (see BulkDMsql.bulkSession)"""
+        if bulk_session:
+            return DB.bulkSession(commit_rows, commit_bytes)
+        return contextlib.nullcontext()
 
     ####################################################
     #2. If activated, remove and create again database tables
@@ -72,27 +136,68 @@ def main(resetDB=False, importPapers=False, importCitations=False, importFields=
         # again without data.
         DB.deleteDBtables()
         DB.createDBschema()
+        # Tables are created without secondary indices and foreign keys,
+        # which are built after the data has been imported. Until then
+        # unique and foreign key checks are disabled
+        DB.setChecks(False)
+
+    ####################################################
+    # 2a. If activated, tables created with the default schema profile
+    # are converted to the profile selected in the configuration file
+    if migrateSchema:
+        print('Converting tables to the', schema_profile, 'schema profile ...')
+        with bulk_stage():
+            DB.migrateSchema()
+
+    ####################################################
+    # 2b. If activated, a single partition of a partitioned table
+    # (given as table.partition, e.g. citations.p0) is rebuilt or emptied
+    if rebuildPartition:
+        print('Rebuilding partition', rebuildPartition, '...')
+        DB.rebuildPartition(*rebuildPartition.split('.', 1))
+    if truncatePartition:
+        print('Removing the rows of partition', truncatePartition, '...')
+        DB.truncatePartition(*truncatePartition.split('.', 1))
+
+    ####################################################
+    # 2c. If activated, all data will be imported from S2 data files
+    # reading each data file only once
+    if importAll:
+        print('Importing all data in a single pass ...')
+        with bulk_stage():
+            DB.importAll(data_files, ncpu, chunksize, assignIDs)
+
+    ####################################################
+    # 2d. If activated, the database will be updated with a new
+    # release of the S2 data files
+    if importDelta:
+        print('Updating the database with a new corpus release ...')
+        with bulk_stage():
+            DB.importDelta(data_files, ncpu, chunksize)
 
     ####################################################
     # 3. If activated, authors and papers data
     # will be imported from S2 data files
     if importPapers:
         print('Importing papers data ...')
-        DB.importPapers(data_files, ncpu, chunksize)
+        with bulk_stage():
+            DB.importPapers(data_files, ncpu, chunksize, assignIDs)
 
     ####################################################
     # 4. If activated, citations data
     # will be imported from S2 data files
     if importCitations:
         print('Importing citations data ...')
-        DB.importCitations(data_files, chunksize)
+        with bulk_stage():
+            DB.importCitations(data_files, ncpu, chunksize)
 
     ####################################################
     # 5. If activated, journals, volumes, and Fields of Study data
     # will be imported from S2 data files
     if importFields:
         print('Importing journal, volume and Fields of Study data ...')
-        DB.importFields(data_files, chunksize)
+        with bulk_stage():
+            DB.importFields(data_files, ncpu, chunksize)
 
 
 
@@ -103,14 +208,33 @@ def main(resetDB=False, importPapers=False, importCitations=False, importFields=
     # will be imported from S2 data files
     if importAuthors:
         print('Importing authorship data ...')
-        DB.importAuthors(data_files)
+        with bulk_stage():
+            DB.importAuthors(data_files, ncpu, chunksize)
 
     ####################################################
     # 6. If activated, entities associated to each paper
     # will be imported from S2 data files
     if importEntities:
         print('Importing entities associated to each paper ...')
-        DB.importEntities(data_files)
+        with bulk_stage():
+            DB.importEntities(data_files, ncpu, chunksize)
+
+    ####################################################
+    # 6a. If activated, tables will be filled in from the Parquet
+    # files written by a previous import
+    if loadParquet:
+        print('Loading data from Parquet files ...')
+        with bulk_stage():
+            DB.loadParquet(chunksize)
+
+    ####################################################
+    # 6b. Indices and foreign keys are built once the papers have been
+    # imported (including imports resumed without resetDB). Existing
+    # indices are not built again
+    if importAll or importPapers or loadParquet or migrateSchema:
+        print('Creating indices and foreign keys ...')
+        DB.createDBindices(max(1, ncpu))
+        DB.setChecks(True)
 
     ####################################################
     # 7. If activated, will carry out lemmas extraction for the
@@ -131,43 +255,53 @@ def main(resetDB=False, importPapers=False, importCitations=False, importFields=
         keepSentence = cf.get('Lemmatizer', 'keepSentence') == 'True'
 
         #Initialize lemmatizer
+        from lemmatizer.ENlemmatizer import ENLemmatizer
         ENLM = ENLemmatizer(lemmas_server=lemmas_server, stw_file=stw_file,
                     dict_eq_file=dict_eq_file, POS=POS, removenumbers=removenumbers,
                     keepSentence=keepSentence)
         selectOptions = 'paperID, title, paperAbstract'
+
+        #The progress is recorded in the import manifest, so that an
+        #interrupted lemmatization continues after the last paper lemmatized
+        #with the same query. Completed lemmatizations are run again
+        lemmas_source = lemmas_query or 'all'
+        entry = DB.readManifest('lemmatize').get(lemmas_source[:255])
+        if entry is not None and entry['status'] == 'started':
+            largest_id = entry['lastID'] or 0
+            cont = entry['nrows'] or 0
+            print('Resuming lemmatization after paperID', largest_id)
+        else:
+            largest_id = 0
         if lemmas_query:
-            filterOptions = 'paperID>0 AND ' + lemmas_query
+            filterOptions = 'paperID>' + str(largest_id) + ' AND ' + lemmas_query
         else:
-            filterOptions = 'paperID>0'
+            filterOptions = 'paperID>' + str(largest_id)
         init_time = time.time()
-        df = DB.readDBtable('S2papers', limit=chunksize, selectOptions=selectOptions,
-                 filterOptions = filterOptions, orderOptions='paperID ASC')
-        while (len(df)):
-            cont = cont+len(df)
-            
-            #Next time, we will read from the largest paperID. This is the
-            #last element of the dataframe, given that we requested an ordered df
-            largest_id = df['paperID'][len(df)-1]
+        #Papers are read in a single query, streamed through a server-side
+        #cursor in batches of chunksize papers ordered by paperID
+        for rows in DB.streamTable('S2papers', selectOptions=selectOptions,
+                                   filterOptions=filterOptions, orderOptions='paperID ASC',
+                                   batchsize=chunksize):
+            cont = cont+len(rows)
+
+            #If the lemmatization is interrupted, it will continue from the
+            #largest paperID of the last batch, given that rows are ordered
+            largest_id = int(rows[-1][0])
             print('Number of articles processed:', cont)
             print('Last Article Id read:', largest_id)
 
-            df['alltext'] = df['title'] + '. ' + df['paperAbstract']
-            df['alltext'] = df['alltext'].apply(clean_utf8)
-            lemasBatch = ENLM.lemmatizeBatch(df[['paperID', 'alltext']].values.tolist(),
-                                                processes=concurrent_posts)
+            lemasBatch = ENLM.lemmatizeBatch([[el[0], clean_utf8(el[1] + '. ' + el[2])]
+                                              for el in rows], processes=concurrent_posts)
             #Remove entries that where not lemmatized correctly
             lemasBatch = [[el[0], clean_utf8(el[1])] for el in lemasBatch if len(el[1])]
             print('Successful lemmatized documents:', len(lemasBatch))
             DB.setField('S2papers', 'paperID', ['LEMAS'], lemasBatch)
-            if lemmas_query:
-                filterOptions = 'paperID>' + str(largest_id) + ' AND ' + lemmas_query
-            else:
-                filterOptions = 'paperID>' + str(largest_id)
-            df = DB.readDBtable('S2papers', limit=chunksize, selectOptions=selectOptions,
-                 filterOptions = filterOptions, orderOptions='paperID ASC')
+            DB.setManifest('lemmatize', lemmas_source[:255], 'started', nrows=cont, lastID=largest_id)
             elapsed_time = time.time() - init_time
             print('Elapsed Time (seconds):', time.strftime("%H:%M:%S", time.gmtime(elapsed_time)))
 
+        DB.setManifest('lemmatize', lemmas_source[:255], 'done', nrows=cont, lastID=largest_id)
+
     return
 
 
@@ -175,16 +309,24 @@ if __name__ == "__main__":
 
     parser = argparse.ArgumentParser(prog='importS2')    
     parser.add_argument('--resetDB', action='store_true', help='If activated, the database will be reset and re-created')
+    parser.add_argument('--importAll', action='store_true', help='If activated, import papers, citations, fields, authorship and entities in a single pass')
+    parser.add_argument('--importDelta', action='store_true', help='If activated, update the database with a new release of the data files')
     parser.add_argument('--importPapers', action='store_true', help='If activated, import author and paper data')
     parser.add_argument('--importCitations', action='store_true', help='If activated, import citation data')
     parser.add_argument('--importFields', action='store_true', help='If activated, import journals, volumes, fields data')
     parser.add_argument('--importAuthors', action='store_true', help='If activated, import authorship data')
     parser.add_argument('--importEntities', action='store_true', help='If activated, import entities data')
+    parser.add_argument('--loadParquet', action='store_true', help='If activated, fill in the database from the Parquet files in parquet_dir')
+    parser.add_argument('--migrateSchema', action='store_true', help='If activated, convert the tables to the schema profile in the configuration file')
+    parser.add_argument('--rebuildPartition', type=str, dest='rebuildPartition', help='Partition to rebuild, as table.partition (e.g., citations.p0)')
+    parser.add_argument('--truncatePartition', type=str, dest='truncatePartition', help='Partition whose rows will be removed, as table.partition (e.g., S2papers.p2020)')
     parser.add_argument('--lemmatize', action='store_true', help='If activated, lemmatize database')
     parser.add_argument('--lemmas_query', type=str, dest='lemmas_query', help='Query for DB elements to lemmatize')
     parser.set_defaults(lemmas_query=None)
     args = parser.parse_args()
 
-    main(resetDB=args.resetDB, importPapers=args.importPapers, importCitations=args.importCitations, 
+    main(resetDB=args.resetDB, importAll=args.importAll, importDelta=args.importDelta, importPapers=args.importPapers, importCitations=args.importCitations, 
     	 importFields=args.importFields, importAuthors=args.importAuthors, importEntities=args.importEntities,
+         loadParquet=args.loadParquet, migrateSchema=args.migrateSchema,
+         rebuildPartition=args.rebuildPartition, truncatePartition=args.truncatePartition,
          lemmatize=args.lemmatize, lemmas_query=args.lemmas_query)